@@ -1,20 +1,69 @@
+import time
+# Start of the module import, startup phases are measured from here
+_IMPORT_START_TIME = time.perf_counter()
+
 import logging
 import os
-from typing import Annotated, Optional
+import functools
+import getpass
 import json
-import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import vtk
 import qt
 import slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
-from slicer.parameterNodeWrapper import (
-    parameterNodeWrapper,
-    WithinRange,
-)
 
 from slicer import vtkMRMLScalarVolumeNode
 
+from showImageReportsLib import CasePrefetcher, CaseWorklist, LoadedCase, VolumeCache, VolumeNodePool, readNifti
+from showImageReportsLib.Reports import (
+    DEFAULT_REPORT_COLUMNS,
+    GROUND_TRUTH_COLUMN,
+    ReportCorpora,
+    loadReportColumns,
+    readReportsFile,
+    reportTexts,
+    textHash,
+)
+from showImageReportsLib.VolumeCache import DEFAULT_CACHE_SIZE
+from showImageReportsLib.Compact import (
+    DISPLAY_LOAD_MODE,
+    LOAD_MODES,
+    NATIVE_LOAD_MODE,
+    compactVolume,
+    volumeForegroundBox,
+)
+from showImageReportsLib.Ingest import MANIFEST_FILE_NAME, DatasetManifest
+from showImageReportsLib.DatasetIndex import INDEX_FILE_NAME, DatasetIndex
+from showImageReportsLib.FileUtils import fileContentHash
+from showImageReportsLib.Pyramid import DEFAULT_PREVIEW_LEVEL
+from showImageReportsLib.ScoreStore import ScoreStore
+from showImageReportsLib.Timing import PhaseTimings, residentBytes
+from showImageReportsLib.Terms import (
+    DEFAULT_TERM_VOCABULARY,
+    TermAutomaton,
+    TermHitCache,
+    highlightHtml,
+    legendHtml,
+    loadTermVocabulary,
+    precomputeHits,
+    vocabularyHash,
+)
+from showImageReportsLib.Scores import CRITERIA, MAX_SCORE, MIN_SCORE, MODELS, UNRATED, ScoreGrid, parseScore
+from showImageReportsLib.VolumePool import DEFAULT_MEMORY_BUDGET
+from showImageReportsLib.Windowing import PRESET_NAMES, windowPresets
+from showImageReportsLib.Thumbnails import ATLAS_FILE_NAME, ThumbnailAtlas, pgmBytes
+from showImageReportsLib.Telemetry import EDIT_EVENT, INTERACTION_EVENT, LOAD_EVENT, SAVE_EVENT, EventLog, caseSessions
+from showImageReportsLib.Scheduling import CaseScheduler, metricDivergence
+
+AUTOSAVE_DELAY_MS = 1500
+# Cases per page of the overview panel
+OVERVIEW_PAGE_SIZE = 48
+
+# Durations in seconds of the startup phases that run before the widget and its logic exist
+_startupSeconds = {}
 
 #
 # showImageReports
@@ -26,6 +75,7 @@ class showImageReports(ScriptedLoadableModule):
     """
 
     def __init__(self, parent):
+        initStartTime = time.perf_counter()
         ScriptedLoadableModule.__init__(self, parent)
         self.parent.title = "showImageReports"  # TODO: make this more human readable by adding spaces
         self.parent.categories = ["Examples"]  # TODO: set categories (folders where the module shows up in the module selector)
@@ -42,8 +92,9 @@ class showImageReports(ScriptedLoadableModule):
             and Steve Pieper, Isomics, Inc. and was partially funded by NIH grant 3P41RR013218-12S1.
             """
 
-        # Additional initialization step after application startup is complete
-        slicer.app.connect("startupCompleted()", registerSampleData)
+        # Sample data is not registered at startup: it is only used by the module test (which calls
+        # registerSampleData) and importing SampleData would slow down every Slicer launch
+        _startupSeconds["moduleInit"] = time.perf_counter() - initStartTime
 
 
 #
@@ -100,22 +151,30 @@ def registerSampleData():
 # showImageReportsParameterNode
 #
 
-@parameterNodeWrapper
-class showImageReportsParameterNode:
-    """
-    The parameters needed by module.
+@functools.lru_cache(maxsize=None)
+def parameterNodeClass():
+    """Parameter node wrapper class, created on first use so that the wrapper machinery is not imported at startup."""
+    from typing import Annotated
+    from slicer.parameterNodeWrapper import parameterNodeWrapper, WithinRange
 
-    inputVolume - The volume to threshold.
-    imageThreshold - The value at which to threshold the input volume.
-    invertThreshold - If true, will invert the threshold.
-    thresholdedVolume - The output volume that will contain the thresholded volume.
-    invertedVolume - The output volume that will contain the inverted thresholded volume.
-    """
-    inputVolume: vtkMRMLScalarVolumeNode
-    imageThreshold: Annotated[float, WithinRange(-100, 500)] = 100
-    invertThreshold: bool = False
-    thresholdedVolume: vtkMRMLScalarVolumeNode
-    invertedVolume: vtkMRMLScalarVolumeNode
+    @parameterNodeWrapper
+    class showImageReportsParameterNode:
+        """
+        The parameters needed by module.
+
+        inputVolume - The volume to threshold.
+        imageThreshold - The value at which to threshold the input volume.
+        invertThreshold - If true, will invert the threshold.
+        thresholdedVolume - The output volume that will contain the thresholded volume.
+        invertedVolume - The output volume that will contain the inverted thresholded volume.
+        """
+        inputVolume: vtkMRMLScalarVolumeNode
+        imageThreshold: Annotated[float, WithinRange(-100, 500)] = 100
+        invertThreshold: bool = False
+        thresholdedVolume: vtkMRMLScalarVolumeNode
+        invertedVolume: vtkMRMLScalarVolumeNode
+
+    return showImageReportsParameterNode
 
 
 #
@@ -137,6 +196,7 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self._parameterNode = None
         self._parameterNodeGuiTag = None
         self.save_score_path = None
+        self.save_res_path = None
         self.text_cn_en = [
             0, {
                 0:{
@@ -150,16 +210,48 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
                 }
             ]
         self.origin_report = [0, None]
+        self.timings_ui = None
+        # Overview panel, loaded when it is first expanded, showing thumbnails of the dataset at overview_root
+        self.overview_ui = None
+        self.overview_root = None
+        self.overview_page = 0
+        # False until the rater first edits a score of the shown case
+        self.case_interacted = False
+        # Whether Save also writes the legacy human.json next to the image
+        self.write_legacy_files = False
+        # Window/level presets of the shown volume, switched with the preset combo box or Alt+1..Alt+4
+        self.shown_volume_node = None
+        self.window_presets = []
+        self.window_preset_name = PRESET_NAMES[0]
+        self.window_shortcuts = []
+        # Polls for the full-resolution volume while a preview is shown
+        self.preview_timer = qt.QTimer()
+        self.preview_timer.setInterval(50)
+        self.preview_case_index = None
+        # Image opened outside the worklist and the future of its volume, while its preview is shown
+        self.preview_image_path = None
+        self.preview_future = None
+        # Scores of the shown case, bound to the score fields in setup. Changed cells are autosaved
+        # once no score was edited for AUTOSAVE_DELAY_MS.
+        self.score_grid = ScoreGrid()
+        self.score_fields = {}
+        self.score_case = None
+        self.invalid_score_cells = set()
+        self.autosave_timer = qt.QTimer()
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.setInterval(AUTOSAVE_DELAY_MS)
 
     def setup(self) -> None:
         """
         Called when the user opens the module the first time and the widget is initialized.
         """
+        setupStartTime = time.perf_counter()
         ScriptedLoadableModuleWidget.setup(self)
 
         # Load widget from .ui file (created by Qt Designer).
         # Additional widgets can be instantiated manually and added to self.layout.
         uiWidget = slicer.util.loadUI(self.resourcePath('UI/showImageReports.ui'))
+        loadUISeconds = time.perf_counter() - setupStartTime
         self.layout.addWidget(uiWidget)
         self.ui = slicer.util.childWidgetVariables(uiWidget)
 
@@ -183,21 +275,109 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.saveButton.connect('clicked(bool)', self.onApplySaveButton )
         self.ui.trans_lang.connect('clicked(bool)', self.onApplyTransButton )
         self.ui.show_origin_reports.connect('clicked(bool)', self.onShowOriginButton )
-        # Make sure parameter node is initialized (needed for module reload)
-        self.initializeParameterNode()
+        self.ui.windowPresetComboBox.connect('activated(int)', self.onWindowPresetActivated)
+        for number, preset_name in enumerate(PRESET_NAMES, start=1):
+            shortcut = qt.QShortcut(qt.QKeySequence(f"Alt+{number}"), slicer.util.mainWindow())
+            shortcut.connect('activated()', lambda preset_name=preset_name: self.selectWindowPreset(preset_name))
+            self.window_shortcuts.append(shortcut)
+        self.ui.openDatasetButton.connect('clicked(bool)', self.onOpenDatasetButton)
+        self.preview_timer.connect('timeout()', self.onPreviewTimer)
+        self.ui.previousCaseButton.connect('clicked(bool)', self.onPreviousCaseButton)
+        self.ui.nextCaseButton.connect('clicked(bool)', self.onNextCaseButton)
+        self.ui.memoryBudgetSpinBox.value = DEFAULT_MEMORY_BUDGET // (1024 * 1024)
+        self.ui.memoryBudgetSpinBox.connect('valueChanged(int)', self.onMemoryBudgetChanged)
+
+        # Decompressed volume cache, shared across sessions
+        settings = qt.QSettings()
+        cacheDir = settings.value("showImageReports/VolumeCacheDirectory", os.path.join(slicer.app.cachePath, "showImageReports"))
+        cacheSizeGB = float(settings.value("showImageReports/VolumeCacheSizeGB", DEFAULT_CACHE_SIZE / 1024 ** 3))
+        self.logic.setVolumeCache(cacheDir, int(cacheSizeGB * 1024 ** 3))
+
+        # Ratings of all raters are kept in one local score store
+        storePath = settings.value("showImageReports/ScoreStorePath",
+                                   os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath), "showImageReports", "scores.sqlite"))
+        self.logic.setScoreStore(storePath)
+        # Per-case rating times, for throughput and the adaptive case order
+        self.logic.setEventLog(settings.value("showImageReports/TelemetryDirectory",
+                                              os.path.join(os.path.dirname(storePath), "telemetry")))
+        self.ui.adaptiveOrderCheckBox.checked = settings.value("showImageReports/AdaptiveOrder", "false") == "true"
+        self.ui.adaptiveOrderCheckBox.connect('toggled(bool)', self.onAdaptiveOrderToggled)
+        # The legacy human.json of a case folder holds the scores of one rater only, so it is opt-in
+        self.write_legacy_files = settings.value("showImageReports/WriteLegacyFiles", "false") == "true"
+        # Optionally saved ratings are also submitted to a collection server
+        collectionServerUrl = settings.value("showImageReports/CollectionServerUrl", "")
+        if collectionServerUrl:
+            self.logic.setCollectionServer(collectionServerUrl, settings.value(
+                "showImageReports/SubmissionSpoolPath", os.path.join(os.path.dirname(storePath), "submissionSpool.sqlite")))
+        self.window_preset_name = settings.value("showImageReports/WindowPreset", PRESET_NAMES[0])
+        self.logic.windowPresetName = self.window_preset_name
+        self.logic.setLoadMode(settings.value("showImageReports/LoadMode", NATIVE_LOAD_MODE))
+        self.ui.raterLineEdit.text = settings.value("showImageReports/RaterName", getpass.getuser())
+        self.ui.raterLineEdit.connect('textChanged(QString)', self.onRaterChanged)
+        self.ui.raterLineEdit.connect('editingFinished()', self.onRaterEditingFinished)
+
+        # Score fields are looked up once and edits go straight into the score grid
+        for model in MODELS:
+            for criterion in CRITERIA:
+                field = getattr(self.ui, f"{model}_{criterion}")
+                field.connect('textChanged()', lambda model=model, criterion=criterion: self.onScoreEdited(model, criterion))
+                self.score_fields[(model, criterion)] = field
+        self.autosave_timer.connect('timeout()', self.flushScores)
+
+        # Report sources
+        reportColumnsFile = settings.value("showImageReports/ReportColumnsFile", "")
+        if reportColumnsFile:
+            self.logic.setReportColumns(loadReportColumns(reportColumnsFile))
+        self.ui.reportCorpusButton.connect('clicked(bool)', self.onReportCorpusButton)
+
+        # Radiology terms highlighted in the reports, hits are cached by report text
+        termVocabularyFile = settings.value("showImageReports/TermVocabularyFile", "")
+        if termVocabularyFile:
+            self.logic.setTermVocabulary(loadTermVocabulary(termVocabularyFile))
+        self.logic.setTermHitCache(settings.value("showImageReports/TermHitCacheFile", os.path.join(cacheDir, "termHits.sqlite")))
+        self.updateTermLegend()
+
+        # Overview and Timings, the panels themselves are only loaded when they are first expanded
+        self.ui.overviewCollapsibleButton.connect('contentsCollapsed(bool)', self.onOverviewCollapsed)
+        self.ui.timingsCollapsibleButton.connect('contentsCollapsed(bool)', self.onTimingsCollapsed)
+        self.setReportCorpora(self.settingsList(settings.value("showImageReports/ReportCorpusFiles", [])))
+        # Make sure parameter node is initialized (needed for module reload), after the rating screen is shown
+        qt.QTimer.singleShot(0, self.initializeParameterNode)
+
+        # Startup phases. The module is interactive once the event loop runs again after setup.
+        for phase, seconds in _startupSeconds.items():
+            self.logic.timings.record(phase, seconds)
+        self.logic.timings.record("loadUI", loadUISeconds)
+        self.logic.timings.record("widgetSetup", time.perf_counter() - setupStartTime)
+        qt.QTimer.singleShot(0, lambda: self.logic.timings.record("interactive", time.perf_counter() - setupStartTime))
 
     def cleanup(self) -> None:
         """
         Called when the application closes and the module widget is destroyed.
         """
         self.removeObservers()
+        self.preview_timer.stop()
+        self.flushScores()
+        for shortcut in self.window_shortcuts:
+            shortcut.setParent(None)
+        self.window_shortcuts = []
+        if self.logic:
+            self.logic.closeWorklist()
+            self.logic.setVolumeCache(None)
+            self.logic.setScoreStore(None)
+            self.logic.setEventLog(None)
+            self.logic.setCollectionServer(None)
+            self.logic.setReportCorpora(None)
+            self.logic.setTermHitCache(None)
+            self.logic.closeThumbnailAtlas()
 
     def enter(self) -> None:
         """
         Called each time the user opens this module.
         """
-        # Make sure parameter node exists and observed
-        self.initializeParameterNode()
+        # Make sure parameter node exists and observed. It only drives the input volume selector, so it is
+        # set up after the rating screen is shown.
+        qt.QTimer.singleShot(0, self.initializeParameterNode)
 
     def exit(self) -> None:
         """
@@ -220,6 +400,8 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         """
         Called just after the scene is closed.
         """
+        # Pooled volume nodes were removed together with the scene
+        self.logic.volumePool.clear()
         # If this module is shown while the scene is closed then recreate a new parameter node immediately
         if self.parent.isEntered:
             self.initializeParameterNode()
@@ -230,6 +412,9 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         """
         # Parameter node stores all user choices in parameter values, node selections, etc.
         # so that when the scene is saved and reloaded, these settings are restored.
+        if self.logic is None:
+            # The widget was cleaned up before the deferred call ran
+            return
 
         self.setParameterNode(self.logic.getParameterNode())
 
@@ -239,9 +424,9 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             if firstVolumeNode:
                 self._parameterNode.inputVolume = firstVolumeNode
 
-    def setParameterNode(self, inputParameterNode: Optional[showImageReportsParameterNode]) -> None:
+    def setParameterNode(self, inputParameterNode) -> None:
         """
-        Set and observe parameter node.
+        Set and observe parameter node (an instance of ``parameterNodeClass()`` or None).
         Observation is needed because when the parameter node is changed then the GUI must be updated immediately.
         """
 
@@ -283,7 +468,7 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def onShowOriginButton(self ) -> None:
         if self.origin_report[1] != None:
             if self.origin_report[0] == 0:
-                self.ui.rawReport.setText(self.origin_report[1])
+                self.ui.rawReport.setHtml(self.origin_report[1])
                 self.origin_report[0] = 1
             elif self.origin_report[0] == 1:
                 self.ui.rawReport.setText("")
@@ -298,39 +483,37 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         """选择文件路径并加载影像"""
         file_path = qt.QFileDialog.getOpenFileName(None, "Select NIfTI File", "", "NIfTI Files (*.nii *.nii.gz)")
         print(file_path)
+        if file_path:
+            self.openImage(file_path)
+
+    def openImage(self, file_path) -> None:
+        """Load a case by its image path and show the saved scores of the rater."""
         self.save_score_path = os.path.dirname(file_path)
         self.save_res_path = file_path
-        if file_path:
-            self.loadImage(file_path)
-            self.reset_score()
+        self.loadImage(file_path)
+        if self.preview_future is not None:
+            # The case ID may need the content hash of the image, which the load thread computes with the
+            # full volume, so the scores are shown with it
+            self.flushScores()
+            self.score_case = None
+            self.score_grid.load()
+            self.updateScoreFields()
+        else:
+            self.restoreScores(file_path)
+        self.updatePoolStatus()
     
         
     def loadImage(self, file_path):
         """加载并显示影像"""
-        try:            
-            volume_node = slicer.util.loadVolume(file_path)
+        try:
+            if self.showImagePreview(file_path):
+                # The full-resolution volume replaces the preview once it is read
+                return
+            volume_node = self.logic.loadVolume(file_path)
             if volume_node:
-                displayNode = volume_node.GetDisplayNode()
-                displayNode.AutoWindowLevelOff()
-                # Set window/level for brain window (CT values)
-                displayNode.SetWindow(60)
-                displayNode.SetLevel(40)
-                
-                # Optionally, you can check if the changes were applied:
-                print("Window:", displayNode.GetWindow())
-                print("Level:", displayNode.GetLevel())
-
-                volume_node.SetName(os.path.basename(file_path))  # 设置文件名为节点名称
-                slicer.util.setSliceViewerLayers(background=volume_node)
+                self.showVolume(volume_node, file_path)
                 print(f"Volume {file_path} loaded successfully.")
-                with open(f"{os.path.dirname(file_path)}/reports.json", "r") as f:
-                    reports = json.load(f)
-                self.origin_report[1] = reports["gt"].split("：")[-1]
-                
-                self.ui.textBrowser_2.setText("Method1: "+ reports["minimed"])
-                self.ui.textBrowser_3.setText("Method2: "+ reports["gpt"])
-                self.ui.textBrowser_4.setText("Method3:  " + reports["radfm"])
-                self.ui.textBrowser_5.setText("Method4: " + reports["brainfound:"].split("：")[-1])               
+                self.showReports(self.logic.readReports(file_path))
 
             else:
                 print(f"Failed to load volume: {file_path}")
@@ -341,37 +524,474 @@ class showImageReportsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         except Exception as e:
             slicer.util.errorDisplay(f"Failed to load image: {str(e)}")
 
-    def reset_score(self)->None:
-        tmp = {"general":0, "complete":0, "pos":0, "num":0, "cls":0, "bian":0, "midu":0, "xing":0, "normal":0}
-        key = ["mini", "gpt4", "radfm", "bf"]
-        res ={k:tmp for k in key}
-        for key in res:
-            for item in res[key]:
-                attr = getattr(self.ui, f"{key}_{item}")
-                attr.setText("-1")
-        return
+    def showImagePreview(self, file_path) -> bool:
+        """Show the cached low-resolution preview and the reports of an image that is not loaded yet, and read
+        the full volume in the background. Returns False if there is no preview to show."""
+        self.preview_timer.stop()
+        self.preview_future = None
+        preview = self.logic.casePreview(file_path)
+        if preview is None or file_path in self.logic.volumePool:
+            return False
+        try:
+            reports = self.logic.readReports(file_path)
+        except Exception:
+            # Report the error when the full volume is loaded
+            return False
+        future = self.logic.readVolumeInBackground(file_path)
+        if future is None:
+            return False
+        preview_node = self.logic.previewVolumeNode(preview, os.path.basename(file_path) + " (preview)")
+        presets = self.logic.cachedWindowPresets(file_path) or windowPresets(preview.array)
+        self.showVolume(preview_node, file_path, preview_node.GetName(), presets)
+        self.showReports(reports)
+        self.preview_case_index = None
+        self.preview_image_path = file_path
+        self.preview_future = future
+        self.preview_timer.start()
+        return True
+
+    def showFullImage(self, file_path, future) -> None:
+        """Swap the preview of an image opened outside the worklist for its full-resolution volume, and show
+        the saved scores of the rater."""
+        try:
+            volume_node = self.logic.loadVolume(file_path, future.result())
+        except Exception as e:
+            slicer.util.errorDisplay(f"Failed to load image: {str(e)}")
+            return
+        self.showVolume(volume_node, file_path)
+        self.restoreScores(file_path)
+        self.updatePoolStatus()
+
+    def showVolume(self, volume_node, file_path, name=None, presets=None) -> None:
+        """Show the volume in the slice views with the selected window preset.
+        :param presets: window presets of the volume, by default they are looked up or computed by the logic
+        """
+        if presets is None:
+            fixed_window = volume_node.GetAttribute("showImageReports.WindowPreset")
+            if fixed_window:
+                # Display load mode: voxels are already windowed to 0..255
+                presets = [[f"{fixed_window} (display mode)", 255.0, 127.5]]
+            else:
+                presets = self.logic.volumeWindowPresets(file_path, slicer.util.arrayFromVolume(volume_node))
+        with self.logic.timings.span("display"):
+            self._showVolume(volume_node, name or os.path.basename(file_path), presets)
+
+    def _showVolume(self, volume_node, name, presets) -> None:
+        self.shown_volume_node = volume_node
+        self.window_presets = presets
+        wasBlocked = self.ui.windowPresetComboBox.blockSignals(True)
+        self.ui.windowPresetComboBox.clear()
+        for preset_name, window, level in presets:
+            self.ui.windowPresetComboBox.addItem(f"{preset_name} (W {window:g} / L {level:g})")
+        self.ui.windowPresetComboBox.blockSignals(wasBlocked)
+        self.applyWindowPreset()
+
+        volume_node.SetName(name)  # 设置文件名为节点名称
+        slicer.util.setSliceViewerLayers(background=volume_node)
+
+    def applyWindowPreset(self) -> None:
+        """Set the selected preset (or the first one if the volume has no such preset) on the shown volume."""
+        names = [preset[0] for preset in self.window_presets]
+        if not names or self.shown_volume_node is None or self.shown_volume_node.GetScene() is None:
+            return
+        index = names.index(self.window_preset_name) if self.window_preset_name in names else 0
+        _, window, level = self.window_presets[index]
+        displayNode = self.shown_volume_node.GetDisplayNode()
+        displayNode.AutoWindowLevelOff()
+        displayNode.SetWindowLevel(window, level)
+        wasBlocked = self.ui.windowPresetComboBox.blockSignals(True)
+        self.ui.windowPresetComboBox.currentIndex = index
+        self.ui.windowPresetComboBox.blockSignals(wasBlocked)
+
+    def selectWindowPreset(self, name) -> None:
+        """Switch the shown volume to a window preset by name, and keep using it for the following cases."""
+        if self.logic.loadMode == DISPLAY_LOAD_MODE and name in PRESET_NAMES:
+            self.logic.windowPresetName = name
+            self.window_preset_name = name
+            qt.QSettings().setValue("showImageReports/WindowPreset", name)
+            slicer.util.showStatusMessage(f"Cases that are not loaded yet will be shown with the {name} window", 2000)
+            return
+        if name not in [preset[0] for preset in self.window_presets]:
+            slicer.util.showStatusMessage(f"No {name} window for this volume", 2000)
+            return
+        self.window_preset_name = name
+        self.logic.windowPresetName = name
+        qt.QSettings().setValue("showImageReports/WindowPreset", name)
+        self.applyWindowPreset()
+
+    def onWindowPresetActivated(self, index) -> None:
+        if 0 <= index < len(self.window_presets):
+            self.selectWindowPreset(self.window_presets[index][0])
+
+    def showReports(self, reports) -> None:
+        """Show the ground truth and model reports of the current case."""
+        texts = self.logic.reportTexts(reports)
+        # Terms that relate to the criteria are highlighted, in the colors shown in the tooltips
+        hits = self.logic.reportTermHits(texts)
+        criteria = self.logic.termCriteria()
+        text = texts[GROUND_TRUTH_COLUMN]
+        self.origin_report[1] = highlightHtml(text, hits[GROUND_TRUTH_COLUMN], criteria) if text else None
+        if self.origin_report[0] == 1:
+            self.ui.rawReport.setHtml(self.origin_report[1] or "")
+
+        # Models are shown anonymized, in score grid order
+        for index, model in enumerate(MODELS):
+            text = texts.get(model)
+            html = highlightHtml(text, hits[model], criteria) if text else "(no report)"
+            getattr(self.ui, f"textBrowser_{index + 2}").setHtml(f"Method{index + 1}: " + html)
+
+    def updateTermLegend(self) -> None:
+        legend = legendHtml(self.logic.termCriteria())
+        for name in ("rawReport", "textBrowser_2", "textBrowser_3", "textBrowser_4", "textBrowser_5"):
+            getattr(self.ui, name).toolTip = legend
+
+    def onOpenDatasetButton(self) -> None:
+        """Select a dataset root and start walking its cases from the first one."""
+        root_path = qt.QFileDialog.getExistingDirectory(None, "Select dataset folder")
+        if not root_path:
+            return
+        worklist = self.openDataset(root_path)
+        self.overview_root = root_path
+        self.overview_page = 0
+        self.updateOverview()
+        if len(worklist) == 0:
+            slicer.util.errorDisplay(f"No NIfTI files found in {root_path}")
+            self.updateWorklistButtons()
+            return
+        self.showWorklistCase(0)
+
+    def openDataset(self, root_path):
+        """Open the worklist of a dataset without showing a case yet. New cases missing from its manifest
+        are validated with a progress dialog."""
+        progress_dialog = None
+
+        def onProgress(done, total):
+            nonlocal progress_dialog
+            if progress_dialog is None:
+                progress_dialog = slicer.util.createProgressDialog(labelText="Validating new cases...", maximum=total)
+            progress_dialog.maximum = total
+            progress_dialog.value = done
+            slicer.app.processEvents()
+
+        try:
+            worklist = self.logic.openWorklist(root_path, prefetchDepth=self.ui.prefetchDepthSpinBox.value,
+                                               progress=onProgress)
+        finally:
+            if progress_dialog is not None:
+                progress_dialog.close()
+        if self.logic.skippedCases:
+            slicer.util.showStatusMessage(f"Skipped {len(self.logic.skippedCases)} cases that failed validation, "
+                                          "see the Python console for details")
+        return worklist
+
+    def onNextCaseButton(self) -> None:
+        if not self.ui.adaptiveOrderCheckBox.checked:
+            self.showWorklistCase(self.logic.worklist.currentIndex + 1)
+            return
+        rater = self.ui.raterLineEdit.text
+        index = self.logic.nextScheduledCase(rater)
+        if index is None:
+            slicer.util.showStatusMessage(f"No cases left that {rater} has not rated", 3000)
+            return
+        self.showWorklistCase(index)
+
+    def onAdaptiveOrderToggled(self, checked) -> None:
+        qt.QSettings().setValue("showImageReports/AdaptiveOrder", "true" if checked else "false")
+        self.updateWorklistButtons()
+
+    def onPreviousCaseButton(self) -> None:
+        self.showWorklistCase(self.logic.worklist.currentIndex - 1)
+
+    def showWorklistCase(self, index) -> None:
+        """Show a worklist case from the prefetched, already decoded data. If the case is still being decoded,
+        a cached low-resolution preview is shown first and replaced by the full volume once it is ready."""
+        self.preview_timer.stop()
+        self.preview_future = None
+        image_path = self.logic.selectWorklistCase(index)
+        self.save_score_path = os.path.dirname(image_path)
+        self.save_res_path = image_path
+        self.updateWorklistButtons()
+        self.restoreScores(image_path)
+        if not self.logic.isCaseReady(index):
+            preview = self.logic.casePreview(image_path)
+            if preview is not None:
+                try:
+                    reports = self.logic.readReports(image_path)
+                except Exception:
+                    # Report the error when the full case is shown
+                    reports = None
+                if reports is not None:
+                    preview_node = self.logic.previewVolumeNode(preview, os.path.basename(image_path) + " (preview)")
+                    # Presets of the preview itself are cheap to compute, but only those of the full volume are cached
+                    presets = self.logic.cachedWindowPresets(image_path) or windowPresets(preview.array)
+                    self.showVolume(preview_node, image_path, preview_node.GetName(), presets)
+                    self.showReports(reports)
+                    self.preview_case_index = index
+                    self.preview_timer.start()
+                    return
+        self.showFullCase(index)
+
+    def onPreviewTimer(self) -> None:
+        if self.preview_future is not None:
+            if self.save_res_path != self.preview_image_path:
+                # Another case was opened meanwhile
+                self.preview_timer.stop()
+                self.preview_future = None
+            elif self.preview_future.done():
+                self.preview_timer.stop()
+                future, self.preview_future = self.preview_future, None
+                self.showFullImage(self.preview_image_path, future)
+            return
+        worklist = self.logic.worklist
+        if worklist is None or worklist.currentIndex != self.preview_case_index:
+            self.preview_timer.stop()
+            return
+        if self.logic.isCaseReady(self.preview_case_index):
+            self.preview_timer.stop()
+            # Reports are already shown, only swap in the full-resolution volume
+            self.showFullCase(self.preview_case_index, showReports=False)
+
+    def showFullCase(self, index, showReports=True) -> None:
+        case = self.logic.worklistCase(index)
+        if case.error is not None:
+            slicer.util.errorDisplay(f"Failed to load image: {str(case.error)}")
+            return
+        volume_node = self.logic.caseVolumeNode(case)
+        self.showVolume(volume_node, case.imagePath)
+        if showReports:
+            self.showReports(case.reports)
+        self.updatePoolStatus()
+
+    def onMemoryBudgetChanged(self, value) -> None:
+        self.logic.volumePool.setMemoryBudget(value * 1024 * 1024)
+        self.updatePoolStatus()
+
+    def updatePoolStatus(self) -> None:
+        stats = self.logic.volumePoolStatistics()
+        self.ui.poolStatusLabel.text = (f"{stats['nodes']} volumes, {stats['residentBytes'] / 1024 ** 2:.0f} MB "
+                                        f"(hits {stats['hits']}, misses {stats['misses']}, evictions {stats['evictions']})")
+
+    def updateWorklistButtons(self) -> None:
+        worklist = self.logic.worklist
+        if worklist is None or len(worklist) == 0:
+            self.ui.caseLabel.text = ""
+            self.ui.previousCaseButton.enabled = False
+            self.ui.nextCaseButton.enabled = False
+            return
+        index = worklist.currentIndex
+        self.ui.caseLabel.text = f"{index + 1} / {len(worklist)}: {worklist.caseId(index)}"
+        self.ui.previousCaseButton.enabled = index > 0
+        self.ui.nextCaseButton.enabled = self.ui.adaptiveOrderCheckBox.checked or index < len(worklist) - 1
+
+    def restoreScores(self, image_path) -> None:
+        """Autosave the scores of the previous case and show the saved scores of the rater for ``image_path``."""
+        self.flushScores()
+        rater = self.ui.raterLineEdit.text
+        case_id = self.logic.caseIdForImage(image_path)
+        self.score_case = (case_id, rater, image_path)
+        self.case_interacted = False
+        self.logic.recordEvent(LOAD_EVENT, case_id, rater)
+        self.score_grid.load(self.logic.caseScores(case_id, rater))
+        self.updateScoreFields()
+
+    def updateScoreFields(self) -> None:
+        """Show the score grid in the score fields, without feeding the changes back into the grid."""
+        self.invalid_score_cells.clear()
+        values = self.score_grid.values
+        for (model, criterion), field in self.score_fields.items():
+            row, column = ScoreGrid.cellIndex(model, criterion)
+            wasBlocked = field.blockSignals(True)
+            field.setText(str(values[row, column]))
+            field.blockSignals(wasBlocked)
+
+    def onScoreEdited(self, model, criterion) -> None:
+        try:
+            score = parseScore(self.score_fields[(model, criterion)].toPlainText())
+        except ValueError:
+            # Reported when saving
+            self.invalid_score_cells.add((model, criterion))
+            return
+        self.invalid_score_cells.discard((model, criterion))
+        if self.score_grid.set(model, criterion, score):
+            self.autosave_timer.start()
+            if self.score_case is not None:
+                case_id, rater, _ = self.score_case
+                if not self.case_interacted:
+                    self.case_interacted = True
+                    self.logic.recordEvent(INTERACTION_EVENT, case_id, rater)
+                self.logic.recordEvent(EDIT_EVENT, case_id, rater, model, criterion, score)
+
+    def flushScores(self) -> None:
+        """Autosave the changed cells of the score grid to the score store."""
+        self.autosave_timer.stop()
+        if self.score_case is None or not self.score_grid.isDirty():
+            return
+        case_id, rater, image_path = self.score_case
+        self.logic.autosaveScores(case_id, rater, self.score_grid.takeDirtyScores(), image_path)
 
     def onApplySaveButton(self) -> None:
         """
         Run processing when user clicks "Apply" button.
         """
-        """选择文件路径并加载影像"""
-        tmp = {"general":0, "complete":0, "pos":0, "num":0, "cls":0, "bian":0, "midu":0, "xing":0, "normal":0}
-        key = ["mini", "gpt4", "radfm", "bf"]
-        res ={k:copy.deepcopy(tmp) for k in key}
-        for key in res:
-            for item in res[key]:
-                attr = getattr(self.ui, f"{key}_{item}")
-                if hasattr(attr, "currentText"):
-                    res[key][item] = attr.currentText
-                elif hasattr(attr, "toPlainText"):
-                    res[key][item] = attr.toPlainText()
-                else:
-                    raise ValueError
-        print(res, self.save_score_path)
-        if self.save_score_path != None:
-            with open(os.path.join(self.save_score_path, "human.json"), "w") as f:
-                json.dump(res, f, indent=2, ensure_ascii=False)
+        """保存评分"""
+        if not self.save_res_path or self.score_case is None:
+            return
+        if self.invalid_score_cells:
+            cells = ", ".join(f"{model}_{criterion}" for model, criterion in sorted(self.invalid_score_cells))
+            slicer.util.errorDisplay(f"Invalid score in {cells}: scores are integers from {MIN_SCORE} to {MAX_SCORE}, "
+                                     f"or {UNRATED} if not rated")
+            return
+        self.autosave_timer.stop()
+        case_id, rater, image_path = self.score_case
+        self.logic.saveScores(case_id, rater, self.score_grid.toScores(), image_path, writeLegacy=self.write_legacy_files)
+        self.score_grid.takeDirtyScores()
+
+    @staticmethod
+    def settingsList(value) -> list:
+        # QSettings returns a single string for one-element lists
+        if not value:
+            return []
+        return [value] if isinstance(value, str) else list(value)
+
+    def onReportCorpusButton(self) -> None:
+        """Select JSONL report corpora; cancelling switches back to the reports.json next to each image."""
+        paths = qt.QFileDialog.getOpenFileNames(None, "Select report corpora", "", "JSON Lines (*.jsonl);;All files (*)")
+        qt.QSettings().setValue("showImageReports/ReportCorpusFiles", list(paths))
+        self.setReportCorpora(list(paths))
+
+    def setReportCorpora(self, paths) -> None:
+        slicer.app.setOverrideCursor(qt.Qt.WaitCursor)
+        try:
+            self.logic.setReportCorpora(paths, qt.QSettings().value("showImageReports/ReportCorpusIdField", "id"))
+        except Exception as e:
+            self.logic.setReportCorpora(None)
+            slicer.util.errorDisplay(f"Failed to index report corpora: {str(e)}")
+        finally:
+            slicer.app.restoreOverrideCursor()
+        self.ui.reportCorpusLabel.text = f"{len(paths)} JSONL corpora" if self.logic.reportCorpora else "reports.json per case"
+
+    def onOverviewCollapsed(self, collapsed) -> None:
+        if not collapsed:
+            self.loadOverviewPanel()
+            self.updateOverview()
+
+    def loadOverviewPanel(self) -> None:
+        """Load the Overview panel from its own .ui file, the first time it is shown."""
+        if self.overview_ui is not None:
+            return
+        panel = slicer.util.loadUI(self.resourcePath('UI/showImageReportsOverview.ui'))
+        self.ui.overviewCollapsibleButton.layout().addWidget(panel)
+        self.overview_ui = slicer.util.childWidgetVariables(panel)
+        self.overview_ui.buildThumbnailsButton.connect('clicked(bool)', self.onBuildThumbnailsButton)
+        self.overview_ui.previousPageButton.connect('clicked(bool)', lambda: self.showOverviewPage(self.overview_page - 1))
+        self.overview_ui.nextPageButton.connect('clicked(bool)', lambda: self.showOverviewPage(self.overview_page + 1))
+        self.overview_ui.overviewListWidget.connect('itemDoubleClicked(QListWidgetItem*)', self.onOverviewItemDoubleClicked)
+
+    def onBuildThumbnailsButton(self) -> None:
+        """Render the thumbnails of the open dataset (or a selected one) with a progress dialog."""
+        root_path = self.overview_root or qt.QFileDialog.getExistingDirectory(None, "Select dataset folder")
+        if not root_path:
+            return
+        progress_dialog = slicer.util.createProgressDialog(labelText="Rendering thumbnails...", maximum=0)
+
+        def onProgress(done, total):
+            progress_dialog.maximum = total
+            progress_dialog.value = done
+            slicer.app.processEvents()
+
+        try:
+            rendered = self.logic.buildThumbnailAtlas(root_path, progress=onProgress)
+        except Exception as e:
+            slicer.util.errorDisplay(f"Failed to build thumbnails: {str(e)}")
+            return
+        finally:
+            progress_dialog.close()
+        slicer.util.showStatusMessage(f"Rendered {rendered} thumbnails", 3000)
+        self.overview_root = root_path
+        self.updateOverview()
+
+    def updateOverview(self) -> None:
+        if self.overview_ui is None:
+            return
+        self.showOverviewPage(self.overview_page)
+
+    def showOverviewPage(self, page) -> None:
+        """Show one page of thumbnails from the atlas of the overview dataset. Cases the rater has scores for
+        are marked with a check mark."""
+        list_widget = self.overview_ui.overviewListWidget
+        list_widget.clear()
+        atlas = self.logic.openThumbnailAtlas(self.overview_root) if self.overview_root else None
+        cases = len(atlas) if atlas else 0
+        pages = max(1, -(-cases // OVERVIEW_PAGE_SIZE))
+        self.overview_page = min(max(0, page), pages - 1)
+        self.overview_ui.previousPageButton.enabled = self.overview_page > 0
+        self.overview_ui.nextPageButton.enabled = self.overview_page < pages - 1
+        if not cases:
+            self.overview_ui.pageLabel.text = "No thumbnails yet" if self.overview_root else "Open a dataset"
+            return
+        self.overview_ui.pageLabel.text = f"Page {self.overview_page + 1} / {pages} ({cases} cases)"
+        rated = set(self.logic.scoreStore.ratedCases(self.ui.raterLineEdit.text)) if self.logic.scoreStore else set()
+        for case_id, image_path, tile in atlas.page(self.overview_page * OVERVIEW_PAGE_SIZE, OVERVIEW_PAGE_SIZE):
+            pixmap = qt.QPixmap()
+            if tile is not None:
+                pixmap.loadFromData(pgmBytes(tile), "PGM")
+            name = os.path.dirname(case_id) or case_id
+            item = qt.QListWidgetItem(qt.QIcon(pixmap), f"\u2713 {name}" if case_id in rated else name)
+            item.setToolTip(image_path)
+            item.setData(qt.Qt.UserRole, image_path)
+            list_widget.addItem(item)
+
+    def onOverviewItemDoubleClicked(self, item) -> None:
+        """Open the case of a thumbnail through the worklist of the overview dataset, which is opened unless it is
+        the open one, so that Next/Previous continue from it and its scores are kept under the overview case ID."""
+        image_path = os.path.abspath(item.data(qt.Qt.UserRole))
+        worklist = self.logic.worklist
+        if not worklist or os.path.abspath(worklist.rootPath) != os.path.abspath(self.overview_root):
+            worklist = self.openDataset(self.overview_root)
+        cases = [os.path.abspath(case) for case in worklist.cases]
+        if image_path in cases:
+            self.showWorklistCase(cases.index(image_path))
+        else:
+            # E.g. a case that failed validation, it keeps its case ID below the dataset root
+            self.openImage(image_path)
+
+    def onTimingsCollapsed(self, collapsed) -> None:
+        if not collapsed:
+            self.loadTimingsPanel()
+            self.updateTimings()
+
+    def loadTimingsPanel(self) -> None:
+        """Load the Timings panel from its own .ui file, the first time it is shown."""
+        if self.timings_ui is not None:
+            return
+        panel = slicer.util.loadUI(self.resourcePath('UI/showImageReportsTimings.ui'))
+        self.ui.timingsCollapsibleButton.layout().addWidget(panel)
+        self.timings_ui = slicer.util.childWidgetVariables(panel)
+        self.timings_ui.refreshTimingsButton.connect('clicked(bool)', self.updateTimings)
+        self.timings_ui.resetTimingsButton.connect('clicked(bool)', self.onResetTimingsButton)
+        self.timings_ui.saveTimingsButton.connect('clicked(bool)', self.onSaveTimingsButton)
+
+    def updateTimings(self) -> None:
+        if self.timings_ui is None:
+            return
+        self.timings_ui.timingsTextEdit.setPlainText(self.logic.timings.formatTable())
+
+    def onResetTimingsButton(self) -> None:
+        self.logic.timings.reset()
+        self.updateTimings()
+
+    def onSaveTimingsButton(self) -> None:
+        path = qt.QFileDialog.getSaveFileName(None, "Save timings", "timings.json", "JSON files (*.json)")
+        if path:
+            self.logic.timings.dump(path)
+
+    def onRaterChanged(self, text) -> None:
+        qt.QSettings().setValue("showImageReports/RaterName", text)
+
+    def onRaterEditingFinished(self) -> None:
+        # Scores entered so far stay with the previous rater, show the new rater's scores of the case
+        if self.score_case is not None and self.score_case[1] != self.ui.raterLineEdit.text:
+            self.restoreScores(self.score_case[2])
 
 #
 # showImageReportsLogic
@@ -392,9 +1012,862 @@ class showImageReportsLogic(ScriptedLoadableModuleLogic):
         Called when the logic class is instantiated. Can be used for initializing member variables.
         """
         ScriptedLoadableModuleLogic.__init__(self)
+        self.worklist = None
+        # Roots of the datasets opened in this session, images below them get case IDs relative to them
+        self.datasetRoots = []
+        self.prefetcher = None
+        self.volumePool = VolumeNodePool(DEFAULT_MEMORY_BUDGET,
+                                         removeNode=slicer.mrmlScene.RemoveNode,
+                                         isValid=lambda node: node.GetScene() is not None)
+        self.volumeCache = None
+        self.scoreStore = None
+        self.submissionClient = None
+        self.reportCorpora = None
+        self.reportColumns = DEFAULT_REPORT_COLUMNS
+        # Cases of the open worklist that the dataset manifest marks as invalid, image path -> problems
+        self.skippedCases = {}
+        self.autosaveExecutor = None
+        # Reads single images behind a preview, see readVolumeInBackground
+        self.loadExecutor = None
+        self.previewLevel = DEFAULT_PREVIEW_LEVEL
+        self.termHitCache = None
+        self.setTermVocabulary(DEFAULT_TERM_VOCABULARY)
+        self.previewNode = None
+        # Window presets per image path, computed on the prefetch threads
+        self.casePresets = {}
+        # Case ID per absolute image path seen in this session, ratings under other IDs are merged the first time
+        self.imageCaseIds = {}
+        # Content hash per absolute path of images in no dataset, as (mtime, size, hash), computed on the load threads
+        self.imageHashes = {}
+        # Thumbnail atlas of the dataset shown in the overview, kept open while paging
+        self.thumbnailAtlas = None
+        # Rater timing events, and the adaptive order of the open worklist built from them and the ratings
+        self.eventLog = None
+        self.scheduler = None
+        # How volumes are held in memory, see Compact.py. Display mode windows them with windowPresetName.
+        self.loadMode = NATIVE_LOAD_MODE
+        self.windowPresetName = PRESET_NAMES[0]
+        # Load mode -> [cases, loaded voxel bytes, native voxel bytes, measured loads, resident bytes they added]
+        self.caseMemory = {}
+        self._caseMemoryLock = threading.Lock()
+        # Token of every load in progress -> whether it did not overlap another load so far
+        self._loadsInFlight = {}
+        # Durations of the load, import, parse, display and save phases
+        self.timings = PhaseTimings()
 
     def getParameterNode(self):
-        return showImageReportsParameterNode(super().getParameterNode())
+        return parameterNodeClass()(super().getParameterNode())
+
+    def openWorklist(self, rootPath, prefetchDepth: int = 3, progress=None) -> CaseWorklist:
+        """
+        Collect all cases below a dataset root and start decoding the first ones in the background.
+        :param rootPath: dataset folder, each NIfTI file in it is a case with a reports.json next to it
+        :param prefetchDepth: number of upcoming cases that are decoded ahead of time
+        :param progress: optional callable ``progress(done, total)``, called while new cases are validated
+        """
+        self.closeWorklist()
+        self.addDatasetRoot(rootPath)
+        self.worklist = CaseWorklist(rootPath, self.datasetCases(rootPath, progress))
+        self.prefetcher = CasePrefetcher(self.worklist, depth=prefetchDepth, skip=lambda path: path in self.volumePool,
+                                         readVolume=self.readCaseVolume, readReports=self.readReports)
+        self.prefetcher.prefetch(0)
+        logging.info(f"Opened worklist with {len(self.worklist)} cases in {rootPath}")
+        return self.worklist
+
+    def datasetCases(self, rootPath, progress=None):
+        """Cases of a dataset from its manifest or its file index if it has one, otherwise None (walk the dataset).
+        A manifest that misses added or removed cases is updated first, with ``progress(done, total)``."""
+        manifestPath = os.path.join(rootPath, MANIFEST_FILE_NAME)
+        if os.path.exists(manifestPath):
+            manifest = DatasetManifest(manifestPath)
+            try:
+                stale = manifest.isStale(rootPath)
+            finally:
+                manifest.close()
+            if stale:
+                logging.warning(f"Cases of {rootPath} were added or removed since {manifestPath} was written, updating it")
+                self.ingestDataset(rootPath, progress=progress, manifestPath=manifestPath)
+            return self.manifestCases(manifestPath)
+        if os.path.exists(os.path.join(rootPath, INDEX_FILE_NAME)):
+            return self.indexCases(rootPath)
+        return None
+
+    def buildThumbnailAtlas(self, rootPath, maxWorkers=None, progress=None) -> int:
+        """
+        Render key-slice thumbnails of all new and changed cases of a dataset on a process pool into the
+        thumbnail atlas in the dataset root, see ``Thumbnails.py``.
+        :param progress: optional callable ``progress(done, total)``
+        :return: number of rendered cases
+        """
+        worklist = CaseWorklist(rootPath, self.datasetCases(rootPath))
+        atlas = self.openThumbnailAtlas(rootPath, create=True)
+        return atlas.build([(worklist.caseId(index), imagePath) for index, imagePath in enumerate(worklist.cases)],
+                           maxWorkers, progress)
+
+    def openThumbnailAtlas(self, rootPath, create: bool = False):
+        """The thumbnail atlas of a dataset, kept open until another one is opened, or None if it was not built."""
+        path = os.path.join(os.path.abspath(rootPath), ATLAS_FILE_NAME)
+        if self.thumbnailAtlas and self.thumbnailAtlas.path == path:
+            return self.thumbnailAtlas
+        self.closeThumbnailAtlas()
+        if create or os.path.exists(path):
+            self.thumbnailAtlas = ThumbnailAtlas(path)
+        return self.thumbnailAtlas
+
+    def closeThumbnailAtlas(self) -> None:
+        if self.thumbnailAtlas:
+            self.thumbnailAtlas.close()
+            self.thumbnailAtlas = None
+
+    def ingestDataset(self, rootPath, maxWorkers=None, progress=None, manifestPath=None) -> dict:
+        """
+        Validate all cases of a dataset on a process pool and write its manifest, see ``Ingest.py``.
+        Reports are checked against the current report columns, unless they are read from report corpora.
+        :param manifestPath: defaults to the manifest file in the dataset root, which ``openWorklist`` uses
+        :return: manifest summary
+        """
+        manifest = DatasetManifest(manifestPath or os.path.join(rootPath, MANIFEST_FILE_NAME))
+        try:
+            manifest.update(rootPath, None if self.reportCorpora else self.reportColumns, maxWorkers, progress)
+            return manifest.summary()
+        finally:
+            manifest.close()
+
+    def updateDatasetIndex(self, rootPath, full: bool = False, indexPath=None, progress=None) -> dict:
+        """
+        Create or incrementally update the file index of a dataset, see ``DatasetIndex.py``.
+        :param full: stat every file, to also find images that were rewritten in place
+        :param indexPath: defaults to the index file in the dataset root, which ``openWorklist`` uses
+        :return: update statistics
+        """
+        index = DatasetIndex(rootPath, indexPath)
+        try:
+            return index.update(full, progress=progress)
+        finally:
+            index.close()
+
+    def indexCases(self, rootPath, indexPath=None) -> list:
+        """Cases of a dataset from its updated file index. The content hashes are passed on to the volume cache."""
+        index = DatasetIndex(rootPath, indexPath)
+        try:
+            index.update()
+            if self.volumeCache:
+                self.volumeCache.recordSources(index.contentHashes())
+            return index.cases()
+        finally:
+            index.close()
+
+    def unratedCases(self, rootPath, rater, indexPath=None) -> list:
+        """Case IDs of a dataset for which the rater saved no score, answered from the dataset index
+        (as last updated) and the score store without walking the dataset."""
+        if not self.scoreStore:
+            raise ValueError("Score store is not open")
+        self.scoreStore.commit()
+        index = DatasetIndex(rootPath, indexPath)
+        try:
+            return index.unratedCases(self.scoreStore.ratedCases(rater))
+        finally:
+            index.close()
+
+    def casesMissingReport(self, rootPath, column, indexPath=None) -> list:
+        """Case IDs of a dataset whose reports.json has no report for a report column (e.g. a model),
+        answered from the dataset index as last updated."""
+        index = DatasetIndex(rootPath, indexPath)
+        try:
+            return index.casesMissingColumn(column, self.reportColumns)
+        finally:
+            index.close()
+
+    def manifestCases(self, manifestPath):
+        """Valid cases of a dataset manifest, or None if the manifest was validated with other report columns.
+        The content hashes recorded in the manifest are passed on to the volume cache."""
+        manifest = DatasetManifest(manifestPath)
+        try:
+            columns = manifest.columns()
+            if columns is not None and columns != self.reportColumns:
+                logging.warning(f"Ignoring {manifestPath}, it was validated with other report columns")
+                return None
+            self.skippedCases = manifest.invalidCases()
+            for imagePath, errors in self.skippedCases.items():
+                logging.warning(f"Skipping invalid case {imagePath}: {'; '.join(errors)}")
+            if self.volumeCache:
+                self.volumeCache.recordSources(manifest.contentHashes())
+            return manifest.validCases()
+        finally:
+            manifest.close()
+
+    def closeWorklist(self) -> None:
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        self.worklist = None
+        self.prefetcher = None
+        self.skippedCases = {}
+        self.scheduler = None
+
+    def selectWorklistCase(self, index: int) -> str:
+        """Make ``index`` the current worklist case and schedule decoding of it and the following cases.
+        Returns the image path of the case without waiting for it."""
+        if not self.worklist or not 0 <= index < len(self.worklist):
+            raise IndexError(f"Case index {index} is out of range")
+        self.worklist.currentIndex = index
+        self.prefetcher.prefetch(index)
+        return self.worklist.cases[index]
+
+    def isCaseReady(self, index: int) -> bool:
+        """True if showing the worklist case would not have to wait for decoding."""
+        return self.worklist.cases[index] in self.volumePool or self.prefetcher.isReady(index)
+
+    def casePreview(self, imagePath):
+        """Cached downsampled preview of a volume (the configured preview level, or the finest coarser one), or None."""
+        if not self.volumeCache:
+            return None
+        for level in range(self.previewLevel, 0, -1):
+            preview = self.volumeCache.lookupPreview(imagePath, level)
+            if preview is not None:
+                return preview
+        return None
+
+    def previewVolumeNode(self, preview, name: str) -> vtkMRMLScalarVolumeNode:
+        """Show a preview in a single reused volume node, which is not part of the volume pool."""
+        if self.previewNode is None or self.previewNode.GetScene() is None:
+            self.previewNode = self.createVolumeNode(preview, name)
+        else:
+            with self.timings.span("import"):
+                ijkToRas = vtk.vtkMatrix4x4()
+                slicer.util.updateVTKMatrixFromArray(ijkToRas, preview.ijkToRas)
+                self.previewNode.SetIJKToRASMatrix(ijkToRas)
+                slicer.util.updateVolumeFromArray(self.previewNode, preview.array)
+                self.previewNode.SetName(name)
+        return self.previewNode
+
+    def worklistCase(self, index: int):
+        """
+        Make ``index`` the current worklist case and return its decoded data.
+        Decoding of the following cases is scheduled before waiting for this one.
+        """
+        imagePath = self.selectWorklistCase(index)
+        if imagePath in self.volumePool:
+            # Volume is still in the scene, only the reports are needed
+            try:
+                return LoadedCase(imagePath, reports=self.readReports(imagePath))
+            except Exception as e:
+                return LoadedCase(imagePath, error=e)
+        return self.prefetcher.get(index)
+
+    def setVolumeCache(self, cacheDir, maxBytes: int = DEFAULT_CACHE_SIZE) -> None:
+        """
+        Enable the persistent cache of decompressed volumes.
+        :param cacheDir: cache folder, or None to disable the cache
+        :param maxBytes: size cap of the cache folder, least recently used volumes are evicted beyond it
+        """
+        if self.volumeCache:
+            self.volumeCache.close()
+        self.volumeCache = VolumeCache(cacheDir, maxBytes) if cacheDir else None
+
+    def readVolume(self, imagePath):
+        """Decode a volume into a ``NiftiVolume``, memory-mapped from the volume cache when it is enabled.
+        Safe to call from worker threads."""
+        with self.timings.span("load"):
+            if self.volumeCache:
+                return self.volumeCache.load(imagePath)
+            return readNifti(imagePath)
+
+    def setLoadMode(self, mode) -> None:
+        """
+        Set how volumes are held in memory for rating. Applies to volumes that are loaded from now on.
+        :param mode: ``native`` (as decoded), ``compact`` (cropped to the foreground, int16) or
+          ``display`` (cropped, windowed to uint8 with the ``windowPresetName`` preset)
+        """
+        if mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode {mode}, expected one of {', '.join(LOAD_MODES)}")
+        self.loadMode = mode
+
+    def readCaseVolume(self, imagePath):
+        """
+        Read a volume for rating: decode it, compute its window presets and convert it to the load mode.
+        Used by the prefetch threads, so that the case is ready to be shown.
+        """
+        token = object()
+        with self._caseMemoryLock:
+            for other in self._loadsInFlight:
+                self._loadsInFlight[other] = False
+            self._loadsInFlight[token] = not self._loadsInFlight
+        residentBefore = residentBytes()
+        try:
+            volume = self._readCaseVolume(imagePath)
+        finally:
+            residentAfter = residentBytes()
+            with self._caseMemoryLock:
+                isolated = self._loadsInFlight.pop(token)
+        # The change of resident memory is only attributed to a load if no other load ran at the same time
+        residentDelta = residentAfter - residentBefore if isolated and residentBefore is not None else None
+        self.recordCaseMemory(volume, residentDelta)
+        # Images in no dataset are identified by their content hash, compute it here instead of when the case is shown
+        if self.datasetRoot(imagePath) is None:
+            self.imageContentHash(imagePath)
+        return volume
+
+    def _readCaseVolume(self, imagePath):
+        volume = self.readVolume(imagePath)
+        presets = self.volumeWindowPresets(imagePath, volume.array)
+        if self.loadMode != NATIVE_LOAD_MODE:
+            box = self.volumeForegroundBox(imagePath, volume.array, presets)
+            names = [preset[0] for preset in presets]
+            window = presets[names.index(self.windowPresetName)] if self.windowPresetName in names else presets[0]
+            with self.timings.span("compact"):
+                volume = compactVolume(volume, box, self.loadMode, window)
+        return volume
+
+    def volumeForegroundBox(self, imagePath, array, presets):
+        """Foreground bounding box of a volume, see ``Compact.py``; cached by content hash with a volume cache."""
+        contentHash = self.volumeCache.contentHash(imagePath) if self.volumeCache else None
+        box = self.volumeCache.foregroundBox(contentHash) if contentHash else None
+        if box is None:
+            box = volumeForegroundBox(array, presets)
+            if contentHash:
+                self.volumeCache.putForegroundBox(contentHash, box)
+        return box
+
+    def recordCaseMemory(self, volume, residentDelta=None) -> None:
+        """Report the mean voxel memory per case of the load mode (and of the native volumes it was made from)
+        and the mean change of resident memory of Slicer per load of the load mode in the timings.
+        :param residentDelta: resident bytes added by loading this volume, None if it was not measured
+        """
+        nativeBytes = getattr(volume, "nativeBytes", volume.nbytes)
+        with self._caseMemoryLock:
+            figures = self.caseMemory.setdefault(self.loadMode, [0, 0, 0, 0, 0])
+            figures[0] += 1
+            figures[1] += volume.nbytes
+            figures[2] += nativeBytes
+            if residentDelta is not None:
+                figures[3] += 1
+                figures[4] += residentDelta
+            cases, loadedBytes, nativeBytes, measuredLoads, residentTotal = figures
+        self.timings.setValue(f"{self.loadMode} MB/case", round(loadedBytes / cases / 1024 ** 2, 1))
+        if self.loadMode != NATIVE_LOAD_MODE:
+            self.timings.setValue(f"{self.loadMode} native MB/case", round(nativeBytes / cases / 1024 ** 2, 1))
+        if measuredLoads:
+            self.timings.setValue(f"{self.loadMode} resident MB/load", round(residentTotal / measuredLoads / 1024 ** 2, 1))
+
+    def cachedWindowPresets(self, imagePath):
+        """Window presets of a volume if they were computed in this session or are in the volume cache, otherwise None."""
+        imagePath = os.path.abspath(imagePath)
+        presets = self.casePresets.get(imagePath)
+        if presets is None and self.volumeCache:
+            presets = self.volumeCache.windowPresets(self.volumeCache.contentHash(imagePath))
+            if presets is not None:
+                self.casePresets[imagePath] = presets
+        return presets
+
+    def volumeWindowPresets(self, imagePath, array):
+        """
+        Suggested ``[name, window, level]`` presets of a volume, see ``Windowing.py``.
+        They are computed from ``array`` only if they are not cached yet, and then added to the volume cache.
+        Safe to call from worker threads.
+        """
+        presets = self.cachedWindowPresets(imagePath)
+        if presets is None:
+            with self.timings.span("presets"):
+                presets = windowPresets(array)
+            if self.volumeCache:
+                self.volumeCache.putWindowPresets(self.volumeCache.contentHash(imagePath), presets)
+            self.casePresets[os.path.abspath(imagePath)] = presets
+        return presets
+
+    def warmUpVolumeCache(self, rootPath, maxWorkers=None, progress=None, pyramidLevels=None) -> int:
+        """Decompress all volumes of a dataset into the volume cache, build their preview levels
+        (``previewLevel`` levels by default) and compute their window presets using a process pool."""
+        if not self.volumeCache:
+            raise ValueError("Volume cache is not enabled")
+        if pyramidLevels is None:
+            pyramidLevels = self.previewLevel
+        return self.volumeCache.warmUp(CaseWorklist(rootPath).cases, maxWorkers, progress, pyramidLevels)
+
+    def readVolumeInBackground(self, imagePath):
+        """
+        Start reading a volume on a worker thread as ``loadVolume`` would, so that a preview can be shown meanwhile.
+        Returns a future of the volume to pass to ``loadVolume``, or None if the volume is resident in the
+        volume pool or is loaded by Slicer itself (native load mode without a volume cache).
+        """
+        if imagePath in self.volumePool or not (self.volumeCache or self.loadMode != NATIVE_LOAD_MODE):
+            return None
+        if self.loadExecutor is None:
+            self.loadExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="showImageReportsLoad")
+        return self.loadExecutor.submit(self.readCaseVolume, imagePath)
+
+    def loadVolume(self, imagePath, volume=None) -> vtkMRMLScalarVolumeNode:
+        """Load a volume from disk, or reuse the node from the volume pool if it is still resident.
+        :param volume: the volume if it was already read, e.g. by ``readVolumeInBackground``
+        """
+        volumeNode = self.volumePool.get(imagePath)
+        if volumeNode is None:
+            if volume is not None or self.volumeCache or self.loadMode != NATIVE_LOAD_MODE:
+                if volume is None:
+                    volume = self.readCaseVolume(imagePath)
+                volumeNode = self.createVolumeNode(volume, os.path.basename(imagePath))
+                self.volumePool.add(imagePath, volumeNode, volume.nbytes)
+            else:
+                with self.timings.span("load"):
+                    volumeNode = slicer.util.loadVolume(imagePath)
+                self.volumePool.add(imagePath, volumeNode, volumeNode.GetImageData().GetActualMemorySize() * 1024)
+        return volumeNode
+
+    def caseVolumeNode(self, case) -> vtkMRMLScalarVolumeNode:
+        """Return the volume node of a worklist case, creating it from the decoded array on a pool miss."""
+        volumeNode = self.volumePool.get(case.imagePath)
+        if volumeNode is None:
+            volumeNode = self.createVolumeNode(case.volume, os.path.basename(case.imagePath))
+            self.volumePool.add(case.imagePath, volumeNode, case.volume.nbytes)
+        return volumeNode
+
+    def volumePoolStatistics(self) -> dict:
+        """Hit/miss/eviction counters and resident voxel bytes of the volume node pool."""
+        return self.volumePool.statistics()
+
+    def setReportCorpora(self, paths, idField: str = "id") -> None:
+        """
+        Read reports from JSONL corpora instead of the reports.json next to each image.
+        The byte-offset index of each corpus is created or incrementally updated here.
+        :param paths: JSONL files, e.g. one per model run; empty to use reports.json files again
+        :param idField: name of the case ID field in each JSONL line
+        """
+        if self.reportCorpora:
+            self.reportCorpora.close()
+        self.reportCorpora = ReportCorpora(paths, idField) if paths else None
+
+    def setReportColumns(self, columns) -> None:
+        """Set which report fields hold the ground truth and the report of each model, see ``Reports.py``.
+        The models are fixed by ``MODELS``, so every one of them needs a column."""
+        missing = [column for column in (GROUND_TRUTH_COLUMN, *MODELS) if column not in columns]
+        if missing:
+            raise ValueError(f"Report columns are missing for: {', '.join(missing)}")
+        self.reportColumns = columns
+
+    def reportCaseIds(self, imagePath) -> list:
+        """Candidate IDs of a case in the report corpora: the case folder relative to the worklist root,
+        the case folder name, and the image file name without extension."""
+        caseDir = os.path.dirname(os.path.abspath(imagePath))
+        ids = []
+        if self.worklist:
+            rootPath = os.path.abspath(self.worklist.rootPath)
+            if os.path.commonpath([rootPath, caseDir]) == rootPath and caseDir != rootPath:
+                ids.append(os.path.relpath(caseDir, rootPath).replace(os.sep, "/"))
+        ids.append(os.path.basename(caseDir))
+        fileName = os.path.basename(imagePath)
+        ids.append(fileName[:-len(".nii.gz")] if fileName.lower().endswith(".nii.gz") else os.path.splitext(fileName)[0])
+        return list(dict.fromkeys(ids))
+
+    def readReports(self, imagePath) -> dict:
+        """Report record of a case, from the report corpora if set, otherwise from its reports.json.
+        A case missing from the corpora indexes the lines appended since the last lookup before giving up.
+        Safe to call from worker threads."""
+        with self.timings.span("parse"):
+            if self.reportCorpora:
+                caseIds = self.reportCaseIds(imagePath)
+                reports = self.reportCorpora.get(caseIds)
+                if reports is None and self.reportCorpora.update():
+                    reports = self.reportCorpora.get(caseIds)
+                if reports is None:
+                    raise KeyError(f"No reports found for {imagePath}")
+                return reports
+            return readReportsFile(imagePath)
+
+    def reportTexts(self, reports) -> dict:
+        """Ground truth and model report texts of a report record, keyed by report column."""
+        return reportTexts(reports, self.reportColumns)
+
+    def setScoreStore(self, path) -> None:
+        """Open the score store database at ``path``, or close it if ``path`` is None."""
+        if self.autosaveExecutor:
+            self.autosaveExecutor.shutdown(wait=True)
+            self.autosaveExecutor = None
+        if self.scoreStore:
+            self.scoreStore.close()
+        self.scoreStore = ScoreStore(path) if path else None
+        self.imageCaseIds.clear()
+
+    def setEventLog(self, directory) -> None:
+        """Record rater timing events into ``directory`` (see ``Telemetry.py``), or stop recording if it is None."""
+        if self.eventLog:
+            self.eventLog.close()
+        self.eventLog = EventLog(directory) if directory else None
+
+    def recordEvent(self, event, caseId, rater, model=None, criterion=None, value=None) -> None:
+        """Record a rater timing event (``Telemetry.LOAD_EVENT``, ...) if an event log is set."""
+        if self.eventLog:
+            self.eventLog.record(event, caseId, rater, model, criterion, value)
+
+    def raterThroughput(self) -> dict:
+        """Rated cases per hour and time per case of every rater, from all recorded events."""
+        if not self.eventLog:
+            raise ValueError("Event log is not set")
+        from showImageReportsLib.Telemetry import raterThroughput
+        return raterThroughput(self.eventLog.events())
+
+    def scheduleWorklist(self) -> CaseScheduler:
+        """Build the adaptive case order of the open worklist from the ratings in the score store, the report
+        metrics (if computed) and the recorded rating times, see ``Scheduling.py``. Saves update it incrementally."""
+        if not self.worklist:
+            raise ValueError("No worklist is open")
+        caseIds = [self.worklist.caseId(index) for index in range(len(self.worklist))]
+        divergence = None
+        ratings = []
+        if self.scoreStore:
+            from showImageReportsLib import Metrics
+            self.scoreStore.commit()
+            store = Metrics.MetricStore(self.scoreStore.path)
+            try:
+                divergence = metricDivergence(store.metricArray(caseIds))
+            finally:
+                store.close()
+            ratings = self.scoreStore.allRatings()
+        sessions = []
+        if self.eventLog:
+            events = self.eventLog.events()
+            caseTimes = caseSessions(events)
+            for index in (caseTimes["saved"]).nonzero()[0]:
+                sessions.append((str(events["caseIds"][caseTimes["case"][index]]),
+                                 str(events["raters"][caseTimes["rater"][index]]), float(caseTimes["seconds"][index])))
+        self.scheduler = CaseScheduler(caseIds, divergence)
+        self.scheduler.load(ratings, sessions)
+        return self.scheduler
+
+    def nextScheduledCase(self, rater):
+        """Worklist index of the most valuable case the rater has not rated yet (other than the current one),
+        or None if there is none."""
+        if self.scheduler is None:
+            self.scheduleWorklist()
+        current = self.worklist.caseId(self.worklist.currentIndex) if self.worklist.currentIndex >= 0 else None
+        caseIds = self.scheduler.nextCases(rater, 1, exclude=[current])
+        return self.scheduler.caseIds.index(caseIds[0]) if caseIds else None
+
+    def setCollectionServer(self, url, spoolPath=None) -> None:
+        """Submit saved scores to the collection server at ``url`` (see ``Collection.py``), queueing them in the
+        local spool database at ``spoolPath`` (default: next to the score store) while the server is unreachable.
+        ``url`` None stops submitting; submissions that are still spooled are sent the next time a server is set."""
+        if self.submissionClient:
+            self.submissionClient.close()
+        self.submissionClient = None
+        if url:
+            if spoolPath is None:
+                if not self.scoreStore:
+                    raise ValueError("Either a spool path or an open score store is required")
+                spoolPath = os.path.join(os.path.dirname(os.path.abspath(self.scoreStore.path)), "submissionSpool.sqlite")
+            from showImageReportsLib.Collection import SubmissionClient
+            self.submissionClient = SubmissionClient(url, spoolPath)
+            # Submissions spooled for another server or in an earlier session are sent right away
+            self.submissionClient.retryNow()
+            self.submissionClient.start()
+
+    @staticmethod
+    def isBelow(path, rootPath) -> bool:
+        try:
+            return os.path.commonpath([rootPath, path]) == rootPath
+        except ValueError:
+            # Different drives
+            return False
+
+    def addDatasetRoot(self, rootPath) -> None:
+        """Give images below ``rootPath`` case IDs relative to it, and merge the ratings that were saved under
+        their absolute image paths into those case IDs."""
+        rootPath = os.path.abspath(rootPath)
+        if rootPath not in self.datasetRoots:
+            self.datasetRoots.append(rootPath)
+        if self.scoreStore:
+            for caseId in self.scoreStore.caseIds():
+                if os.path.isabs(caseId) and self.isBelow(caseId, rootPath):
+                    self.scoreStore.mergeCases(os.path.relpath(caseId, rootPath).replace(os.sep, "/"), caseId)
+
+    def datasetRoot(self, imagePath):
+        """Dataset root of an image: the open worklist, a dataset opened in this session, or the nearest folder
+        above the image with a manifest, file index or thumbnail atlas. None if the image is in no dataset."""
+        imagePath = os.path.abspath(imagePath)
+        roots = ([os.path.abspath(self.worklist.rootPath)] if self.worklist else []) + self.datasetRoots
+        for rootPath in roots:
+            if self.isBelow(imagePath, rootPath):
+                return rootPath
+        directory = os.path.dirname(imagePath)
+        while True:
+            if any(os.path.exists(os.path.join(directory, name)) for name in (MANIFEST_FILE_NAME, INDEX_FILE_NAME, ATLAS_FILE_NAME)):
+                return directory
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return None
+            directory = parent
+
+    def caseIdForImage(self, imagePath) -> str:
+        """
+        Case identifier used in the score store, the same however the image was opened: the image path relative
+        to its dataset root (see ``datasetRoot``), or the ID it was saved under before, or ``sha256:`` and the
+        content hash of an image outside of any dataset. Ratings saved under other IDs of the image (e.g. its
+        absolute path) are merged into it the first time the image is seen in this session.
+        """
+        imagePath = os.path.abspath(imagePath)
+        rootPath = self.datasetRoot(imagePath)
+        if rootPath:
+            caseId = os.path.relpath(imagePath, rootPath).replace(os.sep, "/")
+        elif imagePath in self.imageCaseIds:
+            caseId = self.imageCaseIds[imagePath]
+        else:
+            known = [caseId for caseId in self.scoreStore.imageCaseIds(imagePath) if not os.path.isabs(caseId)] if self.scoreStore else []
+            caseId = known[0] if known else "sha256:" + self.imageContentHash(imagePath)
+        if self.scoreStore and self.imageCaseIds.get(imagePath) != caseId:
+            self.scoreStore.mergeCases(caseId, imagePath)
+        self.imageCaseIds[imagePath] = caseId
+        return caseId
+
+    def imageContentHash(self, imagePath) -> str:
+        """Content hash of an image, reused while its mtime and size are unchanged. Safe to call from worker threads."""
+        imagePath = os.path.abspath(imagePath)
+        stat = os.stat(imagePath)
+        known = self.imageHashes.get(imagePath)
+        if known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+            return known[2]
+        contentHash = self.volumeCache.contentHash(imagePath) if self.volumeCache else fileContentHash(imagePath)
+        self.imageHashes[imagePath] = (stat.st_mtime, stat.st_size, contentHash)
+        return contentHash
+
+    def caseScores(self, caseId, rater):
+        """Saved (including autosaved) scores of a case as ``{model: {criterion: int or None}}``, or None
+        without score store."""
+        if not self.scoreStore:
+            return None
+        self.scoreStore.commit()
+        return self.scoreStore.scores(caseId, rater)
+
+    def autosaveScores(self, caseId, rater, scores, imagePath=None) -> None:
+        """
+        Queue changed cells of a case in the score store and commit them on a background thread.
+        Unlike ``saveScores`` the legacy human.json is not written and nothing is submitted to the collection
+        server, but the save is recorded in the event log and the adaptive case order the same way.
+        :param scores: ``{model: {criterion: int or None}}``, only the cells to update
+        """
+        if not self.scoreStore:
+            return
+        self.scoreStore.putScores(caseId, rater, scores, os.path.abspath(imagePath) if imagePath else None)
+        if self.autosaveExecutor is None:
+            self.autosaveExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="showImageReportsAutosave")
+        self.autosaveExecutor.submit(self.scoreStore.commit)
+        self.recordSave(caseId, rater)
+
+    def saveScores(self, caseId, rater, scores, imagePath=None, writeLegacy: bool = False) -> None:
+        """
+        Commit the scores of one case to the score store, and submit them to the collection server if one is set.
+        :param scores: ``{model: {criterion: int or None}}``
+        :param writeLegacy: also (atomically) write the legacy human.json next to the image. It holds the scores
+          of this rater only and replaces the file of any other rater, use ``ScoreStore.exportLegacy`` instead.
+        """
+        if not self.scoreStore:
+            raise ValueError("Score store is not open")
+        with self.timings.span("save"):
+            self.scoreStore.putScores(caseId, rater, scores, os.path.abspath(imagePath) if imagePath else None)
+            self.scoreStore.commit()
+            if writeLegacy and imagePath:
+                self.scoreStore.writeLegacyFile(caseId, rater, os.path.dirname(imagePath))
+            if self.submissionClient:
+                self.submissionClient.submit(caseId, rater, self.scoreStore.scores(caseId, rater))
+                self.submissionClient.wake()
+        self.recordSave(caseId, rater)
+
+    def recordSave(self, caseId, rater) -> None:
+        """Record a save of a case in the event log and update the adaptive case order with all scores
+        the rater gave the case. A session saved several times counts as one rated case."""
+        seconds = None
+        if self.eventLog:
+            self.eventLog.record(SAVE_EVENT, caseId, rater)
+            seconds = self.eventLog.sessionSeconds(caseId, rater)
+            throughput = self.eventLog.sessionThroughput(rater)
+            if throughput is not None:
+                self.timings.setValue("rated cases/hour", round(throughput, 1))
+        if self.scheduler:
+            # Autosaved cells may still be queued for the autosave thread
+            self.scheduler.recordRating(caseId, rater, self.scoreStore.scores(caseId, rater, pending=True), seconds)
+
+    def aggregateRatings(self, rootPath=None, maxWorkers=None) -> dict:
+        """
+        Compute summary statistics (means, ranks, Friedman/Wilcoxon tests, inter-rater agreement) over all ratings.
+        Can be used without GUI widget.
+        :param rootPath: aggregate the human.json files below this dataset folder instead of the score store
+        :param maxWorkers: number of processes used to parse human.json files
+        """
+        from showImageReportsLib import Aggregation
+        if rootPath:
+            ratings = Aggregation.loadLegacyRatings(rootPath, maxWorkers=maxWorkers)
+        elif self.scoreStore:
+            self.scoreStore.commit()
+            ratings = Aggregation.loadStoreRatings(self.scoreStore)
+        else:
+            raise ValueError("Either a dataset folder or an open score store is required")
+        return Aggregation.summarize(ratings)
+
+    def datasetReportTexts(self, rootPath):
+        """``(caseId, texts)`` of all cases of a dataset, with reports read the same way as for rating.
+        Cases without readable reports are skipped."""
+        worklist = CaseWorklist(rootPath)
+        for index, imagePath in enumerate(worklist.cases):
+            try:
+                reports = self.readReports(imagePath)
+            except Exception as e:
+                logging.warning(f"Skipping reports of {imagePath}: {e}")
+                continue
+            yield worklist.caseId(index), self.reportTexts(reports)
+
+    def setTermVocabulary(self, vocabulary) -> None:
+        """Set the radiology terms highlighted for each criterion, see ``Terms.py``."""
+        self.termVocabulary = vocabulary
+        self.termVocabularyKey = vocabularyHash(vocabulary)
+        self.termAutomaton = None
+
+    def termCriteria(self) -> list:
+        return list(self.termVocabulary)
+
+    def setTermHitCache(self, path) -> None:
+        """Open the term hit cache database at ``path``, or close it if ``path`` is None."""
+        if self.termHitCache:
+            self.termHitCache.close()
+        self.termHitCache = TermHitCache(path) if path else None
+
+    def reportTermHits(self, texts) -> dict:
+        """
+        Term hits of report texts, keyed like ``texts`` (empty texts are left out).
+        Hits are looked up in the term hit cache; texts that are not cached are scanned together in one pass
+        and added to the cache.
+        """
+        present = {column: text for column, text in texts.items() if text}
+        hashes = {column: textHash(text) for column, text in present.items()}
+        hits = self.termHitCache.get(self.termVocabularyKey, set(hashes.values())) if self.termHitCache else {}
+        missing = [column for column in present if hashes[column] not in hits]
+        if missing:
+            if self.termAutomaton is None:
+                self.termAutomaton = TermAutomaton(self.termVocabulary)
+            for column, columnHits in zip(missing, self.termAutomaton.scanAll([present[column] for column in missing])):
+                hits[hashes[column]] = columnHits
+            if self.termHitCache:
+                self.termHitCache.put(self.termVocabularyKey, [(hashes[column], hits[hashes[column]].tobytes()) for column in missing])
+        return {column: hits[hashes[column]] for column in present}
+
+    def precomputeTermHits(self, rootPath, maxWorkers=None, progress=None) -> int:
+        """
+        Scan the reports of all cases of a dataset for radiology terms on a process pool and cache the hits,
+        so that showing a case does no text processing. Can be used without GUI widget.
+        :return: number of scanned report texts, texts that are already cached are not scanned again
+        """
+        if not self.termHitCache:
+            raise ValueError("Term hit cache is not open")
+        texts = (text for _, caseTexts in self.datasetReportTexts(rootPath) for text in caseTexts.values())
+        return precomputeHits(texts, self.termHitCache, self.termVocabulary, maxWorkers, progress)
+
+    def computeReportMetrics(self, rootPath, maxWorkers=None, progress=None) -> int:
+        """
+        Score the model reports of all cases of a dataset against the ground truth report (BLEU, ROUGE-L, chrF,
+        clinical term overlap) and store the results in the score store database, see ``Metrics.py``.
+        Reports are read the same way as for rating. Can be used without GUI widget.
+        :param progress: optional callable ``progress(done, total)``
+        :return: number of scored reports, unchanged reports are not scored again
+        """
+        from showImageReportsLib import Metrics
+        if not self.scoreStore:
+            raise ValueError("Score store is not open")
+        store = Metrics.MetricStore(self.scoreStore.path)
+        try:
+            return Metrics.computeMetrics(self.datasetReportTexts(rootPath), store, maxWorkers=maxWorkers, progress=progress)
+        finally:
+            store.close()
+
+    def reportMetricCorrelations(self) -> dict:
+        """Spearman correlation of each report metric with the mean human score of each criterion."""
+        from showImageReportsLib import Aggregation, Metrics
+        if not self.scoreStore:
+            raise ValueError("Score store is not open")
+        self.scoreStore.commit()
+        store = Metrics.MetricStore(self.scoreStore.path)
+        try:
+            return Metrics.correlateWithRatings(Aggregation.loadStoreRatings(self.scoreStore), store)
+        finally:
+            store.close()
+
+    def exportColumnar(self, outputDirectory, rootPath=None, format=None) -> dict:
+        """
+        Append the ratings and report metrics of the score store, and with ``rootPath`` the report text hashes of
+        the cases of a dataset, that changed since the last export to typed columnar files, see ``Export.py``.
+        Reports are read the same way as for rating. Can be used without GUI widget.
+        :param format: ``parquet``, ``npz`` or ``csv``, by default parquet if pyarrow is installed
+        :return: number of appended rows per table
+        """
+        from showImageReportsLib import Export
+        if not self.scoreStore:
+            raise ValueError("Score store is not open")
+        self.scoreStore.commit()
+        export = Export.ColumnarExport(outputDirectory, format)
+        try:
+            result = {Export.RATINGS_TABLE: export.exportStore(self.scoreStore.path),
+                      Export.METRICS_TABLE: export.exportMetrics(self.scoreStore.path)}
+            if rootPath:
+                result[Export.REPORTS_TABLE] = export.exportReports(self.datasetReportTexts(rootPath), source=rootPath)
+            return result
+        finally:
+            export.close()
+
+    def createVolumeNode(self, volume, name: str) -> vtkMRMLScalarVolumeNode:
+        """Create a scalar volume node from a decoded ``NiftiVolume``.
+        Arrays that the volume owns (e.g. compact volumes) become the image data without being copied."""
+        with self.timings.span("import"):
+            volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+            ijkToRas = vtk.vtkMatrix4x4()
+            slicer.util.updateVTKMatrixFromArray(ijkToRas, volume.ijkToRas)
+            volumeNode.SetIJKToRASMatrix(ijkToRas)
+            if volume.array.flags.c_contiguous and volume.array.flags.writeable:
+                self.wrapArrayInVolume(volumeNode, volume.array)
+            else:
+                slicer.util.updateVolumeFromArray(volumeNode, volume.array)
+            if getattr(volume, "window", None):
+                volumeNode.SetAttribute("showImageReports.WindowPreset", volume.window[0])
+            volumeNode.CreateDefaultDisplayNodes()
+        return volumeNode
+
+    @staticmethod
+    def wrapArrayInVolume(volumeNode, array) -> None:
+        """Use a C-contiguous ``[k, j, i]`` array as the voxel buffer of a volume node. The VTK array keeps
+        a reference to the numpy array, so both share one buffer for the lifetime of the node."""
+        from vtk.util import numpy_support
+
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+        scalars = numpy_support.numpy_to_vtk(array.reshape(-1), deep=False,
+                                             array_type=numpy_support.get_vtk_array_type(array.dtype))
+        imageData.GetPointData().SetScalars(scalars)
+        volumeNode.SetAndObserveImageData(imageData)
+
+    def benchmarkWorklist(self, rootPath, prefetchDepth: int = 3, dwellSeconds: float = 0.0) -> dict:
+        """
+        Walk all cases of a dataset like a rating session, without GUI, and measure throughput.
+        Returns cases per minute, p50/p95 per-case latency in seconds and the per-phase timings.
+        :param dwellSeconds: simulated rating time per case, during which the next cases are prefetched
+        """
+        from showImageReportsLib.Benchmark import runWorklist
+
+        self.timings.reset()
+        self.openWorklist(rootPath, prefetchDepth)
+
+        def showCase(index):
+            case = self.worklistCase(index)
+            if case.error is not None:
+                raise case.error
+            volumeNode = self.caseVolumeNode(case)
+            with self.timings.span("display"):
+                displayNode = volumeNode.GetDisplayNode()
+                displayNode.AutoWindowLevelOff()
+                displayNode.SetWindowLevel(60, 40)
+                if slicer.app.layoutManager():
+                    slicer.util.setSliceViewerLayers(background=volumeNode)
+
+        try:
+            result = runWorklist(showCase, len(self.worklist), dwellSeconds)
+        finally:
+            self.closeWorklist()
+            self.volumePool.clear(remove=True)
+        result["phases"] = self.timings.summary()["phases"]
+        return result
 
     def process(self,
                 inputVolume: vtkMRMLScalarVolumeNode,
@@ -415,7 +1888,6 @@ class showImageReportsLogic(ScriptedLoadableModuleLogic):
         if not inputVolume or not outputVolume:
             raise ValueError("Input or output volume is invalid")
 
-        import time
         startTime = time.time()
         logging.info('Processing started')
 
@@ -455,6 +1927,26 @@ class showImageReportsTest(ScriptedLoadableModuleTest):
         """
         self.setUp()
         self.test_showImageReports1()
+        self.test_niftiWorklist()
+        self.test_volumeNodePool()
+        self.test_volumeCache()
+        self.test_previewPyramid()
+        self.test_scoreStore()
+        self.test_caseIds()
+        self.test_loadBenchmark()
+        self.test_reportCorpus()
+        self.test_datasetIngest()
+        self.test_datasetIndex()
+        self.test_thumbnailAtlas()
+        self.test_adaptiveScheduling()
+        self.test_aggregationStatistics()
+        self.test_reportMetrics()
+        self.test_columnarExport()
+        self.test_termHighlights()
+        self.test_ratingCollection()
+        self.test_startupTimings()
+        self.test_windowPresets()
+        self.test_compactLoadMode()
 
     def test_showImageReports1(self):
         """ Ideally you should have several levels of tests.  At the lowest level
@@ -501,3 +1993,739 @@ class showImageReportsTest(ScriptedLoadableModuleTest):
         self.assertEqual(outputScalarRange[1], inputScalarRange[1])
 
         self.delayDisplay('Test passed')
+
+    def test_niftiWorklist(self):
+        """ Cases are found in a stable order, prefetched in a window, and placed with sform, qform or pixdim.
+        """
+        import struct
+        import tempfile
+        import numpy as np
+        from showImageReportsLib.Benchmark import writeNifti
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            array = np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4)
+            for relativePath in ["b/x.nii", "a/z.nii.gz", "a/y.nii", "c/0.nii"]:
+                os.makedirs(os.path.join(tempDir, os.path.dirname(relativePath)), exist_ok=True)
+                writeNifti(os.path.join(tempDir, relativePath), array, spacing=(0.5, 0.75, 2.0))
+            open(os.path.join(tempDir, "a", "notes.txt"), "w").close()
+            worklist = CaseWorklist(tempDir)
+            self.assertEqual([worklist.caseId(index) for index in range(len(worklist))],
+                             ["a/y.nii", "a/z.nii.gz", "b/x.nii", "c/0.nii"])
+
+            # Only the window [index, index + depth] is decoded
+            decoded = []
+            prefetcher = CasePrefetcher(worklist, depth=1, readVolume=lambda path: decoded.append(path) or readNifti(path),
+                                        readReports=lambda path: {})
+            prefetcher.prefetch(2)
+            volume = prefetcher.get(2).volume
+            prefetcher.get(3)
+            self.assertFalse(prefetcher.isReady(0))
+            self.assertEqual(sorted(decoded), sorted(worklist.cases[2:4]))
+            prefetcher.shutdown()
+            np.testing.assert_array_equal(volume.array, array)
+            np.testing.assert_allclose(volume.ijkToRas, np.diag([0.5, 0.75, 2.0, 1.0]))
+
+            # qform (180 degrees about z: quaternion b=c=0, d=1) when sform_code is 0, then pixdim
+            path = worklist.cases[0]
+            with open(path, "r+b") as f:
+                f.seek(252)
+                f.write(struct.pack("<2h", 1, 0))
+                f.seek(256)
+                f.write(struct.pack("<6f", 0.0, 0.0, 1.0, 10.0, 20.0, 30.0))
+            np.testing.assert_allclose(readNifti(path).ijkToRas, [[-0.5, 0, 0, 10], [0, -0.75, 0, 20], [0, 0, 2.0, 30], [0, 0, 0, 1]])
+            with open(path, "r+b") as f:
+                f.seek(252)
+                f.write(struct.pack("<2h", 0, 0))
+            np.testing.assert_allclose(readNifti(path).ijkToRas, np.diag([0.5, 0.75, 2.0, 1.0]))
+
+        self.delayDisplay('Test passed')
+
+    def test_volumeNodePool(self):
+        """ Pooled volumes are evicted in LRU order once the memory budget is exceeded.
+        """
+        logic = showImageReportsLogic()
+        logic.volumePool.setMemoryBudget(100)
+        nodes = [slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode") for _ in range(3)]
+        logic.volumePool.add("a", nodes[0], 40)
+        logic.volumePool.add("b", nodes[1], 40)
+        self.assertIs(logic.volumePool.get("a"), nodes[0])
+        logic.volumePool.add("c", nodes[2], 40)
+        self.assertIsNone(logic.volumePool.get("b"))
+        self.assertIsNone(nodes[1].GetScene())
+
+        stats = logic.volumePoolStatistics()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["residentBytes"], 80)
+
+        self.delayDisplay('Test passed')
+
+    def test_volumeCache(self):
+        """ Cached volumes are memory mapped, changed sources miss, and least recently used entries are evicted.
+        """
+        import tempfile
+        import time
+        import numpy as np
+        from showImageReportsLib.Benchmark import writeNifti
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = [os.path.join(tempDir, f"case{index}.nii.gz") for index in range(3)]
+            for index, path in enumerate(paths):
+                writeNifti(path, np.full((4, 8, 8), index, dtype=np.int16))
+            # Room for two 512 byte volumes
+            cache = VolumeCache(os.path.join(tempDir, "cache"), maxBytes=1100)
+            self.assertIsNone(cache.lookup(paths[0]))
+            cache.load(paths[0])
+            volume = cache.load(paths[0])
+            self.assertIsInstance(volume.array, np.memmap)
+            self.assertEqual(int(volume.array[0, 0, 0]), 0)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            # A rewritten source (new mtime and size) is not served from the stale entry
+            writeNifti(paths[0], np.full((4, 8, 8), 7, dtype=np.int16), compressLevel=1)
+            self.assertIsNone(cache.lookup(paths[0]))
+            self.assertEqual(int(cache.load(paths[0]).array[0, 0, 0]), 7)
+
+            # Only two volumes fit, so loading case1 and case2 evicts both entries of case0, least recently used first
+            time.sleep(0.01)
+            cache.load(paths[1])
+            time.sleep(0.01)
+            cache.load(paths[2])
+            self.assertIsNone(cache.lookup(paths[0]))
+            self.assertIsNotNone(cache.lookup(paths[1]))
+            self.assertEqual(cache.statistics()["entries"], 2)
+            cache.close()
+
+            warmCache = VolumeCache(os.path.join(tempDir, "warm"))
+            self.assertEqual(warmCache.warmUp(paths, maxWorkers=2), 3)
+            self.assertEqual(warmCache.statistics()["entries"], 3)
+            self.assertIsNotNone(warmCache.windowPresets(warmCache.contentHash(paths[1])))
+            self.assertIsNotNone(warmCache.lookup(paths[2]))
+            warmCache.close()
+
+        self.delayDisplay('Test passed')
+
+    def test_previewPyramid(self):
+        """ Preview levels are block averages that overlay the full volume, the logic finds the finest cached level,
+        and the volume read in the background replaces the preview.
+        """
+        import tempfile
+        import numpy as np
+        from showImageReportsLib.Benchmark import generateDataset
+        from showImageReportsLib.Pyramid import buildPyramid
+
+        array = np.arange(3 * 8 * 8, dtype=np.int16).reshape(3, 8, 8)
+        ijkToRas = np.diag([0.5, 0.5, 2.0, 1.0])
+        ijkToRas[:3, 3] = [10.0, 20.0, 30.0]
+        (level1, ijkToRas1), (level2, ijkToRas2) = buildPyramid(array, ijkToRas, 2)
+        self.assertEqual((level1.shape, level2.shape), ((1, 4, 4), (1, 2, 2)))
+        self.assertEqual(level1.dtype, np.int16)
+        self.assertEqual(int(level1[0, 0, 0]), int(np.rint(array[:2, :2, :2].mean())))
+        # The first voxel of a level is at the center of the block it averages
+        np.testing.assert_allclose(ijkToRas1 @ [0, 0, 0, 1], ijkToRas @ [0.5, 0.5, 0.5, 1])
+        np.testing.assert_allclose(ijkToRas2 @ [1, 1, 0, 1], ijkToRas @ [5.5, 5.5, 0.5, 1])
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            imagePaths = generateDataset(os.path.join(tempDir, "dataset"), cases=1, shape=(8, 32, 32))
+            logic = showImageReportsLogic()
+            self.assertIsNone(logic.casePreview(imagePaths[0]))
+            logic.setVolumeCache(os.path.join(tempDir, "cache"))
+            self.assertIsNone(logic.casePreview(imagePaths[0]))
+            logic.warmUpVolumeCache(os.path.join(tempDir, "dataset"), maxWorkers=1, pyramidLevels=1)
+            logic.previewLevel = 2
+            self.assertEqual(logic.casePreview(imagePaths[0]).array.shape, (4, 16, 16))
+            logic.warmUpVolumeCache(os.path.join(tempDir, "dataset"), maxWorkers=1)
+            self.assertEqual(logic.casePreview(imagePaths[0]).array.shape, (2, 8, 8))
+
+            future = logic.readVolumeInBackground(imagePaths[0])
+            volume = future.result()
+            self.assertEqual(volume.array.shape, (8, 32, 32))
+            volumeNode = logic.loadVolume(imagePaths[0], volume)
+            self.assertIn(imagePaths[0], logic.volumePool)
+            self.assertIs(logic.loadVolume(imagePaths[0]), volumeNode)
+            self.assertIsNone(logic.readVolumeInBackground(imagePaths[0]))
+            slicer.mrmlScene.RemoveNode(volumeNode)
+            logic.setVolumeCache(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_scoreStore(self):
+        """ Scores of several raters are kept apart and progress is answered from the store.
+        """
+        import tempfile
+        from showImageReportsLib import ScoreStore
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            store = ScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            complete = {model: dict.fromkeys(CRITERIA, 3) for model in MODELS}
+            partial = {model: dict.fromkeys(CRITERIA) for model in MODELS}
+            partial["gpt4"]["pos"] = 1
+            store.putScores("case1", "rater1", complete, os.path.join(tempDir, "case1", "image.nii.gz"))
+            store.putScores("case1", "rater2", partial)
+            self.assertEqual(store.commit(), 2 * ScoreStore.CELLS_PER_CASE)
+
+            self.assertEqual(store.completedCases("rater1"), ["case1"])
+            self.assertEqual(store.completedCases("rater2"), [])
+            self.assertEqual(store.progress("rater2"), {"rater2": {"rated": 1, "completed": 0}})
+            self.assertEqual(store.scores("case1", "rater2")["gpt4"]["pos"], 1)
+
+            grid = ScoreGrid()
+            grid.load(store.scores("case1", "rater2"))
+            self.assertFalse(grid.isDirty())
+            self.assertTrue(grid.set("bf", "num", 4))
+            store.putScores("case1", "rater2", grid.takeDirtyScores())
+            self.assertIsNone(store.scores("case1", "rater2")["bf"]["num"])
+            self.assertEqual(store.scores("case1", "rater2", pending=True)["bf"]["num"], 4)
+            store.commit()
+            self.assertEqual(store.scores("case1", "rater2")["bf"]["num"], 4)
+            self.assertEqual(store.scores("case1", "rater2")["gpt4"]["pos"], 1)
+
+            os.makedirs(os.path.join(tempDir, "case1"))
+            with open(store.writeLegacyFile("case1", "rater1"), encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["bf"]["general"], "3")
+
+            # Ratings saved under the absolute image path are merged into the case ID, the later cell wins
+            imagePath = os.path.join(tempDir, "case1", "image.nii.gz")
+            store.putScores(imagePath, "rater1", {"mini": {"general": 1}}, imagePath)
+            store.putScores(imagePath, "rater3", {"mini": {"general": 2}}, imagePath)
+            store.commit()
+            self.assertEqual(store.mergeCases("case1", imagePath), 1)
+            self.assertEqual(store.caseIds(), ["case1"])
+            self.assertEqual(store.scores("case1", "rater1")["mini"]["general"], 1)
+            self.assertEqual(store.scores("case1", "rater1")["bf"]["general"], 3)
+            self.assertEqual(store.scores("case1", "rater3")["mini"]["general"], 2)
+            self.assertEqual(store.imageCaseIds(imagePath), ["case1"])
+            self.assertEqual(store.mergeCases("case1", imagePath), 0)
+            store.close()
+
+        self.delayDisplay('Test passed')
+
+    def test_caseIds(self):
+        """ An image gets the same case ID however it is opened, and older absolute path ratings are merged into it.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            rootPath = os.path.join(tempDir, "dataset")
+            generateDataset(rootPath, cases=2, shape=(8, 16, 16))
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            imagePath = os.path.abspath(CaseWorklist(rootPath).cases[0])
+            caseId = os.path.relpath(imagePath, rootPath).replace(os.sep, "/")
+            # Saved by an earlier version after Open image
+            logic.scoreStore.putScores(imagePath, "rater1", {"mini": {"general": 2}}, imagePath)
+            logic.scoreStore.commit()
+
+            # Outside of any dataset the content hash identifies the image, it is computed when the volume is read
+            logic.readCaseVolume(imagePath)
+            self.assertIn(imagePath, logic.imageHashes)
+            merges = []
+            mergeCases = logic.scoreStore.mergeCases
+            logic.scoreStore.mergeCases = lambda *args: merges.append(args) or mergeCases(*args)
+            contentId = logic.caseIdForImage(imagePath)
+            self.assertTrue(contentId.startswith("sha256:"))
+            self.assertEqual(logic.caseScores(contentId, "rater1")["mini"]["general"], 2)
+            # Ratings under other IDs are only merged the first time the image is seen with an ID
+            self.assertEqual(logic.caseIdForImage(imagePath), contentId)
+            self.assertEqual(len(merges), 1)
+            logic.openWorklist(rootPath, prefetchDepth=0)
+            self.assertEqual(logic.caseIdForImage(imagePath), caseId)
+            self.assertEqual(len(merges), 2)
+            logic.closeWorklist()
+            # Opening the image on its own later keeps the dataset case ID
+            self.assertEqual(logic.caseIdForImage(imagePath), caseId)
+            self.assertEqual(logic.scoreStore.caseIds(), [caseId])
+            self.assertEqual(logic.scoreStore.ratedCases("rater1"), [caseId])
+            logic.setScoreStore(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_loadBenchmark(self):
+        """ Walk a small synthetic dataset through the worklist and report load throughput and latency.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=4, shape=(16, 64, 64))
+            logic = showImageReportsLogic()
+            result = logic.benchmarkWorklist(tempDir, prefetchDepth=2)
+
+        self.assertEqual(result["cases"], 4)
+        self.assertGreater(result["casesPerMinute"], 0)
+        for phase in ("load", "parse", "import", "display"):
+            self.assertEqual(result["phases"][phase]["count"], 4)
+        logging.info(f"Load benchmark: {result['casesPerMinute']:.0f} cases/min, "
+                     f"p50 {result['p50'] * 1000:.1f} ms, p95 {result['p95'] * 1000:.1f} ms")
+
+        self.delayDisplay('Test passed')
+
+    def test_windowPresets(self):
+        """ CT volumes get the CT windows and an automatic window, computed once and then served from the cache.
+        """
+        import tempfile
+        import numpy as np
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            imagePath = generateDataset(tempDir, cases=1, shape=(16, 64, 64))[0]
+            logic = showImageReportsLogic()
+            logic.setVolumeCache(os.path.join(tempDir, "cache"))
+            presets = logic.volumeWindowPresets(imagePath, logic.readVolume(imagePath).array)
+            self.assertEqual([preset[0] for preset in presets], list(PRESET_NAMES))
+            logic.casePresets.clear()
+            self.assertEqual(logic.cachedWindowPresets(imagePath), presets)
+            self.assertEqual(logic.timings.summary()["phases"]["presets"]["count"], 1)
+            logic.setVolumeCache(None)
+
+        # Other modalities only get the automatic window
+        volume = np.zeros((8, 32, 32), dtype=np.float32)
+        volume[2:6, 8:24, 8:24] = np.linspace(100, 900, 16)
+        name, window, level = windowPresets(volume)[0]
+        self.assertEqual(name, "auto")
+        self.assertAlmostEqual(level, 500, delta=50)
+
+        self.delayDisplay('Test passed')
+
+    def test_compactLoadMode(self):
+        """ Compact and display load modes crop to the foreground, narrow the voxels and report their memory.
+        """
+        import tempfile
+        import numpy as np
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            imagePath = generateDataset(tempDir, cases=1, shape=(16, 64, 64))[0]
+            logic = showImageReportsLogic()
+            native = logic.readCaseVolume(imagePath)
+            logic.setLoadMode("compact")
+            compact = logic.readCaseVolume(imagePath)
+            self.assertEqual(compact.array.dtype, np.int16)
+            self.assertLess(compact.nbytes, native.nbytes)
+            (k0, k1), (j0, j1), (i0, i1) = compact.box
+            self.assertTrue(np.array_equal(compact.array, native.array[k0:k1, j0:j1, i0:i1]))
+            logic.setLoadMode("display")
+            display = logic.readCaseVolume(imagePath)
+            self.assertEqual((display.array.dtype, display.window[0]), (np.uint8, "brain"))
+            self.assertIn("display MB/case", logic.timings.summary()["values"])
+            if residentBytes() is not None:
+                # Loads one at a time, so each is measured
+                self.assertEqual(logic.caseMemory["display"][3], 1)
+                self.assertIn("display resident MB/load", logic.timings.summary()["values"])
+            self.assertRaises(ValueError, logic.setLoadMode, "lossy")
+
+            # The node shares the compact array instead of copying it
+            volumeNode = logic.createVolumeNode(display, "display")
+            self.assertTrue(np.shares_memory(slicer.util.arrayFromVolume(volumeNode), display.array))
+            self.assertEqual(volumeNode.GetAttribute("showImageReports.WindowPreset"), "brain")
+            slicer.mrmlScene.RemoveNode(volumeNode)
+
+        self.delayDisplay('Test passed')
+
+    def test_reportCorpus(self):
+        """ Lines appended to a report corpus are indexed without reindexing the rest, and a case missing
+        from the corpora is looked up again after indexing them.
+        """
+        import tempfile
+        from showImageReportsLib.Reports import ReportCorpus
+
+        def appendLines(path, records, tail=""):
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+                f.write(tail)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            corpusPath = os.path.join(tempDir, "run1.jsonl")
+            appendLines(corpusPath, [{"id": f"case{index}", "minimed": f"report {index}"} for index in range(3)])
+            corpus = ReportCorpus(corpusPath)
+            self.assertEqual(len(corpus), 3)
+            self.assertEqual(corpus.update(), 0)
+
+            # A correction of case1, a new case, and a line that is still being written
+            appendLines(corpusPath, [{"id": "case1", "minimed": "corrected"}, {"id": "case3", "minimed": "report 3"}],
+                        tail='{"id": "case4"')
+            self.assertEqual(corpus.update(), 2)
+            self.assertEqual(len(corpus), 4)
+            self.assertEqual(corpus.get("case1")["minimed"], "corrected")
+            self.assertIsNone(corpus.get("case4"))
+            appendLines(corpusPath, [], tail=', "minimed": "report 4"}\n')
+            self.assertEqual(corpus.update(), 1)
+            self.assertEqual(corpus.get("case4")["minimed"], "report 4")
+
+            # A rewritten corpus is indexed from the start
+            with open(corpusPath, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"id": "case0", "minimed": "rewritten"}) + "\n")
+            self.assertEqual(corpus.update(), 1)
+            self.assertEqual(corpus.caseIds(), ["case0"])
+            corpus.close()
+
+            logic = showImageReportsLogic()
+            logic.setReportCorpora([corpusPath])
+            imagePath = os.path.join(tempDir, "case5", "image.nii.gz")
+            with self.assertRaises(KeyError):
+                logic.readReports(imagePath)
+            appendLines(corpusPath, [{"id": "case5", "minimed": "report 5"}])
+            self.assertEqual(logic.readReports(imagePath)["minimed"], "report 5")
+            logic.setReportCorpora(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_datasetIngest(self):
+        """ Cases with corrupt images or incomplete reports are found by the ingest and left out of the worklist,
+        and a manifest that misses added or removed cases is updated when the dataset is opened.
+        """
+        import shutil
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            imagePaths = generateDataset(tempDir, cases=4, shape=(16, 64, 64))
+            with open(imagePaths[1], "r+b") as f:
+                f.truncate(os.path.getsize(imagePaths[1]) // 2)
+            with open(os.path.join(os.path.dirname(imagePaths[2]), "reports.json"), "w", encoding="utf-8") as f:
+                json.dump({"gt": "x", "minimed": "x"}, f)
+
+            logic = showImageReportsLogic()
+            summary = logic.ingestDataset(tempDir, maxWorkers=2)
+            self.assertEqual((summary["valid"], summary["invalid"]), (2, 2))
+            worklist = logic.openWorklist(tempDir)
+            self.assertEqual(worklist.cases, [os.path.abspath(imagePaths[0]), os.path.abspath(imagePaths[3])])
+            self.assertEqual(len(logic.skippedCases), 2)
+            logic.closeWorklist()
+
+            manifest = DatasetManifest(os.path.join(tempDir, MANIFEST_FILE_NAME))
+            self.assertFalse(manifest.isStale(tempDir))
+            # Files saved next to the images do not make the manifest stale
+            with open(os.path.join(os.path.dirname(imagePaths[0]), "human.json"), "w", encoding="utf-8") as f:
+                json.dump({}, f)
+            self.assertFalse(manifest.isStale(tempDir))
+            addedDir = os.path.join(tempDir, "case00009")
+            shutil.copytree(os.path.dirname(imagePaths[0]), addedDir)
+            self.assertTrue(manifest.isStale(tempDir))
+            progress = []
+            worklist = logic.openWorklist(tempDir, progress=lambda done, total: progress.append((done, total)))
+            self.assertEqual(progress, [(0, 1), (1, 1)])
+            self.assertIn(os.path.join(os.path.abspath(addedDir), os.path.basename(imagePaths[0])), worklist.cases)
+            self.assertEqual(len(worklist), 3)
+            logic.closeWorklist()
+            self.assertFalse(manifest.isStale(tempDir))
+            shutil.rmtree(os.path.dirname(imagePaths[3]))
+            self.assertTrue(manifest.isStale(tempDir))
+            self.assertEqual(len(logic.openWorklist(tempDir)), 2)
+            logic.closeWorklist()
+            manifest.close()
+
+        self.delayDisplay('Test passed')
+
+    def test_datasetIndex(self):
+        """ The dataset index picks up new cases and reports incrementally and answers dataset queries.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+        from showImageReportsLib.Worklist import findCases
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            imagePaths = generateDataset(tempDir, cases=3, shape=(8, 32, 32))
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            self.assertEqual(logic.updateDatasetIndex(tempDir)["changed"], 6)
+            self.assertEqual(logic.updateDatasetIndex(tempDir)["removed"], 0)
+
+            # A new case and a report that is replaced without its model outputs
+            newCase = generateDataset(os.path.join(tempDir, "new"), cases=1, shape=(8, 32, 32))[0]
+            reportsPath = os.path.join(os.path.dirname(imagePaths[1]), "reports.json")
+            with open(reportsPath + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"gt": "x"}, f)
+            os.replace(reportsPath + ".tmp", reportsPath)
+            logic.updateDatasetIndex(tempDir)
+
+            caseIds = [os.path.relpath(path, tempDir).replace(os.sep, "/") for path in findCases(tempDir)]
+            self.assertIn(os.path.relpath(newCase, tempDir).replace(os.sep, "/"), caseIds)
+            worklist = logic.openWorklist(tempDir)
+            self.assertEqual(worklist.cases, findCases(tempDir))
+            logic.closeWorklist()
+            self.assertEqual(logic.casesMissingReport(tempDir, "gpt4"), [caseIds[1]])
+            logic.saveScores(caseIds[0], "rater1", {"mini": {"general": 3}}, writeLegacy=False)
+            self.assertEqual(logic.unratedCases(tempDir, "rater1"), caseIds[1:])
+            logic.setScoreStore(None)
+
+            # A reports.json rewritten in place leaves the mtime of its directory unchanged
+            past = time.time() - 60.0
+            for dirPath, _, fileNames in os.walk(tempDir):
+                for path in [dirPath] + [os.path.join(dirPath, fileName) for fileName in fileNames]:
+                    os.utime(path, (past, past))
+            logic.updateDatasetIndex(tempDir)
+            self.assertEqual(logic.updateDatasetIndex(tempDir)["changed"], 0)
+            with open(os.path.join(os.path.dirname(imagePaths[0]), "reports.json"), encoding="utf-8") as f:
+                reports = f.read()
+            with open(reportsPath, "w", encoding="utf-8") as f:
+                f.write(reports)
+            os.utime(os.path.dirname(reportsPath), (past, past))
+            self.assertEqual(logic.updateDatasetIndex(tempDir)["changed"], 1)
+            self.assertEqual(logic.casesMissingReport(tempDir, "gpt4"), [])
+
+        self.delayDisplay('Test passed')
+
+    def test_thumbnailAtlas(self):
+        """ Thumbnails of all cases are rendered into the atlas once and read back page by page.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=3, shape=(16, 64, 64))
+            logic = showImageReportsLogic()
+            self.assertIsNone(logic.openThumbnailAtlas(tempDir))
+            self.assertEqual(logic.buildThumbnailAtlas(tempDir, maxWorkers=2), 3)
+            self.assertEqual(logic.buildThumbnailAtlas(tempDir, maxWorkers=2), 0)
+            page = logic.openThumbnailAtlas(tempDir).page(1, 10)
+            self.assertEqual([caseId for caseId, _, _ in page], ["case00001/image.nii.gz", "case00002/image.nii.gz"])
+            self.assertEqual(page[0][2].shape, (128, 128))
+            self.assertGreater(page[0][2].max(), 0)
+            self.assertTrue(qt.QPixmap().loadFromData(pgmBytes(page[0][2]), "PGM"))
+            logic.closeThumbnailAtlas()
+
+        self.delayDisplay('Test passed')
+
+    def test_adaptiveScheduling(self):
+        """ Saves and autosaves are timed, and the adaptive order prefers cases that lack ratings over ones rated once,
+        and never offers a rater a case they rated.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=4, shape=(8, 32, 32))
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            logic.setEventLog(os.path.join(tempDir, "telemetry"))
+            worklist = logic.openWorklist(tempDir)
+            caseIds = [worklist.caseId(index) for index in range(len(worklist))]
+            self.assertEqual(logic.nextScheduledCase("rater2"), 0)
+            scheduler = logic.scheduler
+
+            allScores = lambda score: {model: dict.fromkeys(CRITERIA, score) for model in MODELS}
+            for caseId, rater, score in [(caseIds[0], "rater1", 4), (caseIds[0], "rater2", 0), (caseIds[1], "rater1", 2)]:
+                # Sessions of about a minute each, so that no case gets a time factor from sub-millisecond gaps
+                logic.eventLog.record(LOAD_EVENT, caseId, rater, timestamp=time.time() - 60.0)
+                logic.eventLog.record(EDIT_EVENT, caseId, rater, MODELS[0], CRITERIA[0], score, timestamp=time.time() - 30.0)
+                logic.saveScores(caseId, rater, allScores(score), writeLegacy=False)
+            self.assertIs(logic.scheduler, scheduler)
+            self.assertEqual(logic.nextScheduledCase("rater2"), 2)
+            self.assertEqual(logic.nextScheduledCase("rater1"), 2)
+            self.assertEqual(logic.raterThroughput()["rater1"]["cases"], 2)
+
+            # Autosaves update the order and the event log as well, and a session saved twice is one rated case
+            logic.eventLog.record(LOAD_EVENT, caseIds[2], "rater3", timestamp=time.time() - 60.0)
+            # The autosaved cell counts before the autosave thread committed it
+            autosaveBlocked = threading.Event()
+            logic.autosaveExecutor = ThreadPoolExecutor(max_workers=1)
+            logic.autosaveExecutor.submit(autosaveBlocked.wait)
+            try:
+                logic.autosaveScores(caseIds[2], "rater3", {MODELS[0]: {CRITERIA[0]: 1}})
+                self.assertNotIn(caseIds[2], logic.scheduler.nextCases("rater3", count=len(caseIds)))
+            finally:
+                autosaveBlocked.set()
+            self.assertEqual(logic.nextScheduledCase("rater2"), 3)
+            logic.saveScores(caseIds[2], "rater3", allScores(1), writeLegacy=False)
+            self.assertAlmostEqual(logic.eventLog.sessionThroughput("rater3"), 60.0, delta=1.0)
+            logic.closeWorklist()
+            logic.setEventLog(None)
+            logic.setScoreStore(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_aggregationStatistics(self):
+        """ The Friedman test, Wilcoxon test, Kendall's W and Krippendorff's alpha match known values on small rating arrays.
+        """
+        import numpy as np
+        from showImageReportsLib import Aggregation
+
+        # Six cases rated on four models; values checked against scipy.stats.friedmanchisquare and wilcoxon.
+        blocks = np.array([[4, 3, 2, 1], [3, 3, 1, 0], [4, 2, 2, 1], [2, 4, 1, 1], [3, 2, 0, 1], [4, 3, 3, 2]], float)
+        friedman = Aggregation.friedmanTest(blocks)
+        self.assertEqual(friedman["n"], 6)
+        self.assertAlmostEqual(friedman["statistic"], 14.678571428571, places=9)
+        self.assertAlmostEqual(friedman["pvalue"], 0.002112991021, places=9)
+        wilcoxon = Aggregation.wilcoxonTest(blocks[:, 0], blocks[:, 2])
+        self.assertEqual(wilcoxon["n"], 6)
+        self.assertAlmostEqual(wilcoxon["pvalue"], 0.025596805386, places=9)
+
+        # Three raters ranking five items, with one tie: W = 12 * 75.5 / (9 * 120 - 3 * 6).
+        judgements = np.array([[4, 3, 2, 1, 0], [4, 2, 3, 1, 1], [3, 4, 2, 0, 1]], float)
+        self.assertAlmostEqual(Aggregation.kendallW(judgements), 906.0 / 1062.0, places=12)
+
+        # Six units rated by three raters with missing ratings; values checked against the krippendorff package.
+        units = np.array([[4, 4, 3], [2, 2, np.nan], [1, 0, 1], [3, 3, 3], [0, 1, np.nan], [2, 4, 3]], float)
+        self.assertAlmostEqual(Aggregation.krippendorffAlpha(units, "nominal"), 0.325, places=9)
+        self.assertAlmostEqual(Aggregation.krippendorffAlpha(units, "ordinal"), 0.778303709428, places=9)
+        self.assertAlmostEqual(Aggregation.krippendorffAlpha(units, "interval"), 0.791666666667, places=9)
+
+        self.delayDisplay('Test passed')
+
+    def test_reportMetrics(self):
+        """ Model reports are scored against the ground truth and the metrics can be correlated with the ratings.
+        """
+        import tempfile
+        from showImageReportsLib import Metrics
+        from showImageReportsLib.Benchmark import generateDataset
+
+        reference = "左侧额叶见片状高密度影，边界清楚，中线结构居中。"
+        self.assertEqual(Metrics.scoreReport(reference, reference), {"bleu": 1.0, "rougeL": 1.0, "chrf": 1.0, "termF1": 1.0})
+        self.assertEqual(Metrics.scoreReport("No acute findings.", reference)["rougeL"], 0.0)
+        # Latin terms only match whole words
+        self.assertEqual(Metrics.mentionedTerms("Massive midline shift, 中线结构居中。"), {"midline", "shift", "中线"})
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=3, shape=(8, 16, 16))
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            self.assertEqual(logic.computeReportMetrics(tempDir), 3 * len(MODELS))
+            self.assertEqual(logic.computeReportMetrics(tempDir), 0)
+            for index, caseId in enumerate(CaseWorklist(tempDir).cases):
+                caseId = os.path.relpath(caseId, tempDir).replace(os.sep, "/")
+                scores = {model: dict.fromkeys(CRITERIA, (index + modelIndex) % 5) for modelIndex, model in enumerate(MODELS)}
+                logic.saveScores(caseId, "rater1", scores, writeLegacy=False)
+            correlations = logic.reportMetricCorrelations()
+            self.assertEqual(correlations["bleu"]["general"]["n"], 3 * len(MODELS))
+            logic.setScoreStore(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_columnarExport(self):
+        """ Ratings, report hashes and metrics are exported to typed columns, and again only when they changed.
+        """
+        import sqlite3
+        import tempfile
+        import numpy as np
+        from showImageReportsLib.Benchmark import generateDataset
+        from showImageReportsLib.Export import METRICS_TABLE, RATINGS_TABLE, REPORTS_TABLE, readTable
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=3, shape=(8, 16, 16))
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            logic.computeReportMetrics(tempDir)
+            caseIds = [os.path.relpath(imagePath, tempDir).replace(os.sep, "/") for imagePath in CaseWorklist(tempDir).cases]
+            for index, caseId in enumerate(caseIds):
+                scores = {model: dict.fromkeys(CRITERIA, index % 5) for model in MODELS}
+                scores[MODELS[0]][CRITERIA[0]] = None
+                logic.saveScores(caseId, "rater1", scores, writeLegacy=False)
+            exportDir = os.path.join(tempDir, "export")
+            appended = logic.exportColumnar(exportDir, tempDir, format="npz")
+            self.assertEqual(appended, {RATINGS_TABLE: 3 * len(MODELS), METRICS_TABLE: 3 * len(MODELS),
+                                        REPORTS_TABLE: 3 * (len(MODELS) + 1)})
+            self.assertEqual(logic.exportColumnar(exportDir, tempDir, format="npz"),
+                             {RATINGS_TABLE: 0, METRICS_TABLE: 0, REPORTS_TABLE: 0})
+            # Saved again with the same scores, and a row that arrives late with an old updated time
+            logic.saveScores(caseIds[0], "rater1", {MODELS[1]: dict.fromkeys(CRITERIA, 0)}, writeLegacy=False)
+            db = sqlite3.connect(logic.scoreStore.path)
+            with db:
+                db.execute("INSERT INTO ratings VALUES (?, ?, ?, ?, ?, ?)",
+                           (caseIds[0], "rater2", MODELS[0], CRITERIA[1], 3, 1.0))
+            db.close()
+            self.assertEqual(logic.exportColumnar(exportDir, tempDir, format="npz")[RATINGS_TABLE], 1)
+            # Ratings moved to another case ID and removed reports are appended as deleted
+            imagePath = os.path.join(tempDir, caseIds[1])
+            logic.scoreStore.putScores(imagePath, "rater4", {MODELS[0]: {CRITERIA[1]: 2}}, imagePath)
+            logic.scoreStore.commit()
+            self.assertEqual(logic.exportColumnar(exportDir, tempDir, format="npz")[RATINGS_TABLE], 1)
+            logic.scoreStore.mergeCases(caseIds[1], imagePath)
+            os.remove(os.path.join(os.path.dirname(imagePath), "reports.json"))
+            appended = logic.exportColumnar(exportDir, tempDir, format="npz")
+            self.assertEqual((appended[RATINGS_TABLE], appended[REPORTS_TABLE]), (2, len(MODELS) + 1))
+
+            ratings = readTable(exportDir, RATINGS_TABLE)
+            self.assertEqual(len(ratings["caseId"]), 3 * len(MODELS) + 2)
+            self.assertNotIn(imagePath, ratings["caseId"])
+            self.assertEqual(ratings[CRITERIA[1]].dtype, np.int8)
+            unrated = (ratings["model"] == MODELS[0])
+            self.assertTrue(ratings[CRITERIA[0]].mask[unrated].all())
+            self.assertFalse(ratings[CRITERIA[1]].mask.any())
+            self.assertEqual(len(readTable(exportDir, REPORTS_TABLE)["textHash"]), 2 * (len(MODELS) + 1))
+            self.assertEqual(len(readTable(exportDir, REPORTS_TABLE, latest=False)["textHash"]), 4 * (len(MODELS) + 1))
+            logic.setScoreStore(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_ratingCollection(self):
+        """ Saved scores are spooled while the collection server is down and submitted once it is reachable.
+        """
+        import tempfile
+        import threading
+        from showImageReportsLib.Collection import CollectionServer, exportSubmissions
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            server = CollectionServer(os.path.join(tempDir, "collected.sqlite"), port=0)
+            url = f"http://127.0.0.1:{server.server_port}"
+            logic = showImageReportsLogic()
+            logic.setScoreStore(os.path.join(tempDir, "scores.sqlite"))
+            # Nothing is listening yet, the submission stays in the spool
+            server.server_close()
+            logic.setCollectionServer(url)
+            client = logic.submissionClient
+            client.stop()
+            scores = {model: {criterion: 3 for criterion in CRITERIA} for model in MODELS}
+            logic.saveScores("case1", "rater1", scores, writeLegacy=False)
+            self.assertEqual(client.flushAll(), 0)
+            self.assertEqual(client.pending(), 1)
+
+            server = CollectionServer(os.path.join(tempDir, "collected.sqlite"), port=server.server_port)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.assertEqual(client.flushAll(), 0)
+            client.retryNow()
+            self.assertEqual(client.flushAll(), 1)
+            self.assertEqual(client.pending(), 0)
+            # Retrying an already applied submission is acknowledged without applying it again
+            self.assertEqual(server.applySubmissions([{"caseId": "case1", "rater": "rater1", "revision": 0,
+                                                       "scores": {}}])[0], 0)
+            logic.setCollectionServer(None)
+            server.shutdown()
+            server.server_close()
+
+            collected = ScoreStore(os.path.join(tempDir, "exported.sqlite"))
+            self.assertEqual(exportSubmissions(os.path.join(tempDir, "collected.sqlite"), collected), 1)
+            self.assertEqual(collected.scores("case1", "rater1"), scores)
+            collected.close()
+            logic.setScoreStore(None)
+
+        self.delayDisplay('Test passed')
+
+    def test_startupTimings(self):
+        """ Module import is timed and the parameter node class is only created when it is first used.
+        """
+        self.assertGreater(_startupSeconds["moduleImport"], 0)
+        logic = showImageReportsLogic()
+        self.assertIsInstance(logic.getParameterNode(), parameterNodeClass())
+        self.assertIs(parameterNodeClass(), parameterNodeClass())
+
+        self.delayDisplay('Test passed')
+
+    def test_termHighlights(self):
+        """ Radiology terms are found per criterion and their hits are served from the cache after precomputing.
+        """
+        import tempfile
+        from showImageReportsLib.Benchmark import generateDataset
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            generateDataset(tempDir, cases=2, shape=(8, 16, 16))
+            logic = showImageReportsLogic()
+            logic.setTermHitCache(os.path.join(tempDir, "termHits.sqlite"))
+            self.assertGreater(logic.precomputeTermHits(tempDir), 0)
+            self.assertEqual(logic.precomputeTermHits(tempDir), 0)
+
+            texts = {"gt": "左侧额叶见片状高密度影，边界清楚", "gpt4": "A hyperdense lesion, leftover"}
+            hits = logic.reportTermHits(texts)
+            criteria = logic.termCriteria()
+            found = {(texts["gt"][start:end], criteria[c]) for start, end, c in hits["gt"]}
+            self.assertTrue({("左侧", "pos"), ("片状", "xing"), ("高密度", "midu"), ("边界清楚", "bian")} <= found)
+            self.assertEqual([criteria[c] for _, _, c in hits["gpt4"]], ["midu"])
+            self.assertIn("background-color", highlightHtml(texts["gt"], hits["gt"], criteria))
+            logic.setTermHitCache(None)
+
+        self.delayDisplay('Test passed')
+
+
+_startupSeconds["moduleImport"] = time.perf_counter() - _IMPORT_START_TIME
@@ -0,0 +1,374 @@
+"""
+Headless aggregation of collected ratings.
+
+Ratings are gathered from legacy ``human.json`` files or from a score store
+into one array shaped case x rater x model x criterion (NaN where a cell was
+not rated). All statistics are computed with vectorized NumPy code on that
+array: per-model means, rank distributions, Friedman and Wilcoxon
+signed-rank tests between models, and inter-rater agreement (Kendall's W and
+Krippendorff's alpha). SciPy is not required.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Aggregation --dataset /path/to/dataset --output summary.json
+    PythonSlicer -m showImageReportsLib.Aggregation --store scores.sqlite --output summary.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from itertools import combinations
+
+import numpy as np
+
+from .FileUtils import processPool
+from .ScoreStore import LEGACY_FILE_NAME, ScoreStore
+from .Scores import CRITERIA, MAX_SCORE, MIN_SCORE, MODELS, parseScore
+
+LEGACY_RATER = "human"
+PARSE_CHUNK_SIZE = 256
+
+
+class RatingArray:
+    """Scores of all cases as a float32 array ``scores[case, rater, model, criterion]`` with NaN for unrated cells."""
+
+    def __init__(self, scores: np.ndarray, caseIds, raters, models=MODELS, criteria=CRITERIA) -> None:
+        self.scores = scores
+        self.caseIds = list(caseIds)
+        self.raters = list(raters)
+        self.models = list(models)
+        self.criteria = list(criteria)
+
+    @property
+    def shape(self):
+        return self.scores.shape
+
+
+#
+# Loading
+#
+
+def findLegacyFiles(rootPath) -> list:
+    paths = []
+    for dirPath, dirNames, fileNames in os.walk(rootPath):
+        dirNames.sort()
+        if LEGACY_FILE_NAME in fileNames:
+            paths.append(os.path.join(dirPath, LEGACY_FILE_NAME))
+    return paths
+
+
+def parseLegacyFiles(paths) -> np.ndarray:
+    """Parse human.json files into a ``(len(paths), models, criteria)`` array. Unreadable files give NaN rows.
+    Runs in process pool workers."""
+    scores = np.full((len(paths), len(MODELS), len(CRITERIA)), np.nan, dtype=np.float32)
+    for index, path in enumerate(paths):
+        try:
+            with open(path, encoding="utf-8") as f:
+                legacyScores = json.load(f)
+            for modelIndex, model in enumerate(MODELS):
+                modelScores = legacyScores.get(model, {})
+                for criterionIndex, criterion in enumerate(CRITERIA):
+                    score = parseScore(modelScores.get(criterion))
+                    if score is not None:
+                        scores[index, modelIndex, criterionIndex] = score
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f"Skipping unreadable ratings file {path}: {e}")
+    return scores
+
+
+def loadLegacyRatings(rootPath, rater=LEGACY_RATER, maxWorkers=None) -> RatingArray:
+    """Collect all human.json files below ``rootPath``. Parsing is spread over a process pool for large datasets."""
+    paths = findLegacyFiles(rootPath)
+    caseIds = [os.path.relpath(os.path.dirname(path), rootPath).replace(os.sep, "/") for path in paths]
+    chunks = [paths[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(paths), PARSE_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        parsed = [parseLegacyFiles(chunk) for chunk in chunks]
+    else:
+        with processPool(maxWorkers) as executor:
+            parsed = list(executor.map(parseLegacyFiles, chunks))
+    if parsed:
+        scores = np.concatenate(parsed)
+    else:
+        scores = np.empty((0, len(MODELS), len(CRITERIA)), dtype=np.float32)
+    return RatingArray(scores[:, np.newaxis], caseIds, [rater])
+
+
+def loadStoreRatings(store) -> RatingArray:
+    """Collect all ratings of a score store (``ScoreStore`` or path to its database)."""
+    if not isinstance(store, ScoreStore):
+        store = ScoreStore(store)
+    rows = store.allRatings()
+    if not rows:
+        return RatingArray(np.empty((0, 0, len(MODELS), len(CRITERIA)), dtype=np.float32), [], [])
+    caseColumn, raterColumn, modelColumn, criterionColumn, scoreColumn = zip(*rows)
+    caseIds, caseIndex = np.unique(np.array(caseColumn, dtype=object).astype(str), return_inverse=True)
+    raters, raterIndex = np.unique(np.array(raterColumn, dtype=object).astype(str), return_inverse=True)
+    modelLookup = {model: i for i, model in enumerate(MODELS)}
+    criterionLookup = {criterion: i for i, criterion in enumerate(CRITERIA)}
+    modelIndex = np.array([modelLookup.get(model, -1) for model in modelColumn])
+    criterionIndex = np.array([criterionLookup.get(criterion, -1) for criterion in criterionColumn])
+    known = (modelIndex >= 0) & (criterionIndex >= 0)
+    scores = np.full((len(caseIds), len(raters), len(MODELS), len(CRITERIA)), np.nan, dtype=np.float32)
+    scores[caseIndex[known], raterIndex[known], modelIndex[known], criterionIndex[known]] = \
+        np.array(scoreColumn, dtype=np.float32)[known]
+    return RatingArray(scores, caseIds, raters)
+
+
+#
+# Statistics helpers
+#
+
+def rankData(values: np.ndarray) -> np.ndarray:
+    """Ascending ranks of a 1D array, ties get the average rank."""
+    sorter = np.argsort(values, kind="mergesort")
+    inverse = np.empty(sorter.size, dtype=np.intp)
+    inverse[sorter] = np.arange(sorter.size)
+    sortedValues = values[sorter]
+    firstOfGroup = np.r_[True, sortedValues[1:] != sortedValues[:-1]]
+    dense = firstOfGroup.cumsum()[inverse]
+    groupStarts = np.r_[np.nonzero(firstOfGroup)[0], len(firstOfGroup)]
+    return 0.5 * (groupStarts[dense] + groupStarts[dense - 1] + 1)
+
+
+def rankRows(values: np.ndarray):
+    """Ascending ranks along the last axis (which must be short), ties get the average rank.
+    Also returns the tie term ``sum(t^3 - t)`` of each row."""
+    less = (values[..., np.newaxis, :] < values[..., :, np.newaxis]).sum(axis=-1)
+    equal = (values[..., np.newaxis, :] == values[..., :, np.newaxis]).sum(axis=-1)
+    ranks = less + 0.5 * (equal + 1)
+    # A tie group of size t contributes t elements that each see t equal values: t * (t^2 - 1) = t^3 - t
+    ties = (equal.astype(np.float64) ** 2 - 1).sum(axis=-1)
+    return ranks, ties
+
+
+def tieTerm(values: np.ndarray) -> float:
+    _, counts = np.unique(values, return_counts=True)
+    return float((counts.astype(np.float64) ** 3 - counts).sum())
+
+
+def chi2Survival(x: float, df: int) -> float:
+    """Upper tail probability of the chi-square distribution (regularized upper incomplete gamma)."""
+    if x <= 0:
+        return 1.0
+    a, x = df / 2.0, x / 2.0
+    logPrefix = -x + a * math.log(x) - math.lgamma(a)
+    if x < a + 1:
+        # Series for the lower incomplete gamma
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(logPrefix))
+    # Continued fraction for the upper incomplete gamma (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(logPrefix) * h)
+
+
+def normalTwoSided(z: float) -> float:
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def completeBlocks(ratings: RatingArray, criterionIndex) -> np.ndarray:
+    """Case x rater blocks in which all models were scored for a criterion, as ``(blocks, models)``."""
+    blocks = ratings.scores[:, :, :, criterionIndex].reshape(-1, len(ratings.models))
+    return blocks[~np.isnan(blocks).any(axis=1)]
+
+
+#
+# Statistics
+#
+
+def modelMeans(ratings: RatingArray):
+    """Mean score per model and criterion over all cases and raters, and the number of scores it is based on."""
+    valid = ~np.isnan(ratings.scores)
+    counts = valid.sum(axis=(0, 1))
+    totals = np.where(valid, ratings.scores, 0).sum(axis=(0, 1), dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / counts, counts
+
+
+def rankDistribution(ratings: RatingArray):
+    """Rank of each model within every complete case x rater block (1 = best, ties share the average rank).
+    Returns the mean rank ``(models, criteria)`` and the fraction of blocks in which each model reached
+    each half-integer rank ``(models, criteria, 2 * models - 1)`` for ranks ``1, 1.5, ..., models``."""
+    modelCount = len(ratings.models)
+    meanRank = np.full((modelCount, len(ratings.criteria)), np.nan)
+    distribution = np.zeros((modelCount, len(ratings.criteria), 2 * modelCount - 1))
+    for criterionIndex in range(len(ratings.criteria)):
+        blocks = completeBlocks(ratings, criterionIndex)
+        if len(blocks) == 0:
+            continue
+        ranks, _ = rankRows(-blocks)
+        meanRank[:, criterionIndex] = ranks.mean(axis=0)
+        bins = np.rint((ranks - 1) * 2).astype(np.intp)
+        for modelIndex in range(modelCount):
+            distribution[modelIndex, criterionIndex] = np.bincount(bins[:, modelIndex], minlength=2 * modelCount - 1) / len(blocks)
+    return meanRank, distribution
+
+
+def friedmanTest(blocks: np.ndarray) -> dict:
+    """Friedman test over complete blocks ``(n, k)`` with tie correction."""
+    n, k = blocks.shape
+    if n < 2 or k < 2:
+        return {"statistic": math.nan, "pvalue": math.nan, "n": int(n)}
+    ranks, ties = rankRows(blocks)
+    rankSums = ranks.sum(axis=0)
+    statistic = 12.0 / (n * k * (k + 1)) * (rankSums ** 2).sum() - 3.0 * n * (k + 1)
+    correction = 1.0 - ties.sum() / (n * (k ** 3 - k))
+    statistic = statistic / correction if correction > 0 else math.nan
+    pvalue = chi2Survival(statistic, k - 1) if not math.isnan(statistic) else math.nan
+    return {"statistic": float(statistic), "pvalue": float(pvalue), "n": int(n)}
+
+
+def wilcoxonTest(a: np.ndarray, b: np.ndarray) -> dict:
+    """Two-sided Wilcoxon signed-rank test (zero differences dropped, normal approximation with tie correction)."""
+    differences = (a - b)[a != b]
+    n = differences.size
+    if n == 0:
+        return {"statistic": math.nan, "pvalue": math.nan, "n": 0}
+    ranks = rankData(np.abs(differences))
+    positive = ranks[differences > 0].sum()
+    mean = n * (n + 1) / 4.0
+    variance = n * (n + 1) * (2 * n + 1) / 24.0 - tieTerm(np.abs(differences)) / 48.0
+    z = (positive - mean) / math.sqrt(variance) if variance > 0 else 0.0
+    return {"statistic": float(positive), "pvalue": normalTwoSided(z), "z": float(z), "n": int(n)}
+
+
+def kendallW(judgements: np.ndarray) -> float:
+    """Kendall's coefficient of concordance of ``(raters, items)`` with tie correction; items must be complete."""
+    m, n = judgements.shape
+    if m < 2 or n < 2:
+        return math.nan
+    ranks = np.stack([rankData(row) for row in judgements])
+    rankSums = ranks.sum(axis=0)
+    s = ((rankSums - rankSums.mean()) ** 2).sum()
+    ties = sum(tieTerm(row) for row in judgements)
+    denominator = m ** 2 * (n ** 3 - n) - m * ties
+    return float(12.0 * s / denominator) if denominator > 0 else math.nan
+
+
+def krippendorffAlpha(units: np.ndarray, level="interval") -> float:
+    """Krippendorff's alpha of ``(units, raters)`` with NaN for missing values.
+    Values must be integers in ``MIN_SCORE..MAX_SCORE``; ``level`` is "nominal", "ordinal" or "interval"."""
+    values = np.arange(MIN_SCORE, MAX_SCORE + 1)
+    present = ~np.isnan(units)
+    pairable = present.sum(axis=1) >= 2
+    units, present = units[pairable], present[pairable]
+    if len(units) == 0:
+        return math.nan
+    # counts[u, v]: how many raters gave value v to unit u
+    counts = np.zeros((len(units), len(values)))
+    unitIndex = np.nonzero(present)[0]
+    valueIndex = (units[present] - MIN_SCORE).astype(np.intp)
+    np.add.at(counts, (unitIndex, valueIndex), 1)
+    weights = 1.0 / (present.sum(axis=1) - 1)
+    coincidences = (counts * weights[:, np.newaxis]).T @ counts - np.diag((counts * weights[:, np.newaxis]).sum(axis=0))
+    marginals = coincidences.sum(axis=0)
+    total = marginals.sum()
+    if level == "nominal":
+        delta = (values[:, np.newaxis] != values[np.newaxis, :]).astype(np.float64)
+    elif level == "ordinal":
+        cumulative = np.cumsum(marginals)
+        between = cumulative[np.maximum.outer(np.arange(len(values)), np.arange(len(values)))] \
+            - cumulative[np.minimum.outer(np.arange(len(values)), np.arange(len(values)))] \
+            + marginals[np.minimum.outer(np.arange(len(values)), np.arange(len(values)))]
+        delta = (between - (marginals[:, np.newaxis] + marginals[np.newaxis, :]) / 2.0) ** 2
+    elif level == "interval":
+        delta = (values[:, np.newaxis] - values[np.newaxis, :]).astype(np.float64) ** 2
+    else:
+        raise ValueError(f"Unknown measurement level {level}")
+    expected = (np.outer(marginals, marginals) * delta).sum()
+    if expected == 0:
+        return math.nan
+    return float(1.0 - (total - 1) * (coincidences * delta).sum() / expected)
+
+
+def summarize(ratings: RatingArray) -> dict:
+    """All statistics of a rating corpus as a JSON serializable dict (NaN is reported as None)."""
+    means, counts = modelMeans(ratings)
+    meanRank, distribution = rankDistribution(ratings)
+    rankLabels = [f"{1 + i / 2:g}" for i in range(2 * len(ratings.models) - 1)]
+
+    def number(value):
+        return None if value is None or math.isnan(value) else float(value)
+
+    summary = {
+        "cases": len(ratings.caseIds),
+        "raters": ratings.raters,
+        "models": ratings.models,
+        "criteria": ratings.criteria,
+        "means": {}, "counts": {}, "meanRank": {}, "rankDistribution": {},
+        "friedman": {}, "wilcoxon": {}, "kendallW": {}, "krippendorffAlpha": {},
+    }
+    for modelIndex, model in enumerate(ratings.models):
+        summary["means"][model] = {c: number(means[modelIndex, i]) for i, c in enumerate(ratings.criteria)}
+        summary["counts"][model] = {c: int(counts[modelIndex, i]) for i, c in enumerate(ratings.criteria)}
+        summary["meanRank"][model] = {c: number(meanRank[modelIndex, i]) for i, c in enumerate(ratings.criteria)}
+        summary["rankDistribution"][model] = {
+            c: dict(zip(rankLabels, distribution[modelIndex, i].tolist())) for i, c in enumerate(ratings.criteria)}
+
+    for criterionIndex, criterion in enumerate(ratings.criteria):
+        blocks = completeBlocks(ratings, criterionIndex)
+        result = friedmanTest(blocks)
+        summary["friedman"][criterion] = {key: number(value) if key != "n" else value for key, value in result.items()}
+        summary["wilcoxon"][criterion] = {}
+        for a, b in combinations(range(len(ratings.models)), 2):
+            result = wilcoxonTest(blocks[:, a], blocks[:, b])
+            summary["wilcoxon"][criterion][f"{ratings.models[a]}/{ratings.models[b]}"] = \
+                {key: number(value) if key != "n" else value for key, value in result.items()}
+
+        # Inter-rater agreement: units are case x model items, judged by the raters
+        units = ratings.scores[:, :, :, criterionIndex].transpose(0, 2, 1).reshape(-1, len(ratings.raters))
+        complete = units[~np.isnan(units).any(axis=1)]
+        summary["kendallW"][criterion] = number(kendallW(complete.T)) if len(ratings.raters) > 1 else None
+        summary["krippendorffAlpha"][criterion] = number(krippendorffAlpha(units)) if len(ratings.raters) > 1 else None
+    return summary
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Aggregate all collected ratings into summary statistics.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dataset", help="dataset root folder with human.json files")
+    source.add_argument("--store", help="score store database")
+    parser.add_argument("--output", help="write the summary to this JSON file instead of stdout")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    startTime = time.time()
+    if args.dataset:
+        ratings = loadLegacyRatings(args.dataset, maxWorkers=args.workers)
+    else:
+        ratings = loadStoreRatings(args.store)
+    logging.info(f"Loaded ratings array {ratings.shape} in {time.time() - startTime:.1f} seconds")
+    summary = summarize(ratings)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
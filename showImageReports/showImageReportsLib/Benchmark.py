@@ -0,0 +1,180 @@
+"""
+Synthetic data generator and load benchmark.
+
+Generates head-CT-like NIfTI volumes of configurable size and compression
+together with reports (``reports.json`` per case and a JSONL corpus), then
+walks them like a rating session and reports cases per minute and p50/p95
+per-case latency.
+
+Command line usage (headless decode path, without the MRML scene)::
+
+    PythonSlicer -m showImageReportsLib.Benchmark --cases 50 --shape 512 512 200 --compress-level 6
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from .NiftiIO import NIFTI1_HEADER_SIZE, readNifti
+from .Reports import REPORTS_FILE_NAME, readReportsFile
+from .Timing import PhaseTimings, percentile
+from .Worklist import CasePrefetcher, CaseWorklist
+
+NIFTI_DATATYPE_CODES = {np.dtype(np.int16): (4, 16), np.dtype(np.uint8): (2, 8), np.dtype(np.float32): (16, 32)}
+
+SYNTHETIC_REPORTS = {
+    "gt": "疾病类别是：这是出血类别。影像描述是：左侧额叶见片状高密度影，边界清楚，周围见低密度水肿带，中线结构居中。",
+    "minimed": "左侧额叶可见高密度影，边缘清晰，脑室系统未见扩大。",
+    "gpt": "This is an axial CT of the head. A hyperdense lesion is seen in the left frontal lobe.",
+    "radfm": "左额叶血肿，周围水肿，中线无移位。",
+    "brainfound": "疾病类别是：这是出血类别。影像描述是：左侧额叶片状高密度影，边界清，中线结构无移位。",
+}
+
+
+def writeNifti(path, array: np.ndarray, spacing=(0.5, 0.5, 5.0), compressLevel=6) -> None:
+    """Write a 3D array indexed ``[k, j, i]`` as single-file NIfTI-1 with a scaled-identity sform."""
+    array = np.ascontiguousarray(array)
+    datatype, bitpix = NIFTI_DATATYPE_CODES[array.dtype]
+    header = bytearray(NIFTI1_HEADER_SIZE)
+    struct.pack_into("<i", header, 0, NIFTI1_HEADER_SIZE)
+    struct.pack_into("<8h", header, 40, 3, array.shape[2], array.shape[1], array.shape[0], 1, 1, 1, 1)
+    struct.pack_into("<2h", header, 70, datatype, bitpix)
+    struct.pack_into("<8f", header, 76, 1.0, *spacing, 1.0, 1.0, 1.0, 1.0)
+    struct.pack_into("<f", header, 108, NIFTI1_HEADER_SIZE + 4)
+    struct.pack_into("<2f", header, 112, 1.0, 0.0)
+    struct.pack_into("<2h", header, 252, 0, 1)
+    struct.pack_into("<12f", header, 280, spacing[0], 0, 0, 0, 0, spacing[1], 0, 0, 0, 0, spacing[2], 0)
+    header[344:348] = b"n+1\0"
+    data = bytes(header) + b"\0" * 4 + array.astype(array.dtype.newbyteorder("<")).tobytes()
+    if path.lower().endswith(".gz"):
+        with gzip.open(path, "wb", compresslevel=compressLevel) as f:
+            f.write(data)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def syntheticHead(shape, seed=0) -> np.ndarray:
+    """int16 head phantom in Hounsfield units: air, a skull shell, brain tissue with noise and a hyperdense lesion."""
+    rng = np.random.default_rng(seed)
+    k, j, i = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    radius = ((k - shape[0] / 2) / (shape[0] * 0.45)) ** 2 + ((j - shape[1] / 2) / (shape[1] * 0.40)) ** 2 \
+        + ((i - shape[2] / 2) / (shape[2] * 0.35)) ** 2
+    volume = np.full(shape, -1000, dtype=np.int16)
+    volume[radius < 1.0] = 1000
+    brain = radius < 0.85
+    volume[brain] = 35 + rng.normal(0, 5, int(brain.sum())).astype(np.int16)
+    lesion = (((k - shape[0] * 0.5) ** 2 + (j - shape[1] * 0.4) ** 2 + (i - shape[2] * 0.4) ** 2)
+              < (min(shape) * 0.08) ** 2)
+    volume[lesion & brain] = 70
+    return volume
+
+
+def generateDataset(rootPath, cases=10, shape=(64, 256, 256), compressLevel=6, seed=0, corpusPath=None) -> list:
+    """Create ``cases`` case folders with a synthetic ``image.nii.gz`` and ``reports.json`` each.
+    If ``corpusPath`` is given, the reports are also written there as a JSONL corpus keyed by case folder name.
+    Returns the image paths."""
+    imagePaths = []
+    corpus = open(corpusPath, "w", encoding="utf-8") if corpusPath else None
+    try:
+        for caseIndex in range(cases):
+            caseId = f"case{caseIndex:05d}"
+            caseDir = os.path.join(rootPath, caseId)
+            os.makedirs(caseDir, exist_ok=True)
+            imagePath = os.path.join(caseDir, "image.nii.gz" if compressLevel else "image.nii")
+            writeNifti(imagePath, syntheticHead(shape, seed + caseIndex), compressLevel=compressLevel)
+            with open(os.path.join(caseDir, REPORTS_FILE_NAME), "w", encoding="utf-8") as f:
+                json.dump(SYNTHETIC_REPORTS, f, ensure_ascii=False)
+            if corpus:
+                corpus.write(json.dumps({"id": caseId, **SYNTHETIC_REPORTS}, ensure_ascii=False) + "\n")
+            imagePaths.append(imagePath)
+    finally:
+        if corpus:
+            corpus.close()
+    return imagePaths
+
+
+def latencySummary(latencies, elapsed) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "cases": len(latencies),
+        "seconds": elapsed,
+        "casesPerMinute": 60.0 * len(latencies) / elapsed if elapsed > 0 else float("nan"),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+    }
+
+
+def runWorklist(showCase, cases, dwellSeconds=0.0) -> dict:
+    """Call ``showCase(index)`` for every worklist index in order and summarize per-case latency.
+    ``dwellSeconds`` simulates the time a rater spends on each case, during which prefetching continues."""
+    latencies = []
+    startTime = time.perf_counter()
+    for index in range(cases):
+        caseStartTime = time.perf_counter()
+        showCase(index)
+        latencies.append(time.perf_counter() - caseStartTime)
+        if dwellSeconds:
+            time.sleep(dwellSeconds)
+    return latencySummary(latencies, time.perf_counter() - startTime)
+
+
+def benchmarkDecode(rootPath, prefetchDepth=3, dwellSeconds=0.0, timings=None) -> dict:
+    """Headless benchmark: walk a dataset through the worklist prefetcher, without creating MRML nodes."""
+    timings = timings or PhaseTimings()
+    worklist = CaseWorklist(rootPath)
+
+    def readVolume(path):
+        with timings.span("load"):
+            return readNifti(path)
+
+    def readReports(path):
+        with timings.span("parse"):
+            return readReportsFile(path)
+
+    prefetcher = CasePrefetcher(worklist, depth=prefetchDepth, readVolume=readVolume, readReports=readReports)
+
+    def showCase(index):
+        prefetcher.prefetch(index)
+        case = prefetcher.get(index)
+        if case.error is not None:
+            raise case.error
+
+    try:
+        result = runWorklist(showCase, len(worklist), dwellSeconds)
+    finally:
+        prefetcher.shutdown()
+    result["phases"] = timings.summary()["phases"]
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset and measure case load throughput.")
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--shape", type=int, nargs=3, default=[256, 256, 64], metavar=("I", "J", "K"))
+    parser.add_argument("--compress-level", type=int, default=6, help="gzip level, 0 writes uncompressed .nii")
+    parser.add_argument("--prefetch", type=int, default=3)
+    parser.add_argument("--dwell", type=float, default=0.0, help="simulated rating time per case in seconds")
+    parser.add_argument("--output-dir", default=None, help="keep the generated dataset in this folder")
+    args = parser.parse_args(argv)
+
+    shape = (args.shape[2], args.shape[1], args.shape[0])
+    # Without --output-dir the dataset is removed after the run
+    with (contextlib.nullcontext(args.output_dir) if args.output_dir
+          else tempfile.TemporaryDirectory(prefix="showImageReportsBenchmark")) as rootPath:
+        generateDataset(rootPath, args.cases, shape, args.compress_level)
+        for depth in sorted({0, args.prefetch}):
+            result = benchmarkDecode(rootPath, depth, args.dwell)
+            print(f"prefetch {depth}: {result['casesPerMinute']:.1f} cases/min, "
+                  f"p50 {result['p50'] * 1000:.1f} ms, p95 {result['p95'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
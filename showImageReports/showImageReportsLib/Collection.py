@@ -0,0 +1,424 @@
+"""
+Collection of ratings from several raters over HTTP.
+
+Instead of every rater writing ``human.json`` files into a shared dataset
+folder, saved scores can be submitted to a small collection server. The
+client queues each submission in a local spool (SQLite) and a background
+thread pushes them in gzip-compressed batches. A submission is identified by
+case and rater (its idempotency key) and carries a revision; the server keeps
+the newest revision per key and acknowledges older or repeated ones without
+applying them, so retries after timeouts are safe. While the server is
+unreachable, submissions stay in the spool and are retried with exponential
+backoff, also across Slicer sessions.
+
+The reference server only uses the standard library. It keeps one row per
+case and rater with the newest scores, so a submission is a single upsert;
+``export`` copies the collected ratings into a score store database for the
+aggregation tools.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Collection serve --db /path/to/collected.sqlite --host 0.0.0.0 --port 8765
+    PythonSlicer -m showImageReportsLib.Collection export --db collected.sqlite --store scores.sqlite
+    PythonSlicer -m showImageReportsLib.Collection flush --url http://server:8765 --spool submissionSpool.sqlite
+    PythonSlicer -m showImageReportsLib.Collection loadtest --submissions 100000 --clients 8
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .ScoreStore import ScoreStore
+from .Scores import CRITERIA, MAX_SCORE, MODELS
+from .Timing import percentile
+
+DEFAULT_PORT = 8765
+SUBMISSION_BATCH_SIZE = 200
+FLUSH_INTERVAL = 2.0
+REQUEST_TIMEOUT = 10.0
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+_SPOOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    caseId TEXT NOT NULL,
+    rater TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    scores TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    nextAttempt REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (caseId, rater)
+);
+"""
+
+_SUBMISSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    caseId TEXT NOT NULL,
+    rater TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    received REAL NOT NULL,
+    scores TEXT NOT NULL,
+    PRIMARY KEY (caseId, rater)
+);
+"""
+
+# Older or repeated revisions leave the stored row untouched
+_UPSERT = """
+INSERT INTO submissions VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (caseId, rater) DO UPDATE SET revision=excluded.revision, received=excluded.received, scores=excluded.scores
+WHERE excluded.revision > submissions.revision
+"""
+
+
+def encodeBatch(submissions) -> bytes:
+    return gzip.compress(json.dumps({"submissions": submissions}, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+
+
+def postBatch(url, body: bytes, timeout=REQUEST_TIMEOUT) -> dict:
+    request = urllib.request.Request(url.rstrip("/") + "/submissions", data=body, method="POST", headers={
+        "Content-Type": "application/json", "Content-Encoding": "gzip"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+#
+# Client
+#
+
+class SubmissionClient:
+    """Local spool of submissions that a background thread pushes to a collection server in batches.
+
+    Only the newest submission of a case and rater is kept in the spool. Thread safe.
+    """
+
+    def __init__(self, serverUrl, spoolPath, batchSize=SUBMISSION_BATCH_SIZE, timeout=REQUEST_TIMEOUT) -> None:
+        self.serverUrl = serverUrl
+        self.spoolPath = spoolPath
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.lastError = None
+        if os.path.dirname(spoolPath):
+            os.makedirs(os.path.dirname(spoolPath), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(spoolPath, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SPOOL_SCHEMA)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def submit(self, caseId, rater, scores) -> None:
+        """Queue the scores ``{model: {criterion: int or None}}`` of a case, replacing a queued older submission."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO spool (caseId, rater, revision, scores) VALUES (?, ?, ?, ?)",
+                             (caseId, rater, time.time_ns(), json.dumps(scores)))
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def flush(self) -> int:
+        """Send one batch of due submissions. Returns the number of acknowledged submissions;
+        0 if nothing was due or the server could not be reached (the batch is then retried later)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT caseId, rater, revision, scores, attempts FROM spool WHERE nextAttempt <= ? ORDER BY revision LIMIT ?",
+                (time.time(), self.batchSize)).fetchall()
+        if not rows:
+            return 0
+        submissions = [{"caseId": caseId, "rater": rater, "revision": revision, "scores": json.loads(scores)}
+                       for caseId, rater, revision, scores, _ in rows]
+        try:
+            result = postBatch(self.serverUrl, encodeBatch(submissions), self.timeout)
+        except (OSError, ValueError) as e:
+            # URLError and HTTPError are OSErrors
+            self.lastError = e
+            logging.info(f"Could not submit {len(rows)} ratings to {self.serverUrl}, will retry: {e}")
+            now = time.time()
+            with self._lock, self._db:
+                self._db.executemany("UPDATE spool SET attempts=?, nextAttempt=? WHERE caseId=? AND rater=? AND revision=?", [
+                    (attempts + 1, now + min(MAX_BACKOFF, MIN_BACKOFF * 2 ** attempts), caseId, rater, revision)
+                    for caseId, rater, revision, _, attempts in rows])
+            return 0
+        self.lastError = None
+        acknowledged = [tuple(key) for key in result.get("acknowledged", [])]
+        with self._lock, self._db:
+            # A newer revision queued meanwhile stays in the spool
+            self._db.executemany("DELETE FROM spool WHERE caseId=? AND rater=? AND revision=?", acknowledged)
+        return len(acknowledged)
+
+    def retryNow(self) -> None:
+        """Make all spooled submissions due now, ignoring their backoff (e.g. once the server is known to be back),
+        and wake the background thread."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE spool SET nextAttempt=0")
+        self.wake()
+
+    def flushAll(self) -> int:
+        """Send batches until the spool has no due submissions left or the server is unreachable."""
+        total = 0
+        while True:
+            sent = self.flush()
+            if not sent:
+                return total
+            total += sent
+
+    def start(self, interval=FLUSH_INTERVAL) -> None:
+        """Push submissions from a background thread every ``interval`` seconds (or when woken by ``wake``)."""
+        if self._thread:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.flushAll()
+                except sqlite3.Error as e:
+                    logging.warning(f"Submission spool error: {e}")
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name="showImageReportsSubmissions", daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        if self._thread:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+
+#
+# Reference server
+#
+
+class CollectionServer(ThreadingHTTPServer):
+    """HTTP collection server that keeps the newest submission of every case and rater in an SQLite database.
+
+    ``POST /submissions`` takes a (optionally gzip-compressed) JSON batch ``{"submissions": [...]}`` and
+    answers ``{"applied": n, "acknowledged": [[caseId, rater, revision], ...]}``. ``GET /health`` answers
+    the number of stored submissions.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, dbPath, host="127.0.0.1", port=DEFAULT_PORT) -> None:
+        self.dbPath = dbPath
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(dbPath, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SUBMISSIONS_SCHEMA)
+        super().__init__((host, port), _CollectionRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        with self._lock:
+            self._db.close()
+
+    def applySubmissions(self, submissions) -> tuple:
+        """Store the submissions that are newer than what is stored for their case and rater.
+        Returns the number of applied submissions and the keys of all submissions, which are all acknowledged."""
+        now = time.time()
+        rows = []
+        for submission in submissions:
+            if not isinstance(submission["scores"], dict):
+                raise ValueError("scores must be an object")
+            rows.append((str(submission["caseId"]), str(submission["rater"]), int(submission["revision"]), now,
+                         json.dumps(submission["scores"])))
+        with self._lock, self._db:
+            changesBefore = self._db.total_changes
+            self._db.executemany(_UPSERT, rows)
+            applied = self._db.total_changes - changesBefore
+        return applied, [[caseId, rater, revision] for caseId, rater, revision, _, _ in rows]
+
+    def submissionCount(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+
+def exportSubmissions(dbPath, store, since=0.0) -> int:
+    """Copy the submissions of a collection database received since ``since`` (seconds since the epoch)
+    into a ``ScoreStore``. Returns the number of exported submissions."""
+    db = sqlite3.connect(dbPath)
+    try:
+        rows = db.execute("SELECT caseId, rater, scores FROM submissions WHERE received >= ?", (since,)).fetchall()
+    finally:
+        db.close()
+    for caseId, rater, scores in rows:
+        store.putScores(caseId, rater, json.loads(scores))
+    store.commit()
+    return len(rows)
+
+
+class _CollectionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _reply(self, status, content) -> None:
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "submissions": self.server.submissionCount()})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/submissions":
+            self._reply(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_REQUEST_SIZE:
+            self._reply(413, {"error": "request too large"})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+        try:
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            applied, acknowledged = self.server.applySubmissions(json.loads(body)["submissions"])
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, {"applied": applied, "acknowledged": acknowledged})
+
+
+#
+# Load test
+#
+
+def loadTest(url, submissions=10000, clients=8, batchSize=SUBMISSION_BATCH_SIZE, raters=20) -> dict:
+    """Post synthetic submissions from ``clients`` threads in batches and measure throughput and request latency."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    perClient = (submissions + clients - 1) // clients
+
+    def client(clientIndex):
+        sent = 0
+        while sent < perClient:
+            batch = []
+            for i in range(sent, min(sent + batchSize, perClient)):
+                number = clientIndex * perClient + i
+                scores = {model: {criterion: (number + m + c) % (MAX_SCORE + 1) for c, criterion in enumerate(CRITERIA)}
+                          for m, model in enumerate(MODELS)}
+                batch.append({"caseId": f"case{number // raters:07d}", "rater": f"rater{number % raters}",
+                              "revision": time.time_ns(), "scores": scores})
+            body = encodeBatch(batch)
+            startTime = time.perf_counter()
+            try:
+                postBatch(url, body)
+            except (OSError, ValueError) as e:
+                with lock:
+                    errors.append(str(e))
+            with lock:
+                latencies.append(time.perf_counter() - startTime)
+            sent += len(batch)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    startTime = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - startTime
+    latencies.sort()
+    return {
+        "submissions": perClient * clients,
+        "seconds": elapsed,
+        "submissionsPerSecond": perClient * clients / elapsed,
+        "requestP50": percentile(latencies, 0.50),
+        "requestP95": percentile(latencies, 0.95),
+        "errors": len(errors),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Rating collection server, client spool flush and load test.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the collection server")
+    serve.add_argument("--db", required=True, help="database the submissions are collected in")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    export = commands.add_parser("export", help="copy the collected ratings into a score store")
+    export.add_argument("--db", required=True)
+    export.add_argument("--store", required=True)
+    flush = commands.add_parser("flush", help="push all spooled submissions")
+    flush.add_argument("--url", required=True)
+    flush.add_argument("--spool", required=True)
+    load = commands.add_parser("loadtest", help="measure server throughput")
+    load.add_argument("--url", default=None, help="server to test (default: start a server on a temporary store)")
+    load.add_argument("--submissions", type=int, default=20000)
+    load.add_argument("--clients", type=int, default=8)
+    load.add_argument("--batch", type=int, default=SUBMISSION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        server = CollectionServer(args.db, args.host, args.port)
+        logging.info(f"Collecting ratings into {args.db} on http://{args.host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == "export":
+        store = ScoreStore(args.store)
+        print(f"Exported {exportSubmissions(args.db, store)} submissions to {args.store}")
+        store.close()
+    elif args.command == "flush":
+        client = SubmissionClient(args.url, args.spool)
+        sent = client.flushAll()
+        print(f"Submitted {sent} ratings, {client.pending()} still pending")
+        client.close()
+    else:
+        server = None
+        url = args.url
+        if url is None:
+            # The temporary store is removed after the run
+            tempDir = tempfile.TemporaryDirectory(prefix="showImageReportsCollection")
+            server = CollectionServer(os.path.join(tempDir.name, "collected.sqlite"), port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            result = loadTest(url, args.submissions, args.clients, args.batch)
+            print(f"{result['submissionsPerSecond']:.0f} submissions/s, request p50 {result['requestP50'] * 1000:.1f} ms, "
+                  f"p95 {result['requestP95'] * 1000:.1f} ms, {result['errors']} errors")
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+                tempDir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
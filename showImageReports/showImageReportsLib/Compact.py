@@ -0,0 +1,120 @@
+"""
+Compact voxel representation for rating sessions.
+
+A head CT is mostly air around the head, and decoders promote voxels to
+wider types than needed. For rating, a volume can be cropped to its
+foreground bounding box and stored as int16 (``compact`` load mode), or as
+uint8 that is already windowed with a display preset (``display`` load mode,
+for when only viewing is needed). The result is one contiguous array that
+the VTK image data can wrap without another copy.
+
+Foreground boxes are computed on a strided subsample in one vectorized pass
+and, like the window presets, cached by content hash.
+"""
+
+import numpy as np
+
+from .NiftiIO import NiftiVolume
+from .Windowing import CT_FOREGROUND_MIN, CT_PRESETS, sampleStep
+
+NATIVE_LOAD_MODE = "native"
+COMPACT_LOAD_MODE = "compact"
+DISPLAY_LOAD_MODE = "display"
+LOAD_MODES = (NATIVE_LOAD_MODE, COMPACT_LOAD_MODE, DISPLAY_LOAD_MODE)
+# Voxels kept around the foreground, on top of the subsampling step
+BOX_MARGIN = 2
+
+
+class CompactVolume(NiftiVolume):
+    """Cropped and narrowed volume. ``nativeBytes`` is the size of the volume it was made from,
+    ``window`` the ``[name, window, level]`` preset the voxels are windowed with in display mode, else None."""
+
+    def __init__(self, array, ijkToRas, sourcePath=None, box=None, nativeBytes=0, window=None) -> None:
+        super().__init__(array, ijkToRas, sourcePath)
+        self.box = box
+        self.nativeBytes = nativeBytes
+        self.window = window
+
+
+def foregroundBox(array: np.ndarray, threshold=None, margin=BOX_MARGIN) -> list:
+    """``[[start, stop], ...]`` per array axis of the voxels above ``threshold`` (default: the lowest value,
+    i.e. everything but the background), found on a strided subsample and padded to cover what it skipped.
+    The whole extent is returned if there is no foreground."""
+    step = sampleStep(array)
+    samples = array[(slice(None, None, step),) * array.ndim]
+    if threshold is None:
+        threshold = samples.min() if samples.size else 0
+    mask = samples > threshold
+    box = []
+    for axis, size in enumerate(array.shape):
+        projection = np.any(mask, axis=tuple(a for a in range(mask.ndim) if a != axis))
+        indices = np.flatnonzero(projection)
+        if indices.size == 0:
+            return [[0, size] for size in array.shape]
+        box.append([max(0, int(indices[0]) * step - step - margin), min(size, int(indices[-1]) * step + step + margin + 1)])
+    return box
+
+
+def volumeForegroundBox(array: np.ndarray, presets) -> list:
+    """Foreground box of a volume with the given window presets. Air is background of CT volumes,
+    which are the ones that got the CT presets."""
+    isCT = any(name == CT_PRESETS[0][0] for name, _, _ in presets)
+    return foregroundBox(array, CT_FOREGROUND_MIN if isCT else None)
+
+
+def cropGeometry(ijkToRas: np.ndarray, box) -> np.ndarray:
+    """IJK to RAS matrix of a crop starting at ``box`` (given in array order ``(k, j, i)``)."""
+    shift = np.eye(4)
+    shift[:3, 3] = [box[2][0], box[1][0], box[0][0]]
+    return ijkToRas @ shift
+
+
+def int16Range(array: np.ndarray) -> bool:
+    """True if the voxels can be stored as int16 without loss."""
+    if array.dtype == np.int16 or array.dtype in (np.int8, np.uint8):
+        return True
+    if array.size == 0:
+        return True
+    low, high = array.min(), array.max()
+    if low < np.iinfo(np.int16).min or high > np.iinfo(np.int16).max:
+        return False
+    return np.issubdtype(array.dtype, np.integer) or bool(np.all(array == np.rint(array)))
+
+
+def windowLookupTable(window, level) -> np.ndarray:
+    """uint8 value of every int16 voxel value, indexed by the voxel bits viewed as uint16."""
+    values = np.arange(65536, dtype=np.int32)
+    values[32768:] -= 65536
+    low = level - window / 2.0
+    return np.clip(np.rint((values - low) * (255.0 / max(window, 1e-6))), 0, 255).astype(np.uint8)
+
+
+def compactVolume(volume: NiftiVolume, box, mode=COMPACT_LOAD_MODE, window=None) -> CompactVolume:
+    """
+    Crop a volume to ``box`` into one new contiguous array.
+    :param mode: ``compact`` stores int16 where lossless (float32 otherwise), ``display`` stores uint8
+    :param window: ``[name, window, level]`` preset the voxels are windowed with in display mode
+    """
+    cropped = volume.array[tuple(slice(start, stop) for start, stop in box)]
+    ijkToRas = cropGeometry(volume.ijkToRas, box)
+    if mode == DISPLAY_LOAD_MODE:
+        if window is None:
+            raise ValueError("Display load mode needs a window preset")
+        _, width, level = window
+        if int16Range(cropped):
+            # One table lookup per voxel, no floating point temporaries
+            array = windowLookupTable(width, level)[np.asarray(cropped, dtype=np.int16).view(np.uint16)]
+        else:
+            low = level - width / 2.0
+            array = np.empty(cropped.shape, dtype=np.uint8)
+            for index in range(cropped.shape[0]):
+                array[index] = np.clip(np.rint((cropped[index] - low) * (255.0 / max(width, 1e-6))), 0, 255)
+        return CompactVolume(array, ijkToRas, volume.sourcePath, box, volume.nbytes, window)
+    if mode != COMPACT_LOAD_MODE:
+        raise ValueError(f"Unknown load mode {mode}")
+    dtype = np.int16 if int16Range(cropped) else np.float32
+    array = np.ascontiguousarray(cropped, dtype=dtype)
+    if np.shares_memory(array, volume.array):
+        # Already contiguous in the right type (e.g. nothing to crop): own a writable copy, not a view of the source
+        array = array.copy()
+    return CompactVolume(array, ijkToRas, volume.sourcePath, box, volume.nbytes)
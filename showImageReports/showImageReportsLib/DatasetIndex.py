@@ -0,0 +1,343 @@
+"""
+Persistent index of the files of a dataset.
+
+The index records path, size, mtime and content hash of every NIfTI image
+and ``reports.json`` below a dataset root, and which report fields each
+``reports.json`` contains. Dataset level questions ("which cases has rater X
+not rated yet?", "which cases have no report of model Y?") are then answered
+by queries on the index instead of walking the dataset.
+
+Updates are incremental. A directory is only listed again if its mtime
+changed, which happens when entries are created, deleted or renamed in it;
+unchanged directories cost a single stat, plus one for the ``reports.json``
+recorded in them, since reports are often edited in place, which does not
+change the mtime of their directory. Files whose size or mtime changed are
+hashed again on a thread pool. Images that are rewritten in place (not
+replaced by a rename) are only found by a full update, which re-stats every
+file.
+
+Paths in the index are relative to the dataset root with ``/`` separators,
+so the relative path of an image is its case ID.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.DatasetIndex /path/to/dataset update
+    PythonSlicer -m showImageReportsLib.DatasetIndex /path/to/dataset unrated --store scores.sqlite --rater NAME
+    PythonSlicer -m showImageReportsLib.DatasetIndex /path/to/dataset missing --column gpt4
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .FileUtils import fileContentHash
+from .NiftiIO import isNiftiFile
+from .Reports import DEFAULT_REPORT_COLUMNS, REPORTS_FILE_NAME
+
+INDEX_FILE_NAME = "showImageReports.index.sqlite"
+IMAGE_KIND = "image"
+REPORTS_KIND = "reports"
+# Directories and files modified less than this many seconds before they were looked at may change again
+# within the same timestamp, so they are looked at again by the next update
+RACY_INTERVAL = 2.0
+HASH_BATCH_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_kind ON files (kind, directory);
+CREATE TABLE IF NOT EXISTS reportFields (
+    directory TEXT NOT NULL,
+    field TEXT NOT NULL,
+    PRIMARY KEY (directory, field)
+);
+"""
+
+
+def _joinPath(directory, name) -> str:
+    return f"{directory}/{name}" if directory else name
+
+
+def _fileKind(name):
+    if name == REPORTS_FILE_NAME:
+        return REPORTS_KIND
+    if isNiftiFile(name):
+        return IMAGE_KIND
+    return None
+
+
+def caseOrderKey(casePath):
+    """Sort key that orders relative paths like ``findCases``: the files of a directory before its subdirectories."""
+    parts = casePath.split("/")
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+def reportFields(path) -> list:
+    """Fields of a ``reports.json`` with a non-empty text. An unreadable file has no fields."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            reports = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed to read {path}: {e}")
+        return []
+    if not isinstance(reports, dict):
+        return []
+    return sorted(field for field, text in reports.items() if isinstance(text, str) and text.strip())
+
+
+def _hashFile(rootPath, row):
+    """Thread pool worker: content hash (and report fields) of a new or changed file."""
+    path, directory, kind, size, mtime = row
+    absolutePath = os.path.join(rootPath, path)
+    try:
+        contentHash = fileContentHash(absolutePath)
+    except OSError as e:
+        logging.warning(f"Failed to hash {absolutePath}: {e}")
+        contentHash = None
+    fields = reportFields(absolutePath) if kind == REPORTS_KIND else None
+    return (path, directory, kind, size, mtime, contentHash), fields
+
+
+class DatasetIndex:
+    """Incrementally updated index of the images and reports below a dataset root. Thread safe."""
+
+    def __init__(self, rootPath, path=None) -> None:
+        self.rootPath = os.path.abspath(rootPath)
+        self.path = path or os.path.join(self.rootPath, INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def update(self, full: bool = False, maxWorkers=None, progress=None) -> dict:
+        """
+        Bring the index up to date with the dataset.
+        :param full: list every directory and stat every file, also to find images that were rewritten in place
+        :param progress: optional callable ``progress(done, total)`` while new and changed files are hashed
+        :return: number of ``directories`` in the dataset, of ``scanned`` directories, ``changed`` and
+          ``removed`` files and the ``seconds`` it took
+        """
+        startTime = time.time()
+        with self._lock:
+            knownDirectories = dict(self._db.execute("SELECT path, mtime FROM directories"))
+            knownReports = {row[0]: row[1:] for row in self._db.execute(
+                "SELECT directory, path, size, mtime FROM files WHERE kind=?", (REPORTS_KIND,))}
+            children = defaultdict(list)
+            for path, parent in self._db.execute("SELECT path, parent FROM directories WHERE parent IS NOT NULL"):
+                children[parent].append(path)
+        now = time.time()
+        stack = [("", None)]
+        directoryRows = []
+        removedDirectories = []
+        removedFiles = []
+        pending = []
+        scanned = 0
+        while stack:
+            directory, parent = stack.pop()
+            absoluteDirectory = os.path.join(self.rootPath, directory)
+            try:
+                mtime = os.stat(absoluteDirectory).st_mtime
+            except FileNotFoundError:
+                removedDirectories.append(directory)
+                continue
+            if not full and mtime == knownDirectories.get(directory):
+                stack.extend((child, directory) for child in children[directory])
+                if directory in knownReports:
+                    self._checkReports(knownReports[directory], directory, now, pending, removedFiles)
+                continue
+            # The mtime is taken before listing, so changes made while listing are found by the next update
+            scanned += 1
+            racy = now - mtime < RACY_INTERVAL
+            with self._lock:
+                knownFiles = {row[0]: row[1:] for row in self._db.execute(
+                    "SELECT path, size, mtime FROM files WHERE directory=?", (directory,))}
+            subdirectories = []
+            try:
+                entries = list(os.scandir(absoluteDirectory))
+            except OSError as e:
+                logging.warning(f"Failed to list {absoluteDirectory}: {e}")
+                entries = []
+            for entry in entries:
+                path = _joinPath(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(path)
+                    continue
+                kind = _fileKind(entry.name)
+                if kind is None:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # A racy file is recorded without mtime, so that it is hashed again by the next update
+                fileRacy = now - stat.st_mtime < RACY_INTERVAL
+                racy = racy or fileRacy
+                if knownFiles.pop(path, None) != (stat.st_size, stat.st_mtime):
+                    pending.append((path, directory, kind, stat.st_size, None if fileRacy else stat.st_mtime))
+            removedFiles.extend(knownFiles)
+            removedDirectories.extend(set(children[directory]) - set(subdirectories))
+            stack.extend((child, directory) for child in sorted(subdirectories, reverse=True))
+            directoryRows.append((directory, parent, None if racy else mtime))
+
+        with self._lock, self._db:
+            for directory in removedDirectories:
+                prefix = directory + "/"
+                self._db.execute("DELETE FROM directories WHERE path=? OR substr(path, 1, ?)=?", (directory, len(prefix), prefix))
+                self._db.execute("DELETE FROM files WHERE directory=? OR substr(directory, 1, ?)=?", (directory, len(prefix), prefix))
+                self._db.execute("DELETE FROM reportFields WHERE directory=? OR substr(directory, 1, ?)=?", (directory, len(prefix), prefix))
+            self._db.executemany("DELETE FROM files WHERE path=?", [(path,) for path in removedFiles])
+            self._db.executemany("DELETE FROM reportFields WHERE directory=?",
+                                 [(path.rpartition("/")[0],) for path in removedFiles if path.rpartition("/")[2] == REPORTS_FILE_NAME])
+        self._hashFiles(pending, maxWorkers, progress)
+        # Directories are recorded last: if the update is interrupted, they are listed again the next time
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO directories VALUES (?, ?, ?)", directoryRows)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('rootPath', ?)", (self.rootPath,))
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (time.time(),))
+            directories = self._db.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+        return {"directories": directories, "scanned": scanned, "changed": len(pending),
+                "removed": len(removedFiles) + len(removedDirectories), "seconds": time.time() - startTime}
+
+    def _checkReports(self, known, directory, now, pending, removedFiles) -> None:
+        """Stat the recorded ``reports.json`` of a directory that was not listed, to find it rewritten in place."""
+        path, size, mtime = known
+        try:
+            stat = os.stat(os.path.join(self.rootPath, path))
+        except FileNotFoundError:
+            # Removed after the directory mtime was taken
+            removedFiles.append(path)
+            return
+        if (stat.st_size, stat.st_mtime) != (size, mtime):
+            fileRacy = now - stat.st_mtime < RACY_INTERVAL
+            pending.append((path, directory, REPORTS_KIND, stat.st_size, None if fileRacy else stat.st_mtime))
+
+    def _hashFiles(self, pending, maxWorkers=None, progress=None) -> None:
+        """Hash new and changed files on a thread pool (hashlib releases the GIL) and write them in batches."""
+        if not pending:
+            return
+        done = 0
+        with ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="showImageReportsIndex") as executor:
+            for start in range(0, len(pending), HASH_BATCH_SIZE):
+                results = list(executor.map(lambda row: _hashFile(self.rootPath, row), pending[start:start + HASH_BATCH_SIZE]))
+                with self._lock, self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", [row for row, _ in results])
+                    for row, fields in results:
+                        if fields is not None:
+                            self._db.execute("DELETE FROM reportFields WHERE directory=?", (row[1],))
+                            self._db.executemany("INSERT INTO reportFields VALUES (?, ?)", [(row[1], field) for field in fields])
+                done += len(results)
+                if progress:
+                    progress(done, len(pending))
+
+    def caseIds(self) -> list:
+        """Case IDs (image paths relative to the dataset root) in the order of ``findCases``."""
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM files WHERE kind=?", (IMAGE_KIND,))]
+        return sorted(paths, key=caseOrderKey)
+
+    def cases(self) -> list:
+        """Absolute image paths, in the order of ``findCases``."""
+        return [os.path.join(self.rootPath, *caseId.split("/")) for caseId in self.caseIds()]
+
+    def unratedCases(self, ratedCaseIds) -> list:
+        """Case IDs that are not in ``ratedCaseIds``, e.g. ``ScoreStore.ratedCases(rater)``."""
+        rated = set(ratedCaseIds)
+        return [caseId for caseId in self.caseIds() if caseId not in rated]
+
+    def casesMissingColumn(self, column, columns=DEFAULT_REPORT_COLUMNS) -> list:
+        """Case IDs whose ``reports.json`` has none of the fields of a report column (or that have no reports)."""
+        fields = columns[column]["fields"]
+        with self._lock:
+            paths = [row[0] for row in self._db.execute(
+                f"SELECT path FROM files WHERE kind=? AND NOT EXISTS (SELECT 1 FROM reportFields "
+                f"WHERE reportFields.directory=files.directory AND field IN ({', '.join('?' * len(fields))}))",
+                (IMAGE_KIND, *fields))]
+        return sorted(paths, key=caseOrderKey)
+
+    def contentHashes(self) -> list:
+        """``(imagePath, mtime, size, hash)`` of all hashed images, in the form the volume cache records sources."""
+        with self._lock:
+            rows = self._db.execute("SELECT path, mtime, size, hash FROM files WHERE kind=? AND hash IS NOT NULL",
+                                    (IMAGE_KIND,)).fetchall()
+        return [(os.path.join(self.rootPath, *path.split("/")), mtime, size, contentHash)
+                for path, mtime, size, contentHash in rows if mtime is not None]
+
+    def summary(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT kind, COUNT(*) FROM files GROUP BY kind"))
+            directories = self._db.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+        return {"rootPath": self.rootPath, "directories": directories, "cases": counts.get(IMAGE_KIND, 0),
+                "reports": counts.get(REPORTS_KIND, 0), "updated": self._meta("updated")}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Update and query the file index of a dataset.")
+    parser.add_argument("datasetRoot")
+    parser.add_argument("command", choices=["update", "unrated", "missing"])
+    parser.add_argument("--index", default=None, help=f"index file (default: {INDEX_FILE_NAME} in the dataset root)")
+    parser.add_argument("--full", action="store_true", help="stat every file, also to find images rewritten in place")
+    parser.add_argument("--store", default=None, help="score store, for unrated")
+    parser.add_argument("--rater", default=None, help="rater, for unrated")
+    parser.add_argument("--column", default=None, help="report column, for missing")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    index = DatasetIndex(args.datasetRoot, args.index)
+    try:
+        if args.command == "update":
+            result = index.update(args.full, args.workers)
+            logging.info(f"Listed {result['scanned']} of {result['directories']} directories, {result['changed']} new or "
+                         f"changed and {result['removed']} removed files in {result['seconds']:.2f} seconds")
+        elif args.command == "unrated":
+            if args.store is None or args.rater is None:
+                parser.error("unrated requires --store and --rater")
+            from .ScoreStore import ScoreStore
+
+            store = ScoreStore(args.store)
+            try:
+                print("\n".join(index.unratedCases(store.ratedCases(args.rater))))
+            finally:
+                store.close()
+        else:
+            if args.column not in DEFAULT_REPORT_COLUMNS:
+                parser.error(f"missing requires --column, one of {', '.join(DEFAULT_REPORT_COLUMNS)}")
+            print("\n".join(index.casesMissingColumn(args.column)))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
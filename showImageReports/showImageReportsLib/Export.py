@@ -0,0 +1,596 @@
+"""
+Incremental columnar export of ratings, reports and report metrics.
+
+Analysis tools get typed tables instead of nested ``human.json`` files with
+scores stored as strings. An export directory holds one folder per table,
+each with numbered part files:
+
+- ``ratings``: ``caseId``, ``rater``, ``model``, one int8 column per
+  criterion (null where the cell is not rated) and ``updated``,
+- ``reports``: ``caseId``, ``column`` (``gt`` or a model identifier),
+  ``textHash`` and ``length`` of the report text (null if the case has no
+  such report) and ``updated``,
+- ``metrics``: the ``report_metrics`` rows of ``Metrics.py``,
+
+and a ``deleted`` flag in every table.
+
+Parts are written as Parquet if pyarrow is installed, otherwise as
+compressed ``.npz`` files (nulls as a ``<column>.null`` mask) or CSV (nulls
+as empty fields). Every export only appends the rows that changed since the
+last one: score store rows by a hash of their values per source database
+(whatever their ``updated`` time, so rows that arrive late are not missed),
+``human.json`` and ``reports.json`` files by mtime and size, and report
+texts by their hash.
+A changed row is appended again, and a row removed from its source (e.g. a
+rating moved to another case ID, or a deleted ``reports.json``) is appended
+with ``deleted`` set, so readers keep the last row per key and drop it if
+it is deleted, as ``readTable`` does. What was exported is recorded in
+``showImageReports.export.sqlite`` in the export directory; several score
+stores (e.g. one per site) can be exported into the same directory.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Export /path/to/export --store site1.sqlite --store site2.sqlite --dataset /path/to/dataset
+"""
+
+import argparse
+import csv
+import functools
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+import numpy as np
+
+from .Aggregation import LEGACY_RATER, PARSE_CHUNK_SIZE, parseLegacyFiles
+from .DatasetIndex import RACY_INTERVAL
+from .FileUtils import atomicWrite, processPool
+from .Metrics import METRICS
+from .Reports import DEFAULT_REPORT_COLUMNS, REPORTS_FILE_NAME, corpusRecords, reportTexts, textHash
+from .ScoreStore import LEGACY_FILE_NAME
+from .Scores import CRITERIA, MODELS
+from .Worklist import findCases
+
+EXPORT_STATE_FILE_NAME = "showImageReports.export.sqlite"
+RATINGS_TABLE, REPORTS_TABLE, METRICS_TABLE = "ratings", "reports", "metrics"
+FORMATS = ("parquet", "npz", "csv")
+# Rows per part file
+PART_ROWS = 100000
+# Separates the key columns of a row in the rowHashes table
+KEY_SEPARATOR = "\x1f"
+NULL_SUFFIX = ".null"
+
+# Table -> ((column, type, nullable), ...)
+TABLE_COLUMNS = {
+    RATINGS_TABLE: (("caseId", "string", False), ("rater", "string", False), ("model", "string", False))
+    + tuple((criterion, "int8", True) for criterion in CRITERIA) + (("updated", "float64", False),),
+    REPORTS_TABLE: (("caseId", "string", False), ("column", "string", False), ("textHash", "string", True),
+                    ("length", "int32", True), ("updated", "float64", False)),
+    METRICS_TABLE: (("caseId", "string", False), ("model", "string", False), ("referenceHash", "string", False),
+                    ("candidateHash", "string", False)) + tuple((metric, "float32", True) for metric in METRICS)
+    + (("updated", "float64", False),),
+}
+# Every table ends with a flag that is 1 in the rows that delete their key
+for _table in TABLE_COLUMNS:
+    TABLE_COLUMNS[_table] += (("deleted", "int8", False),)
+del _table
+# Table -> columns that identify a row; the last row of a key is the current one
+TABLE_KEYS = {
+    RATINGS_TABLE: ("caseId", "rater", "model"),
+    REPORTS_TABLE: ("caseId", "column"),
+    METRICS_TABLE: ("caseId", "model"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS files (
+    caseId TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (caseId, path)
+);
+CREATE TABLE IF NOT EXISTS reportHashes (
+    caseId TEXT NOT NULL,
+    column TEXT NOT NULL,
+    textHash TEXT,
+    PRIMARY KEY (caseId, column)
+);
+CREATE TABLE IF NOT EXISTS rowHashes (
+    tableName TEXT NOT NULL,
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (tableName, source, key)
+);
+"""
+
+
+def defaultFormat() -> str:
+    """Parquet if pyarrow can be imported, otherwise npz."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return "npz"
+    return "parquet"
+
+
+#
+# Part files
+#
+
+def _numpyColumn(values, kind):
+    """``(array, nulls)`` of a column given as a list with None for nulls."""
+    nulls = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    if kind == "string":
+        return np.array(["" if value is None else value for value in values], dtype=str), nulls
+    fill = np.nan if kind.startswith("float") else 0
+    return np.array([fill if value is None else value for value in values], dtype=kind), nulls
+
+
+def _missingColumn(rows, kind):
+    """``(array, nulls)`` of a column that parts written before it was added do not have (``deleted``)."""
+    return np.zeros(rows, dtype=str if kind == "string" else kind), np.zeros(rows, dtype=bool)
+
+
+def deletionRow(table, key, updated) -> tuple:
+    """Row that deletes ``key`` (the values of ``TABLE_KEYS[table]``) from a table."""
+    values = []
+    for name, kind, nullable in TABLE_COLUMNS[table][len(key):]:
+        if name == "updated":
+            values.append(updated)
+        elif name == "deleted":
+            values.append(1)
+        else:
+            values.append(None if nullable else "" if kind == "string" else 0)
+    return tuple(key) + tuple(values)
+
+
+def _writeParquet(f, table, columns) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"string": pa.string(), "int8": pa.int8(), "int32": pa.int32(), "float32": pa.float32(),
+             "float64": pa.float64()}
+    arrays = [pa.array(values, type=types[kind]) for values, (_, kind, _) in zip(columns, TABLE_COLUMNS[table])]
+    pq.write_table(pa.Table.from_arrays(arrays, names=[name for name, _, _ in TABLE_COLUMNS[table]]), f)
+
+
+def _writeNpz(f, table, columns) -> None:
+    arrays = {}
+    for values, (name, kind, nullable) in zip(columns, TABLE_COLUMNS[table]):
+        arrays[name], nulls = _numpyColumn(values, kind)
+        if nullable:
+            arrays[name + NULL_SUFFIX] = nulls
+    np.savez_compressed(f, **arrays)
+
+
+def _writeCsv(f, table, columns) -> None:
+    writer = csv.writer(f)
+    writer.writerow([name for name, _, _ in TABLE_COLUMNS[table]])
+    writer.writerows(("" if value is None else value for value in row) for row in zip(*columns))
+
+
+def _readParquet(path, table) -> dict:
+    import pyarrow.parquet as pq
+
+    data = pq.read_table(path)
+    columns = {}
+    for name, kind, _ in TABLE_COLUMNS[table]:
+        if name not in data.column_names:
+            columns[name] = _missingColumn(data.num_rows, kind)
+            continue
+        values = data.column(name)
+        nulls = values.is_null().to_numpy(zero_copy_only=False)
+        values = values.fill_null("" if kind == "string" else 0).to_numpy(zero_copy_only=False)
+        columns[name] = (np.asarray(values, dtype=str if kind == "string" else kind), nulls)
+    return columns
+
+
+def _readNpz(path, table) -> dict:
+    with np.load(path) as part:
+        rows = len(part["caseId"])
+        return {name: (part[name], part[name + NULL_SUFFIX] if nullable else np.zeros(rows, dtype=bool))
+                if name in part else _missingColumn(rows, kind) for name, kind, nullable in TABLE_COLUMNS[table]}
+
+
+def _readCsv(path, table) -> dict:
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    columns = {}
+    for name, kind, nullable in TABLE_COLUMNS[table]:
+        if name not in header:
+            columns[name] = _missingColumn(len(rows), kind)
+            continue
+        index = header.index(name)
+        columns[name] = _numpyColumn([None if nullable and row[index] == "" else row[index] for row in rows], kind)
+    return columns
+
+
+_WRITERS = {"parquet": (_writeParquet, "wb", {}), "npz": (_writeNpz, "wb", {}),
+            "csv": (_writeCsv, "w", {"newline": "", "encoding": "utf-8"})}
+_READERS = {"parquet": _readParquet, "npz": _readNpz, "csv": _readCsv}
+
+
+def partFiles(directory, table) -> list:
+    """Part files of a table in export order."""
+    return sorted(glob.glob(os.path.join(directory, table, "part-*.*")))
+
+
+def readTable(directory, table, latest: bool = True) -> dict:
+    """
+    All part files of a table as ``{column: array}``; nullable columns are masked arrays.
+    :param latest: keep only the last exported row of every key (e.g. case, rater and model of ratings), and
+      only if it does not delete the key
+    """
+    parts = [_READERS[os.path.splitext(path)[1][1:]](path, table) for path in partFiles(directory, table)]
+    columns = {}
+    for name, kind, nullable in TABLE_COLUMNS[table]:
+        values = np.concatenate([part[name][0] for part in parts]) if parts else np.array([], dtype=str if kind == "string" else kind)
+        nulls = np.concatenate([part[name][1] for part in parts]) if parts else np.array([], dtype=bool)
+        columns[name] = np.ma.MaskedArray(values, mask=nulls) if nullable else values
+    if latest and len(columns["caseId"]):
+        keys = np.stack([columns[name].astype(str) for name in TABLE_KEYS[table]], axis=1)
+        _, first = np.unique(keys[::-1], axis=0, return_index=True)
+        keep = np.sort(len(keys) - 1 - first)
+        keep = keep[columns["deleted"][keep] == 0]
+        columns = {name: values[keep] for name, values in columns.items()}
+    return columns
+
+
+#
+# Export
+#
+
+def reportFileRows(paths, columns=DEFAULT_REPORT_COLUMNS) -> list:
+    """``{column: (textHash, length)}`` of ``reports.json`` files, None for unreadable files.
+    Runs in process pool workers."""
+    rows = []
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                texts = reportTexts(json.load(f), columns)
+            rows.append({column: (None, None) if text is None else (textHash(text), len(text))
+                         for column, text in texts.items()})
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f"Skipping unreadable reports file {path}: {e}")
+            rows.append(None)
+    return rows
+
+
+def _mapChunks(function, paths, maxWorkers=None) -> list:
+    """``function(chunk)`` over chunks of ``paths``, concatenated; on a process pool if there are several chunks."""
+    chunks = [paths[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(paths), PARSE_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        return [result for chunk in chunks for result in function(chunk)]
+    with processPool(maxWorkers) as executor:
+        return [result for results in executor.map(function, chunks) for result in results]
+
+
+class ColumnarExport:
+    """Export directory that ratings, reports and metrics are appended to. Thread safe, but only one process
+    should export into a directory at a time."""
+
+    def __init__(self, directory, format=None, partRows=PART_ROWS) -> None:
+        self.directory = directory
+        self.format = format or defaultFormat()
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown export format {self.format}, expected one of {', '.join(FORMATS)}")
+        self.partRows = partRows
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, EXPORT_STATE_FILE_NAME), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        with self._lock:
+            for table in TABLE_COLUMNS:
+                # Parts of an interrupted export, the rows in them are exported again
+                for path in partFiles(directory, table)[self._nextPart(table):]:
+                    os.remove(path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _meta(self, key, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _nextPart(self, table) -> int:
+        return self._meta(f"nextPart:{table}", 0)
+
+    def _writeParts(self, table, rows):
+        """Write an iterable of rows as new part files of up to ``partRows`` rows each.
+        Returns the number of rows and the meta rows that record the parts; call with the lock held."""
+        os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+        writer, mode, openArgs = _WRITERS[self.format]
+        part = self._nextPart(table)
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.partRows))
+            if not batch:
+                break
+            columns = [list(column) for column in zip(*batch)]
+            path = os.path.join(self.directory, table, f"part-{part:06d}.{self.format}")
+            atomicWrite(path, lambda f: writer(f, table, columns), mode=mode, **openArgs)
+            count += len(batch)
+            part += 1
+        return count, [(f"nextPart:{table}", part)]
+
+    def exportStore(self, path) -> int:
+        """Append the ratings of a score store database that changed since its last export.
+        Returns the number of appended rows (one per case, rater and model)."""
+        return self._exportSource(RATINGS_TABLE, path, "ratings", lambda source: _groupRatings(source.execute(
+            "SELECT caseId, rater, model, criterion, score, updated FROM ratings ORDER BY caseId, rater, model")))
+
+    def exportMetrics(self, path) -> int:
+        """Append the report metrics of a database (usually the score store) that changed since its last export."""
+        return self._exportSource(METRICS_TABLE, path, "report_metrics", lambda source: source.execute(
+            f"SELECT caseId, model, referenceHash, candidateHash, {', '.join(METRICS)}, updated FROM report_metrics "
+            "ORDER BY caseId, model"))
+
+    def _exportSource(self, table, path, sourceTable, readRows) -> int:
+        """
+        Append the rows of a source database whose values changed since they were last exported from it.
+        Every row is compared with the hash recorded for its key and source, so rows are found whatever their
+        ``updated`` time, and rows exported before are not appended again. Keys exported before that the
+        source no longer has are appended as deleted. The source is not read at all if its files did not
+        change since the last export.
+        :param readRows: function of the source connection that returns the rows sorted by key
+        :return: number of appended rows
+        """
+        source = os.path.abspath(path)
+        state, racy = _sourceState(source)
+        stateKey = f"sourceState:{table}:{source}"
+        with self._lock:
+            if self._meta(stateKey) == state:
+                return 0
+            db = _openSource(path, sourceTable)
+            if db is None:
+                return 0
+            keyLength = len(TABLE_KEYS[table])
+            known = dict(self._db.execute("SELECT key, hash FROM rowHashes WHERE tableName=? AND source=?",
+                                          (table, source)))
+            hashes = []
+            deleted = []
+
+            def changedRows():
+                for row in readRows(db):
+                    key = KEY_SEPARATOR.join(row[:keyLength])
+                    # The updated time is left out, rows saved again with the same values are not appended
+                    hash = textHash(json.dumps(list(row[keyLength:-1])))
+                    if known.pop(key, None) != hash:
+                        hashes.append((table, source, key, hash))
+                        yield tuple(row) + (0,)
+                now = time.time()
+                for key in known:
+                    deleted.append((table, source, key))
+                    yield deletionRow(table, key.split(KEY_SEPARATOR), now)
+
+            try:
+                count, meta = self._writeParts(table, changedRows())
+            finally:
+                db.close()
+            # Sources modified within the racy interval may change again unnoticed, they are read again next time
+            meta.append((stateKey, None if racy else state))
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+                self._db.executemany("INSERT OR REPLACE INTO rowHashes VALUES (?, ?, ?, ?)", hashes)
+                self._db.executemany("DELETE FROM rowHashes WHERE tableName=? AND source=? AND key=?", deleted)
+        return count
+
+    def exportReports(self, records, updated=None, source=None) -> int:
+        """
+        Append the report text hashes of cases whose reports changed since their last export.
+        :param records: iterable of ``(caseId, texts)`` with ``texts`` as returned by ``reportTexts``
+        :param updated: time of the rows, by default now
+        :param source: path of what ``records`` are all the cases of (a dataset folder or a corpus); the reports
+          of cases exported from it before that are no longer in ``records`` are appended as deleted
+        :return: number of appended rows (one per case and report column)
+        """
+        updated = time.time() if updated is None else updated
+        caseHashes = {}
+        for caseId, texts in records:
+            caseHashes[caseId] = {column: None if text is None else (textHash(text), len(text))
+                                  for column, text in texts.items()}
+        return self._appendReports([(caseId, hashes, updated) for caseId, hashes in caseHashes.items()], source=source)
+
+    def _appendReports(self, cases, fileRows=(), removed=(), source=None) -> int:
+        """Append the changed reports of ``(caseId, {column: (textHash, length) or None}, updated)`` and record
+        the exported ``files`` rows. The reports of ``removed`` files (``(caseId, path)``), and with ``source``
+        of the cases exported from it before that are not in ``cases``, are appended as deleted."""
+        with self._lock:
+            known = {(caseId, column): hash for caseId, column, hash in self._db.execute("SELECT * FROM reportHashes")}
+            rows = []
+            for caseId, hashes, updated in cases:
+                for column, value in hashes.items():
+                    hash, length = value or (None, None)
+                    if (caseId, column) not in known or known[(caseId, column)] != hash:
+                        rows.append((caseId, column, hash, length, updated, 0))
+            removedCases = {caseId for caseId, _ in removed}
+            sourceCases = []
+            if source is not None:
+                source = os.path.abspath(source)
+                sourceCases = [(REPORTS_TABLE, source, caseId, textHash(json.dumps(hashes, sort_keys=True)))
+                               for caseId, hashes, _ in cases]
+                exported = {row[0] for row in self._db.execute(
+                    "SELECT key FROM rowHashes WHERE tableName=? AND source=?", (REPORTS_TABLE, source))}
+                removedCases.update(exported - {caseId for caseId, _, _ in cases})
+            now = time.time()
+            deleted = [deletionRow(REPORTS_TABLE, key, now) for key in known if key[0] in removedCases]
+            _, meta = self._writeParts(REPORTS_TABLE, rows + deleted)
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+                self._db.executemany("INSERT OR REPLACE INTO reportHashes VALUES (?, ?, ?)",
+                                     [row[:3] for row in rows])
+                self._db.executemany("DELETE FROM reportHashes WHERE caseId=? AND column=?", [row[:2] for row in deleted])
+                self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", fileRows)
+                self._db.executemany("DELETE FROM files WHERE caseId=? AND path=?", removed)
+                if source is not None:
+                    self._db.execute("DELETE FROM rowHashes WHERE tableName=? AND source=?", (REPORTS_TABLE, source))
+                    self._db.executemany("INSERT INTO rowHashes VALUES (?, ?, ?, ?)", sourceCases)
+        return len(rows) + len(deleted)
+
+    def _changedFiles(self, rootPath, cases, fileName) -> list:
+        """``(caseId, path, mtime, size)`` of the files named ``fileName`` next to the images of ``cases``
+        (``(caseId, imagePath)``) of a dataset that are new or changed since their last export, with ``mtime``
+        None for files that are read again next time, a dict path -> mtime, and ``(caseId, path)`` of the
+        exported files below ``rootPath`` that no longer exist (or whose case no longer exists)."""
+        with self._lock:
+            known = {(caseId, path): (mtime, size) for caseId, path, mtime, size in self._db.execute(
+                "SELECT caseId, path, mtime, size FROM files")}
+        now = time.time()
+        changed = []
+        modified = {}
+        present = set()
+        for caseId, imagePath in cases:
+            path = os.path.join(os.path.dirname(os.path.abspath(imagePath)), fileName)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            present.add((caseId, path))
+            if known.get((caseId, path)) != (stat.st_mtime, stat.st_size):
+                # Files modified within the racy interval may change again unnoticed, they are read again next time
+                mtime = stat.st_mtime if now - stat.st_mtime > RACY_INTERVAL else None
+                changed.append((caseId, path, mtime, stat.st_size))
+                modified[path] = stat.st_mtime
+        prefix = os.path.join(os.path.abspath(rootPath), "")
+        removed = [key for key in known if key not in present and key[1].startswith(prefix)
+                   and os.path.basename(key[1]) == fileName]
+        return changed, modified, removed
+
+    def exportDataset(self, rootPath, columns=DEFAULT_REPORT_COLUMNS, legacy: bool = False, maxWorkers=None) -> dict:
+        """
+        Append the reports of a dataset, and with ``legacy`` its ``human.json`` ratings (rater ``human``).
+        Only ``reports.json`` and ``human.json`` files that are new or changed since the last export are read.
+        :return: number of appended rows per table
+        """
+        cases = []
+        for imagePath in findCases(rootPath):
+            cases.append((os.path.relpath(imagePath, rootPath).replace(os.sep, "/"), imagePath))
+        result = {}
+        changed, modified, removed = self._changedFiles(rootPath, cases, REPORTS_FILE_NAME)
+        paths = sorted(modified)
+        parsed = dict(zip(paths, _mapChunks(functools.partial(reportFileRows, columns=columns), paths, maxWorkers)))
+        # Unreadable files are not recorded, so they are read again next time
+        changed = [row for row in changed if parsed[row[1]] is not None]
+        result[REPORTS_TABLE] = self._appendReports(
+            [(caseId, parsed[path], modified[path]) for caseId, path, _, _ in changed], changed, removed)
+        if legacy:
+            result[RATINGS_TABLE] = self._exportLegacy(rootPath, cases, maxWorkers)
+        return result
+
+    def _exportLegacy(self, rootPath, cases, maxWorkers=None) -> int:
+        changed, modified, removed = self._changedFiles(rootPath, cases, LEGACY_FILE_NAME)
+        paths = sorted(modified)
+        scores = dict(zip(paths, _mapChunks(parseLegacyFiles, paths, maxWorkers)))
+        rows = []
+        for caseId, path, _, _ in changed:
+            for modelIndex, model in enumerate(MODELS):
+                values = scores[path][modelIndex]
+                rows.append((caseId, LEGACY_RATER, model) + tuple(None if np.isnan(value) else int(value) for value in values)
+                            + (modified[path], 0))
+        now = time.time()
+        rows += [deletionRow(RATINGS_TABLE, (caseId, LEGACY_RATER, model), now) for caseId, _ in removed for model in MODELS]
+        with self._lock:
+            count, meta = self._writeParts(RATINGS_TABLE, rows)
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+                self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", changed)
+                self._db.executemany("DELETE FROM files WHERE caseId=? AND path=?", removed)
+        return count
+
+
+def _groupRatings(cursor):
+    """One row per case, rater and model from score store rows sorted by them."""
+    criterionIndex = {criterion: i for i, criterion in enumerate(CRITERIA)}
+    row = None
+    for caseId, rater, model, criterion, score, updated in cursor:
+        if row is None or row[:3] != [caseId, rater, model]:
+            if row is not None:
+                yield row
+            row = [caseId, rater, model] + [None] * len(CRITERIA) + [updated]
+        if criterion in criterionIndex:
+            row[3 + criterionIndex[criterion]] = score
+        row[-1] = max(row[-1], updated)
+    if row is not None:
+        yield row
+
+
+def _sourceState(path) -> tuple:
+    """Mtime and size of a source database and its write-ahead log as a string, and whether one of them was
+    modified within the racy interval."""
+    state = []
+    now = time.time()
+    racy = False
+    for name in (path, path + "-wal"):
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            state.append(None)
+            continue
+        state.append((stat.st_mtime_ns, stat.st_size))
+        racy = racy or now - stat.st_mtime <= RACY_INTERVAL
+    return json.dumps(state), racy
+
+
+def _openSource(path, table):
+    """Connection to a source database, or None if it has no ``table``."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    db = sqlite3.connect(path)
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is None:
+        db.close()
+        return None
+    return db
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Append changed ratings, reports and metrics to a columnar export.")
+    parser.add_argument("directory", help="export directory")
+    parser.add_argument("--store", action="append", default=[], help="score store database, can be repeated")
+    parser.add_argument("--metrics", action="append", default=[],
+                        help="report metrics database, can be repeated (default: the score stores)")
+    parser.add_argument("--dataset", default=None, help="dataset root folder with reports.json files")
+    parser.add_argument("--legacy", action="store_true", help="also export the human.json ratings of --dataset")
+    parser.add_argument("--corpus", action="append", default=[], help="JSONL report corpus, can be repeated")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--columns", default=None, help="report column mapping JSON file")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="part file format (default: parquet if pyarrow is installed, else npz)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from .Reports import loadReportColumns
+
+    logging.basicConfig(level=logging.INFO)
+    columns = loadReportColumns(args.columns) if args.columns else DEFAULT_REPORT_COLUMNS
+    export = ColumnarExport(args.directory, args.format)
+    startTime = time.time()
+    appended = dict.fromkeys(TABLE_COLUMNS, 0)
+    for path in args.store:
+        appended[RATINGS_TABLE] += export.exportStore(path)
+    for path in args.metrics or args.store:
+        appended[METRICS_TABLE] += export.exportMetrics(path)
+    if args.dataset:
+        for table, rows in export.exportDataset(args.dataset, columns, args.legacy, args.workers).items():
+            appended[table] += rows
+    for path in args.corpus:
+        appended[REPORTS_TABLE] += export.exportReports(corpusRecords(path, args.id_field, columns), source=path)
+    export.close()
+    logging.info(f"Appended {', '.join(f'{rows} {table} rows' for table, rows in appended.items())} "
+                 f"as {export.format} in {time.time() - startTime:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
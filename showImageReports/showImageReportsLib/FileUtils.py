@@ -0,0 +1,46 @@
+"""
+Small file helpers shared by the caches and stores of this module.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def fileContentHash(path) -> str:
+    """SHA-256 of the file content as hex string. The file is streamed, hashlib releases the GIL."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomicWrite(path, writeFunction, mode="wb", **openArgs) -> None:
+    """Write a file through ``writeFunction(f)`` into a temporary file and rename it into place,
+    so readers never see a partially written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode, **openArgs) as f:
+            writeFunction(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, path)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+
+def processPool(maxWorkers=None) -> ProcessPoolExecutor:
+    """Process pool for CPU bound batch jobs.
+
+    Workers are spawned (not forked) so that they do not inherit the Qt/VTK state of a running Slicer;
+    the functions they run must therefore be importable without slicer.
+    """
+    return ProcessPoolExecutor(max_workers=maxWorkers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,231 @@
+"""
+Dataset validation and ingest manifest.
+
+Validating a dataset up front (on a process pool) instead of at rating time
+catches unreadable NIfTI headers, corrupt or truncated voxel data, missing
+``reports.json`` files and incomplete reports before a session starts. The
+results are written to a manifest (SQLite, by default in the dataset root)
+together with the content hash of every image. When a dataset has a
+manifest, the module builds its worklist from the valid cases only and seeds
+the volume cache with the recorded hashes, so the rating loop does no
+validation I/O of its own.
+
+The manifest is updated incrementally: only cases whose image or reports
+changed (mtime, size) since the last run are validated again. Whether cases
+were added or removed since then is checked by walking the folders (one stat
+per case folder, not per file), so a stale manifest is noticed and updated
+when the dataset is opened.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Ingest /path/to/dataset --workers 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import as_completed
+
+from .FileUtils import fileContentHash, processPool
+from .NiftiIO import readNifti, readNiftiHeader
+from .Reports import DEFAULT_REPORT_COLUMNS, REPORTS_FILE_NAME, loadReportColumns, readReportsFile, reportTexts
+from .Worklist import findCases
+
+MANIFEST_FILE_NAME = "showImageReports.manifest.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS cases (
+    imagePath TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    reportsMtime REAL,
+    hash TEXT,
+    shape TEXT,
+    dtype TEXT,
+    valid INTEGER NOT NULL,
+    errors TEXT NOT NULL
+);
+"""
+
+
+def _reportsPath(imagePath) -> str:
+    return os.path.join(os.path.dirname(imagePath), REPORTS_FILE_NAME)
+
+
+def _fileStamp(imagePath):
+    """``(mtime, size, reportsMtime)`` of a case, reportsMtime is None if there is no reports file."""
+    stat = os.stat(imagePath)
+    try:
+        reportsMtime = os.stat(_reportsPath(imagePath)).st_mtime
+    except OSError:
+        reportsMtime = None
+    return stat.st_mtime, stat.st_size, reportsMtime
+
+
+def validateCase(imagePath, columns=DEFAULT_REPORT_COLUMNS) -> dict:
+    """Process pool worker: check the header, the complete voxel data and the reports of one case,
+    and hash the image. Problems are collected in ``errors``, nothing is raised.
+    If ``columns`` is None the reports are not checked (e.g. they are read from JSONL corpora)."""
+    mtime, size, reportsMtime = _fileStamp(imagePath)
+    result = {"imagePath": imagePath, "mtime": mtime, "size": size, "reportsMtime": reportsMtime,
+              "hash": None, "shape": None, "dtype": None, "errors": []}
+    try:
+        header = readNiftiHeader(imagePath)
+        result["shape"] = list(header.shape)
+        result["dtype"] = str(header.dtype)
+        # Reading all voxels verifies the gzip CRC and that the data is complete
+        readNifti(imagePath)
+        result["hash"] = fileContentHash(imagePath)
+    except Exception as e:
+        result["errors"].append(f"image: {e}")
+    if columns is None:
+        return result
+    try:
+        texts = reportTexts(readReportsFile(imagePath), columns)
+    except Exception as e:
+        result["errors"].append(f"reports: {e}")
+    else:
+        missing = [column for column, text in texts.items() if not text or not str(text).strip()]
+        if missing:
+            result["errors"].append(f"reports: missing or empty columns {', '.join(missing)}")
+    return result
+
+
+class DatasetManifest:
+    """Validation results and content hashes of all cases of a dataset."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def columns(self):
+        """Report column mapping the cases were validated against, or None if reports were not checked."""
+        columns = self._meta("columns")
+        return json.loads(columns) if columns else None
+
+    def update(self, rootPath, columns=DEFAULT_REPORT_COLUMNS, maxWorkers=None, progress=None) -> int:
+        """Validate all new and changed cases below ``rootPath`` and drop cases that no longer exist.
+        If ``columns`` differ from the ones of the last update, all cases are validated again.
+        :param columns: report column mapping to check the reports against, None to not check reports
+        :param progress: optional callable ``progress(done, total)``
+        :return: number of validated cases
+        """
+        imagePaths = [os.path.abspath(path) for path in findCases(rootPath)]
+        columnsJson = json.dumps(columns, sort_keys=True)
+        with self._lock:
+            known = {row[0]: tuple(row[1:]) for row in
+                     self._db.execute("SELECT imagePath, mtime, size, reportsMtime FROM cases")}
+        removed = set(known) - set(imagePaths)
+        if self._meta("columns") != columnsJson:
+            known = {}
+        pending = [path for path in imagePaths if known.get(path) != _fileStamp(path)]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM cases WHERE imagePath=?", [(path,) for path in removed])
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('rootPath', ?)", (os.path.abspath(rootPath),))
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('columns', ?)", (columnsJson,))
+        done = 0
+        if pending:
+            if progress:
+                progress(0, len(pending))
+            with processPool(maxWorkers) as executor:
+                futures = [executor.submit(validateCase, path, columns) for path in pending]
+                for future in as_completed(futures):
+                    self._addCase(future.result())
+                    done += 1
+                    if progress:
+                        progress(done, len(pending))
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (time.time(),))
+        return done
+
+    def isStale(self, rootPath) -> bool:
+        """True if cases below ``rootPath`` were added, removed or renamed since the last update.
+        Only the paths of the images are compared, not folder mtimes, which also change when other files are
+        written next to the images (e.g. human.json on every save). Images or reports rewritten in place are
+        not noticed, ``update`` finds those."""
+        if self._meta("updated") is None:
+            return True
+        with self._lock:
+            known = {row[0] for row in self._db.execute("SELECT imagePath FROM cases")}
+        return {os.path.abspath(path) for path in findCases(rootPath)} != known
+
+    def _addCase(self, result) -> None:
+        if result["errors"]:
+            logging.warning(f"Invalid case {result['imagePath']}: {'; '.join(result['errors'])}")
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                result["imagePath"], result["mtime"], result["size"], result["reportsMtime"], result["hash"],
+                json.dumps(result["shape"]), result["dtype"], int(not result["errors"]), json.dumps(result["errors"])))
+
+    def validCases(self) -> list:
+        """Sorted image paths of the cases that passed validation."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT imagePath FROM cases WHERE valid ORDER BY imagePath")]
+
+    def invalidCases(self) -> dict:
+        """Image path -> list of problems, for the cases that failed validation."""
+        with self._lock:
+            rows = self._db.execute("SELECT imagePath, errors FROM cases WHERE NOT valid ORDER BY imagePath").fetchall()
+        return {imagePath: json.loads(errors) for imagePath, errors in rows}
+
+    def contentHashes(self) -> list:
+        """``(imagePath, mtime, size, hash)`` of all valid cases, in the form the volume cache records sources."""
+        with self._lock:
+            return self._db.execute("SELECT imagePath, mtime, size, hash FROM cases WHERE valid").fetchall()
+
+    def summary(self) -> dict:
+        with self._lock:
+            total, valid = self._db.execute("SELECT COUNT(*), COALESCE(SUM(valid), 0) FROM cases").fetchone()
+        return {"rootPath": self._meta("rootPath"), "cases": total, "valid": valid, "invalid": total - valid,
+                "updated": self._meta("updated")}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Validate all cases of a dataset and write its ingest manifest.")
+    parser.add_argument("datasetRoot")
+    parser.add_argument("--manifest", default=None, help=f"manifest file (default: {MANIFEST_FILE_NAME} in the dataset root)")
+    parser.add_argument("--columns", default=None, help="report column mapping JSON file")
+    parser.add_argument("--no-reports", action="store_true", help="do not check reports.json (reports come from corpora)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    columns = loadReportColumns(args.columns) if args.columns else DEFAULT_REPORT_COLUMNS
+    if args.no_reports:
+        columns = None
+    manifest = DatasetManifest(args.manifest or os.path.join(args.datasetRoot, MANIFEST_FILE_NAME))
+    startTime = time.time()
+    validated = manifest.update(args.datasetRoot, columns, args.workers,
+                                progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    if validated:
+        print()
+    summary = manifest.summary()
+    logging.info(f"Validated {validated} cases in {time.time() - startTime:.1f} seconds, "
+                 f"{summary['valid']} of {summary['cases']} cases are valid")
+    for imagePath, errors in manifest.invalidCases().items():
+        print(f"{imagePath}: {'; '.join(errors)}")
+    manifest.close()
+
+
+if __name__ == "__main__":
+    main()
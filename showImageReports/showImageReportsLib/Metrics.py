@@ -0,0 +1,424 @@
+"""
+Automatic comparison of model reports with the ground truth report.
+
+Every model report of a case is scored against the ground truth with
+
+- ``bleu``: BLEU-4 on tokens (single CJK characters, Latin words, numbers) with
+  add-one smoothing of the higher orders,
+- ``rougeL``: ROUGE-L F1 on the same tokens,
+- ``chrf``: chrF (character 1..6-grams, beta 2), whitespace ignored,
+- ``termF1``: F1 of the clinical terms mentioned in both reports.
+
+Texts are tokenized once per worker process and cached, n-grams are counted
+with ``np.unique`` on packed n-gram windows and the LCS uses a bit-parallel
+algorithm on Python integers (one pass over the candidate). Cases are scored
+in chunks on a process pool. Results go into a ``report_metrics`` table,
+normally in the score store database so they can be correlated with the human
+ratings; unchanged report pairs (by text hash) are not scored again.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Metrics --dataset /path/to/dataset --output scores.sqlite --correlate
+    PythonSlicer -m showImageReportsLib.Metrics --corpus reports.jsonl --output metrics.sqlite
+"""
+
+import argparse
+import json
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+import warnings
+from concurrent.futures import as_completed
+from functools import lru_cache
+
+import numpy as np
+
+from .FileUtils import processPool
+from .Reports import (
+    DEFAULT_REPORT_COLUMNS,
+    GROUND_TRUTH_COLUMN,
+    corpusRecords,
+    datasetRecords,
+    loadReportColumns,
+    textHash,
+)
+from .Scores import MODELS
+
+METRICS = ("bleu", "rougeL", "chrf", "termF1")
+BLEU_ORDER = 4
+CHRF_ORDER = 6
+CHRF_BETA = 2.0
+METRIC_CHUNK_SIZE = 500
+TOKEN_CACHE_SIZE = 8192
+
+TOKEN_PATTERN = re.compile(r"[㐀-鿿]|[a-z]+|\d+(?:\.\d+)?")
+WORD_CHARACTER = re.compile(r"[a-z0-9_]")
+
+# Common head CT findings and structures, in Chinese and English
+DEFAULT_CLINICAL_TERMS = (
+    "出血", "血肿", "梗死", "梗塞", "缺血", "水肿", "占位", "钙化", "骨折", "积液", "积气", "萎缩", "软化灶", "脑积水",
+    "高密度", "低密度", "等密度", "混杂密度", "中线", "移位", "脑室", "脑沟", "脑池", "脑裂", "蛛网膜下腔", "硬膜下",
+    "硬膜外", "脑实质", "白质", "灰质", "基底节", "丘脑", "额叶", "颞叶", "顶叶", "枕叶", "小脑", "脑干", "颅骨",
+    "片状", "结节", "类圆形", "斑点状", "边界清", "边界不清", "肿瘤", "转移", "脑膜瘤", "胶质瘤", "脓肿",
+    "hemorrhage", "hematoma", "infarct", "ischemia", "edema", "mass", "calcification", "fracture", "hydrocephalus",
+    "atrophy", "hyperdense", "hypodense", "isodense", "midline", "shift", "ventricle", "sulci", "cistern",
+    "subarachnoid", "subdural", "epidural", "white matter", "basal ganglia", "thalamus", "frontal", "temporal",
+    "parietal", "occipital", "cerebellum", "brainstem", "skull", "tumor", "metastasis", "meningioma", "glioma",
+    "abscess",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_metrics (
+    caseId TEXT NOT NULL,
+    model TEXT NOT NULL,
+    referenceHash TEXT NOT NULL,
+    candidateHash TEXT NOT NULL,
+    bleu REAL,
+    rougeL REAL,
+    chrf REAL,
+    termF1 REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (caseId, model)
+);
+"""
+
+
+#
+# Tokens and n-grams
+#
+
+# Token -> id, per process. Ids only have to agree within one process.
+_vocabulary = {}
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def tokenIds(text) -> np.ndarray:
+    """Token ids of a text: each CJK character, Latin word and number is one token."""
+    ids = np.array([_vocabulary.setdefault(token, len(_vocabulary)) for token in TOKEN_PATTERN.findall(text.lower())],
+                   dtype=np.int64)
+    ids.flags.writeable = False
+    return ids
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def characterIds(text) -> np.ndarray:
+    """Code points of a text without whitespace, for chrF."""
+    ids = np.array([ord(c) for c in text.lower() if not c.isspace()], dtype=np.int64)
+    ids.flags.writeable = False
+    return ids
+
+
+def ngramCounts(ids: np.ndarray, n):
+    """Distinct n-grams of a token id sequence (packed as opaque byte strings) and how often each occurs."""
+    if len(ids) < n:
+        return np.empty(0, dtype=np.dtype((np.void, 8 * n))), np.empty(0, dtype=np.intp)
+    windows = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(ids, n))
+    return np.unique(windows.view(np.dtype((np.void, 8 * n))).ravel(), return_counts=True)
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _tokenNgrams(text):
+    ids = tokenIds(text)
+    return [ngramCounts(ids, n) for n in range(1, BLEU_ORDER + 1)]
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _characterNgrams(text):
+    ids = characterIds(text)
+    return [ngramCounts(ids, n) for n in range(1, CHRF_ORDER + 1)]
+
+
+def clippedMatches(candidate, reference) -> int:
+    """Number of candidate n-grams that also occur in the reference, each counted at most as often as there."""
+    candidateKeys, candidateCounts = candidate
+    referenceKeys, referenceCounts = reference
+    _, candidateIndex, referenceIndex = np.intersect1d(candidateKeys, referenceKeys, assume_unique=True,
+                                                       return_indices=True)
+    return int(np.minimum(candidateCounts[candidateIndex], referenceCounts[referenceIndex]).sum())
+
+
+def lcsLength(a: np.ndarray, b: np.ndarray) -> int:
+    """Length of the longest common subsequence, bit-parallel over ``b`` (Hyyrö's formulation)."""
+    if len(a) == 0 or len(b) == 0:
+        return 0
+    matches = {}
+    for position, token in enumerate(b.tolist()):
+        matches[token] = matches.get(token, 0) | (1 << position)
+    allBits = (1 << len(b)) - 1
+    v = allBits
+    for token in a.tolist():
+        u = v & matches.get(token, 0)
+        v = ((v + u) | (v - u)) & allBits
+    return len(b) - bin(v).count("1")
+
+
+#
+# Metrics
+#
+
+def bleu(candidate, reference) -> float:
+    candidateLength = len(tokenIds(candidate))
+    referenceLength = len(tokenIds(reference))
+    if candidateLength == 0 or referenceLength == 0:
+        return 0.0
+    logPrecision = 0.0
+    for n, (candidateNgrams, referenceNgrams) in enumerate(zip(_tokenNgrams(candidate), _tokenNgrams(reference)), start=1):
+        matches = clippedMatches(candidateNgrams, referenceNgrams)
+        total = max(candidateLength - n + 1, 0)
+        if n == 1:
+            if matches == 0:
+                return 0.0
+            logPrecision += math.log(matches / total)
+        else:
+            logPrecision += math.log((matches + 1) / (total + 1))
+    brevityPenalty = 1.0 if candidateLength > referenceLength else math.exp(1 - referenceLength / candidateLength)
+    return brevityPenalty * math.exp(logPrecision / BLEU_ORDER)
+
+
+def rougeL(candidate, reference) -> float:
+    candidateIds = tokenIds(candidate)
+    referenceIds = tokenIds(reference)
+    lcs = lcsLength(candidateIds, referenceIds)
+    if lcs == 0:
+        return 0.0
+    precision = lcs / len(candidateIds)
+    recall = lcs / len(referenceIds)
+    return 2 * precision * recall / (precision + recall)
+
+
+def chrf(candidate, reference) -> float:
+    precisions = []
+    recalls = []
+    for candidateNgrams, referenceNgrams in zip(_characterNgrams(candidate), _characterNgrams(reference)):
+        candidateTotal = int(candidateNgrams[1].sum())
+        referenceTotal = int(referenceNgrams[1].sum())
+        if candidateTotal == 0 or referenceTotal == 0:
+            continue
+        matches = clippedMatches(candidateNgrams, referenceNgrams)
+        precisions.append(matches / candidateTotal)
+        recalls.append(matches / referenceTotal)
+    if not precisions:
+        return 0.0
+    precision = sum(precisions) / len(precisions)
+    recall = sum(recalls) / len(recalls)
+    if precision + recall == 0:
+        return 0.0
+    beta2 = CHRF_BETA ** 2
+    return (1 + beta2) * precision * recall / (beta2 * precision + recall)
+
+
+@lru_cache(maxsize=8)
+def _termMatchers(terms) -> tuple:
+    """Per term a pattern if it is a Latin term, which only matches whole words as in ``Terms.py``, else None."""
+    matchers = []
+    for term in terms:
+        if WORD_CHARACTER.fullmatch(term[:1]) or WORD_CHARACTER.fullmatch(term[-1:]):
+            matchers.append((term, re.compile(rf"(?<![a-z0-9_]){re.escape(term)}(?![a-z0-9_])")))
+        else:
+            matchers.append((term, None))
+    return tuple(matchers)
+
+
+def mentionedTerms(text, terms=DEFAULT_CLINICAL_TERMS) -> set:
+    """Terms mentioned in a text. CJK terms are found anywhere, Latin terms only as whole words
+    (e.g. "mass" is not found in "massive")."""
+    text = text.lower()
+    return {term for term, pattern in _termMatchers(tuple(terms))
+            if (pattern.search(text) is not None if pattern else term in text)}
+
+
+def termF1(candidate, reference, terms=DEFAULT_CLINICAL_TERMS):
+    """F1 of the clinical terms of the candidate against those of the reference, None if neither mentions any."""
+    candidateTerms = mentionedTerms(candidate, terms)
+    referenceTerms = mentionedTerms(reference, terms)
+    if not candidateTerms and not referenceTerms:
+        return None
+    return 2 * len(candidateTerms & referenceTerms) / (len(candidateTerms) + len(referenceTerms))
+
+
+def scoreReport(candidate, reference, terms=DEFAULT_CLINICAL_TERMS) -> dict:
+    """All metrics of one model report against the ground truth report."""
+    return {
+        "bleu": bleu(candidate, reference),
+        "rougeL": rougeL(candidate, reference),
+        "chrf": chrf(candidate, reference),
+        "termF1": termF1(candidate, reference, terms),
+    }
+
+
+def scoreChunk(items, terms=DEFAULT_CLINICAL_TERMS) -> list:
+    """Process pool worker: score ``(caseId, model, candidate, reference)`` items.
+    Returns rows as stored in the ``report_metrics`` table."""
+    now = time.time()
+    rows = []
+    for caseId, model, candidate, reference in items:
+        metrics = scoreReport(candidate, reference, terms)
+        rows.append((caseId, model, textHash(reference), textHash(candidate),
+                     *(metrics[metric] for metric in METRICS), now))
+    return rows
+
+
+#
+# Storage
+#
+
+class MetricStore:
+    """``report_metrics`` table in a SQLite database, usually the score store database. Thread safe."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def textHashes(self) -> dict:
+        """``(caseId, model) -> (referenceHash, candidateHash)`` of all scored reports."""
+        with self._lock:
+            rows = self._db.execute("SELECT caseId, model, referenceHash, candidateHash FROM report_metrics").fetchall()
+        return {(caseId, model): (referenceHash, candidateHash) for caseId, model, referenceHash, candidateHash in rows}
+
+    def put(self, rows) -> None:
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO report_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def metrics(self, caseId) -> dict:
+        """``{model: {metric: value}}`` of one case."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT model, {', '.join(METRICS)} FROM report_metrics WHERE caseId=?",
+                                    (caseId,)).fetchall()
+        return {row[0]: dict(zip(METRICS, row[1:])) for row in rows}
+
+    def metricArray(self, caseIds, models=MODELS) -> np.ndarray:
+        """Metrics as a float array ``[case, model, metric]`` in the given order, NaN where not computed."""
+        caseLookup = {caseId: i for i, caseId in enumerate(caseIds)}
+        modelLookup = {model: i for i, model in enumerate(models)}
+        values = np.full((len(caseLookup), len(modelLookup), len(METRICS)), np.nan)
+        with self._lock:
+            rows = self._db.execute(f"SELECT caseId, model, {', '.join(METRICS)} FROM report_metrics").fetchall()
+        for caseId, model, *metrics in rows:
+            if caseId in caseLookup and model in modelLookup:
+                values[caseLookup[caseId], modelLookup[model]] = [np.nan if m is None else m for m in metrics]
+        return values
+
+    def modelMeans(self) -> dict:
+        with self._lock:
+            rows = self._db.execute(f"SELECT model, COUNT(*), {', '.join(f'AVG({m})' for m in METRICS)} "
+                                    "FROM report_metrics GROUP BY model ORDER BY model").fetchall()
+        return {row[0]: {"count": row[1], **dict(zip(METRICS, row[2:]))} for row in rows}
+
+
+#
+# Batch scoring
+#
+
+def computeMetrics(records, store: MetricStore, terms=DEFAULT_CLINICAL_TERMS, maxWorkers=None, progress=None,
+                   chunkSize=METRIC_CHUNK_SIZE) -> int:
+    """
+    Score all model reports of ``records`` against their ground truth and store the results.
+    :param records: iterable of ``(caseId, texts)`` with ``texts`` as returned by ``reportTexts``
+    :param progress: optional callable ``progress(done, total)`` counting scored reports
+    :return: number of scored reports; pairs whose texts did not change since they were stored are skipped
+    """
+    known = store.textHashes()
+    items = []
+    for caseId, texts in records:
+        reference = texts.get(GROUND_TRUTH_COLUMN)
+        if not reference:
+            continue
+        for model in MODELS:
+            candidate = texts.get(model)
+            if candidate and known.get((caseId, model)) != (textHash(reference), textHash(candidate)):
+                items.append((caseId, model, candidate, reference))
+    chunks = [items[i:i + chunkSize] for i in range(0, len(items), chunkSize)]
+    done = 0
+    if len(chunks) <= 1:
+        for chunk in chunks:
+            store.put(scoreChunk(chunk, terms))
+            done += len(chunk)
+    else:
+        with processPool(maxWorkers) as executor:
+            futures = [executor.submit(scoreChunk, chunk, terms) for chunk in chunks]
+            for future in as_completed(futures):
+                rows = future.result()
+                store.put(rows)
+                done += len(rows)
+                if progress:
+                    progress(done, len(items))
+    return done
+
+
+def correlateWithRatings(ratings, store: MetricStore) -> dict:
+    """
+    Spearman correlation between each metric and the mean human score of each criterion over all rated
+    ``(case, model)`` pairs.
+    :param ratings: ``Aggregation.RatingArray`` with the same case IDs as the metrics
+    :return: ``{metric: {criterion: {"rho": float or None, "n": int}}}``
+    """
+    from .Aggregation import rankData
+
+    metrics = store.metricArray(ratings.caseIds, ratings.models)
+    with warnings.catch_warnings():
+        # Mean of cells that no rater scored
+        warnings.simplefilter("ignore", RuntimeWarning)
+        humanScores = np.nanmean(ratings.scores, axis=1)
+    result = {}
+    for metricIndex, metric in enumerate(METRICS):
+        result[metric] = {}
+        for criterionIndex, criterion in enumerate(ratings.criteria):
+            x = metrics[:, :, metricIndex].ravel()
+            y = humanScores[:, :, criterionIndex].ravel()
+            valid = ~np.isnan(x) & ~np.isnan(y)
+            rho = None
+            if valid.sum() > 2:
+                xRanks = rankData(x[valid])
+                yRanks = rankData(y[valid])
+                if xRanks.std() > 0 and yRanks.std() > 0:
+                    rho = float(np.corrcoef(xRanks, yRanks)[0, 1])
+            result[metric][criterion] = {"rho": rho, "n": int(valid.sum())}
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Score all model reports against the ground truth report.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dataset", help="dataset root folder with reports.json files")
+    source.add_argument("--corpus", help="JSONL report corpus")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--output", required=True, help="database to store the metrics in, e.g. the score store")
+    parser.add_argument("--columns", default=None, help="report column mapping JSON file")
+    parser.add_argument("--terms", default=None, help="clinical term list, one term per line")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--correlate", action="store_true", help="correlate with the ratings of the score store in --output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    columns = loadReportColumns(args.columns) if args.columns else DEFAULT_REPORT_COLUMNS
+    terms = DEFAULT_CLINICAL_TERMS
+    if args.terms:
+        with open(args.terms, encoding="utf-8") as f:
+            terms = tuple(line.strip().lower() for line in f if line.strip())
+    records = datasetRecords(args.dataset, columns) if args.dataset else corpusRecords(args.corpus, args.id_field, columns)
+    store = MetricStore(args.output)
+    startTime = time.time()
+    scored = computeMetrics(records, store, terms, args.workers,
+                            progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    print()
+    logging.info(f"Scored {scored} reports in {time.time() - startTime:.1f} seconds")
+    result = {"means": store.modelMeans()}
+    if args.correlate:
+        from .Aggregation import loadStoreRatings
+        result["correlations"] = correlateWithRatings(loadStoreRatings(args.output), store)
+    store.close()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
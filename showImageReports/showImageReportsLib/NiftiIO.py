@@ -0,0 +1,144 @@
+"""
+Minimal NIfTI-1 reader.
+
+Decodes ``.nii`` / ``.nii.gz`` files into a NumPy voxel array and an IJK to RAS
+matrix without touching the MRML scene, so it can run in worker threads and
+processes. Arrays use the slicer.util convention (``array[k, j, i]``).
+"""
+
+import gzip
+import os
+import struct
+
+import numpy as np
+
+NIFTI1_HEADER_SIZE = 348
+
+# NIfTI-1 datatype code -> NumPy scalar type
+NIFTI_DTYPES = {
+    2: np.uint8,
+    4: np.int16,
+    8: np.int32,
+    16: np.float32,
+    64: np.float64,
+    256: np.int8,
+    512: np.uint16,
+    768: np.uint32,
+    1024: np.int64,
+    1280: np.uint64,
+}
+
+
+def isNiftiFile(path) -> bool:
+    name = os.path.basename(path).lower()
+    return name.endswith(".nii") or name.endswith(".nii.gz")
+
+
+def openNifti(path):
+    """Open a NIfTI file for binary reading, transparently inflating gzip."""
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class NiftiHeader:
+    """Fields of a NIfTI-1 header that are needed to place the voxels in RAS space."""
+
+    def __init__(self, raw: bytes) -> None:
+        if len(raw) < NIFTI1_HEADER_SIZE:
+            raise ValueError("Truncated NIfTI header")
+        if struct.unpack("<i", raw[0:4])[0] == NIFTI1_HEADER_SIZE:
+            endian = "<"
+        elif struct.unpack(">i", raw[0:4])[0] == NIFTI1_HEADER_SIZE:
+            endian = ">"
+        else:
+            raise ValueError("Not a NIfTI-1 file (NIfTI-2 is not supported)")
+        magic = raw[344:348]
+        if magic != b"n+1\0":
+            raise ValueError(f"Unsupported NIfTI magic {magic!r}, only single-file NIfTI-1 is supported")
+
+        self.endian = endian
+        dim = struct.unpack(endian + "8h", raw[40:56])
+        if dim[0] < 3 or any(d > 1 for d in dim[4:dim[0] + 1]):
+            raise ValueError(f"Only 3D NIfTI volumes are supported, got dim={dim[:dim[0] + 1]}")
+        self.shape = (dim[3], dim[2], dim[1])  # k, j, i
+        self.datatype = struct.unpack(endian + "h", raw[70:72])[0]
+        if self.datatype not in NIFTI_DTYPES:
+            raise ValueError(f"Unsupported NIfTI datatype {self.datatype}")
+        self.dtype = np.dtype(NIFTI_DTYPES[self.datatype]).newbyteorder(endian)
+        self.pixdim = struct.unpack(endian + "8f", raw[76:108])
+        self.voxOffset = int(struct.unpack(endian + "f", raw[108:112])[0])
+        self.sclSlope, self.sclInter = struct.unpack(endian + "2f", raw[112:120])
+        self.qformCode, self.sformCode = struct.unpack(endian + "2h", raw[252:256])
+        self.quatern = struct.unpack(endian + "6f", raw[256:280])
+        self.srow = struct.unpack(endian + "12f", raw[280:328])
+
+    @property
+    def dataSize(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def spacing(self):
+        return tuple(abs(float(s)) for s in self.pixdim[1:4])
+
+    def ijkToRas(self) -> np.ndarray:
+        """4x4 IJK to RAS matrix, using sform, then qform, then pixdim as fallback."""
+        matrix = np.eye(4)
+        if self.sformCode > 0:
+            matrix[:3, :] = np.array(self.srow, dtype=np.float64).reshape(3, 4)
+        elif self.qformCode > 0:
+            b, c, d, qx, qy, qz = (float(v) for v in self.quatern)
+            a = np.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+            rotation = np.array([
+                [a * a + b * b - c * c - d * d, 2 * b * c - 2 * a * d, 2 * b * d + 2 * a * c],
+                [2 * b * c + 2 * a * d, a * a + c * c - b * b - d * d, 2 * c * d - 2 * a * b],
+                [2 * b * d - 2 * a * c, 2 * c * d + 2 * a * b, a * a + d * d - c * c - b * b],
+            ])
+            qfac = -1.0 if self.pixdim[0] < 0 else 1.0
+            scale = np.array([self.pixdim[1], self.pixdim[2], qfac * self.pixdim[3]])
+            matrix[:3, :3] = rotation * scale
+            matrix[:3, 3] = (qx, qy, qz)
+        else:
+            matrix[:3, :3] = np.diag(self.spacing)
+        return matrix
+
+    @property
+    def hasScaling(self) -> bool:
+        return self.sclSlope != 0.0 and (self.sclSlope != 1.0 or self.sclInter != 0.0)
+
+
+class NiftiVolume:
+    """Decoded voxel array plus its geometry."""
+
+    def __init__(self, array: np.ndarray, ijkToRas: np.ndarray, sourcePath=None) -> None:
+        self.array = array
+        self.ijkToRas = ijkToRas
+        self.sourcePath = sourcePath
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+
+def readNiftiHeader(path) -> NiftiHeader:
+    with openNifti(path) as f:
+        return NiftiHeader(f.read(NIFTI1_HEADER_SIZE))
+
+
+def readNifti(path) -> NiftiVolume:
+    """Decode a NIfTI-1 file into a ``NiftiVolume``.
+
+    Gzip inflate releases the GIL, so several files can be decoded concurrently from a thread pool.
+    """
+    with openNifti(path) as f:
+        header = NiftiHeader(f.read(NIFTI1_HEADER_SIZE))
+        f.seek(header.voxOffset)
+        data = f.read(header.dataSize)
+    if len(data) != header.dataSize:
+        raise ValueError(f"Truncated voxel data in {path}: expected {header.dataSize} bytes, got {len(data)}")
+    array = np.frombuffer(data, dtype=header.dtype).reshape(header.shape)
+    if header.hasScaling:
+        array = array.astype(np.float32) * np.float32(header.sclSlope) + np.float32(header.sclInter)
+    elif not header.dtype.isnative:
+        array = array.astype(header.dtype.newbyteorder("="))
+    return NiftiVolume(array, header.ijkToRas(), path)
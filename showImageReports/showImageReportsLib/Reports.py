@@ -0,0 +1,269 @@
+"""
+Report sources and report column configuration.
+
+Reports are read either from the ``reports.json`` next to each image, or from
+one or more JSONL corpora (one JSON object per line, e.g. one file per model
+run). Each corpus gets a persistent byte-offset index keyed by case ID, so a
+lookup is a single seek and parse. The index is updated incrementally when a
+corpus is appended to.
+
+Which report fields are shown for the ground truth and for each scored model
+is configured by a report column mapping::
+
+    {"<column>": {"fields": ["<field>", "<alias>", ...], "stripPrefix": true}}
+
+The first field present in a report record is used. ``stripPrefix`` drops
+everything up to the last full-width colon (e.g. "影像描述是：").
+
+The columns themselves are fixed: the ground truth and one column per entry of
+``Scores.MODELS``, which are the rows of the rating grid in the widget UI and
+of every score store. A mapping only chooses which report fields fill them; to
+rate a different set of models, change ``MODELS`` and the UI together.
+
+Command line usage (build or update the index of corpora)::
+
+    PythonSlicer -m showImageReportsLib.Reports model_run_1.jsonl model_run_2.jsonl --id-field id
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+REPORTS_FILE_NAME = "reports.json"
+GROUND_TRUTH_COLUMN = "gt"
+PREFIX_SEPARATOR = "："
+
+DEFAULT_REPORT_COLUMNS = {
+    GROUND_TRUTH_COLUMN: {"fields": ["gt"], "stripPrefix": True},
+    "mini": {"fields": ["minimed"]},
+    "gpt4": {"fields": ["gpt"]},
+    "radfm": {"fields": ["radfm"]},
+    "bf": {"fields": ["brainfound", "brainfound:"], "stripPrefix": True},
+}
+
+INDEX_SUFFIX = ".idx.sqlite"
+INDEX_HEAD_SIZE = 64 * 1024
+INDEX_BATCH_SIZE = 10000
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS offsets (
+    caseId TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def readReportsFile(imagePath) -> dict:
+    """Read the ``reports.json`` that belongs to the image at ``imagePath``."""
+    with open(os.path.join(os.path.dirname(imagePath), REPORTS_FILE_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def textHash(text) -> str:
+    """Short hash of a report text, by which metrics, term hits and exports detect changed reports."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def loadReportColumns(path) -> dict:
+    """Read a report column mapping from a JSON file."""
+    with open(path, encoding="utf-8") as f:
+        columns = json.load(f)
+    for column, spec in columns.items():
+        if not isinstance(spec.get("fields"), list) or not spec["fields"]:
+            raise ValueError(f"Report column {column} needs a non-empty 'fields' list")
+    return columns
+
+
+def reportTexts(reports, columns=DEFAULT_REPORT_COLUMNS) -> dict:
+    """Extract the text of every configured column from a report record. Missing columns give None."""
+    texts = {}
+    for column, spec in columns.items():
+        text = next((reports[field] for field in spec["fields"] if reports.get(field) is not None), None)
+        if text is not None and spec.get("stripPrefix"):
+            text = text.split(PREFIX_SEPARATOR)[-1]
+        texts[column] = text
+    return texts
+
+
+class ReportCorpus:
+    """One JSONL report corpus with a persistent case ID -> byte offset index.
+
+    The index is a SQLite file next to the corpus (``<corpus>.idx.sqlite``). It records how many
+    bytes were indexed and a copy of the first bytes of the corpus, so appended lines are indexed
+    incrementally and a rewritten corpus triggers a full rebuild. If a case ID occurs several times,
+    the last line wins, which allows appending corrections.
+    """
+
+    def __init__(self, path, idField="id", indexPath=None) -> None:
+        self.path = path
+        self.idField = idField
+        self.indexPath = indexPath or path + INDEX_SUFFIX
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.indexPath, check_same_thread=False)
+        self._db.executescript(_INDEX_SCHEMA)
+        self._file = None
+        self.update()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._db.close()
+
+    def _meta(self, key, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def update(self) -> int:
+        """Index lines appended since the last update (or rebuild if the corpus was rewritten).
+        Returns the number of newly indexed lines."""
+        with self._lock:
+            size = os.path.getsize(self.path)
+            with open(self.path, "rb") as f:
+                head = f.read(INDEX_HEAD_SIZE)
+            indexedBytes = self._meta("indexedBytes", 0)
+            indexedHead = self._meta("head", b"")
+            if size < indexedBytes or head[:len(indexedHead)] != indexedHead or self._meta("idField") != self.idField:
+                logging.info(f"Rebuilding report index of {self.path}")
+                with self._db:
+                    self._db.execute("DELETE FROM offsets")
+                indexedBytes = 0
+            if size == indexedBytes:
+                return 0
+            count = self._indexFrom(indexedBytes)
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('head', ?)", (head,))
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('idField', ?)", (self.idField,))
+            if self._file:
+                # Reopen so that the appended data is visible
+                self._file.close()
+                self._file = None
+            return count
+
+    def _indexFrom(self, offset) -> int:
+        count = 0
+        batch = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Incomplete last line, still being written
+                    break
+                if line.strip():
+                    try:
+                        caseId = str(json.loads(line)[self.idField])
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.warning(f"Skipping invalid line at byte {offset} of {self.path}: {e}")
+                    else:
+                        batch.append((caseId, offset))
+                        count += 1
+                offset += len(line)
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    self._writeOffsets(batch, offset)
+                    batch = []
+        self._writeOffsets(batch, offset)
+        return count
+
+    def _writeOffsets(self, batch, indexedBytes) -> None:
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO offsets VALUES (?, ?)", batch)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('indexedBytes', ?)", (indexedBytes,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM offsets").fetchone()[0]
+
+    def __contains__(self, caseId) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM offsets WHERE caseId=?", (caseId,)).fetchone() is not None
+
+    def caseIds(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT caseId FROM offsets")]
+
+    def get(self, caseId):
+        """Return the report record of a case, or None if the corpus has no line for it."""
+        with self._lock:
+            row = self._db.execute("SELECT offset FROM offsets WHERE caseId=?", (caseId,)).fetchone()
+            if row is None:
+                return None
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            self._file.seek(row[0])
+            line = self._file.readline()
+        return json.loads(line)
+
+
+class ReportCorpora:
+    """Several JSONL corpora queried together; the records found for a case are merged in corpus order."""
+
+    def __init__(self, paths, idField="id") -> None:
+        self.corpora = [ReportCorpus(path, idField) for path in paths]
+
+    def close(self) -> None:
+        for corpus in self.corpora:
+            corpus.close()
+
+    def update(self) -> int:
+        return sum(corpus.update() for corpus in self.corpora)
+
+    def get(self, caseIds):
+        """Merged record of the first of ``caseIds`` (alternative IDs of the same case) found in each corpus,
+        or None if no corpus has the case."""
+        if isinstance(caseIds, str):
+            caseIds = [caseIds]
+        merged = None
+        for corpus in self.corpora:
+            record = next((r for r in (corpus.get(caseId) for caseId in caseIds) if r is not None), None)
+            if record is not None:
+                merged = {**(merged or {}), **record}
+        return merged
+
+
+def datasetRecords(rootPath, columns=DEFAULT_REPORT_COLUMNS):
+    """``(caseId, texts)`` of all cases of a dataset from their reports.json, with the case IDs of the score store."""
+    # Worklist imports this module
+    from .Worklist import CaseWorklist
+
+    worklist = CaseWorklist(rootPath)
+    for index, imagePath in enumerate(worklist.cases):
+        try:
+            yield worklist.caseId(index), reportTexts(readReportsFile(imagePath), columns)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping reports of {imagePath}: {e}")
+
+
+def corpusRecords(path, idField="id", columns=DEFAULT_REPORT_COLUMNS):
+    """``(caseId, texts)`` of all lines of a JSONL report corpus; the last line of a case wins."""
+    corpus = ReportCorpus(path, idField)
+    try:
+        for caseId in corpus.caseIds():
+            yield caseId, reportTexts(corpus.get(caseId), columns)
+    finally:
+        corpus.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Build or update the byte-offset index of JSONL report corpora.")
+    parser.add_argument("corpora", nargs="+")
+    parser.add_argument("--id-field", default="id")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for path in args.corpora:
+        corpus = ReportCorpus(path, args.id_field)
+        print(f"{path}: {len(corpus)} cases indexed")
+        corpus.close()
+
+
+if __name__ == "__main__":
+    main()
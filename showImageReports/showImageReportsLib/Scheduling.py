@@ -0,0 +1,219 @@
+"""
+Adaptive case order for rating sessions.
+
+Cases are ordered by the expected statistical value of one more rating per
+rater-minute. The value of a case adds up
+
+- coverage: how many ratings it still lacks to reach ``TARGET_RATINGS``,
+- disagreement: the mean standard deviation of the scores raters gave to the
+  same cells, relative to the largest possible one,
+- divergence: how much the automatic report metrics of the models differ,
+  i.e. cases where the models are hard to tell apart by metrics alone,
+
+and is divided by the relative time the case took raters so far (its time
+factor, 1 until it was timed). Each rater contributes the time of their
+latest saved session of a case, so saving a case repeatedly (autosave)
+updates its time instead of counting it again. A rater is never offered a
+case they rated.
+
+Score sums per cell and case are kept as running sums, and the order is a
+heap with lazily invalidated entries, so recording a save updates only the
+saved case in ``O(cells + log cases)`` instead of recomputing all cases.
+"""
+
+import heapq
+import threading
+import warnings
+
+import numpy as np
+
+from .Scores import CRITERIA, MAX_SCORE, MIN_SCORE, MODELS
+
+TARGET_RATINGS = 2
+COVERAGE_WEIGHT = 1.0
+DISAGREEMENT_WEIGHT = 1.0
+DIVERGENCE_WEIGHT = 0.5
+# Time factors are clipped to this range, so a single slow or fast session does not dominate the order
+TIME_FACTOR_RANGE = (0.25, 4.0)
+
+
+def metricDivergence(metrics: np.ndarray) -> np.ndarray:
+    """Divergence of every case from its ``[case, model, metric]`` metric array (metrics in 0..1): the standard
+    deviation over models, averaged over metrics and scaled to 0..1. Cases without metrics get 0."""
+    if metrics.size == 0:
+        return np.zeros(len(metrics))
+    valid = ~np.isnan(metrics)
+    counts = valid.sum(axis=1)
+    values = np.where(valid, metrics, 0.0)
+    means = values.sum(axis=1) / np.maximum(counts, 1)
+    variances = np.where(valid, (values - means[:, None, :]) ** 2, 0.0).sum(axis=1) / np.maximum(counts, 1)
+    deviations = np.where(counts >= 2, np.sqrt(variances), np.nan)
+    with warnings.catch_warnings():
+        # Cases without metrics
+        warnings.simplefilter("ignore", RuntimeWarning)
+        divergence = np.nanmean(deviations, axis=1) if deviations.shape[1] else np.zeros(len(metrics))
+    # 0.5 is the largest standard deviation of values in 0..1
+    return np.nan_to_num(np.clip(divergence / 0.5, 0.0, 1.0))
+
+
+class CaseScheduler:
+    """Incrementally updated priority order of the cases of a worklist. Thread safe."""
+
+    def __init__(self, caseIds, divergence=None) -> None:
+        self.caseIds = list(caseIds)
+        self._caseIndex = {caseId: i for i, caseId in enumerate(self.caseIds)}
+        cases = len(self.caseIds)
+        self._lock = threading.Lock()
+        cells = (cases, len(MODELS), len(CRITERIA))
+        self._counts = np.zeros(cells, dtype=np.int32)
+        self._sums = np.zeros(cells)
+        self._squares = np.zeros(cells)
+        # (case index, rater) -> scores array the rater gave, to replace them when the case is saved again
+        self._scores = {}
+        self._raters = [set() for _ in range(cases)]
+        self._divergence = np.zeros(cases) if divergence is None else np.asarray(divergence, dtype=float)
+        self._timeFactors = np.ones(cases)
+        self._timeSamples = np.zeros(cases, dtype=np.int32)
+        self._factorSums = np.zeros(cases)
+        # rater -> [timed cases, total seconds]
+        self._raterSeconds = {}
+        # (case index, rater) -> (seconds, time factor or None) of the latest timed session, to replace it
+        self._sessionTimes = {}
+        self._versions = np.zeros(cases, dtype=np.int64)
+        self._heap = []
+        self._rebuildHeap()
+
+    @staticmethod
+    def _scoreArray(scores) -> np.ndarray:
+        array = np.full((len(MODELS), len(CRITERIA)), np.nan)
+        for modelIndex, model in enumerate(MODELS):
+            for criterionIndex, criterion in enumerate(CRITERIA):
+                score = scores.get(model, {}).get(criterion)
+                if score is not None:
+                    array[modelIndex, criterionIndex] = score
+        return array
+
+    def _addScores(self, index, array, sign) -> None:
+        valid = ~np.isnan(array)
+        values = np.where(valid, array, 0.0)
+        self._counts[index] += sign * valid
+        self._sums[index] += sign * values
+        self._squares[index] += sign * values ** 2
+
+    def _setScores(self, index, rater, scores) -> None:
+        previous = self._scores.get((index, rater))
+        if previous is not None:
+            self._addScores(index, previous, -1)
+        array = self._scoreArray(scores)
+        self._scores[(index, rater)] = array
+        self._addScores(index, array, 1)
+        if np.isnan(array).all():
+            self._raters[index].discard(rater)
+        else:
+            self._raters[index].add(rater)
+
+    def _addTime(self, index, rater, seconds) -> None:
+        """Update the time factor of a case with a session of ``seconds``, relative to the mean of the rater.
+        A previous session of the rater on the case is replaced."""
+        previousSeconds, previousFactor = self._sessionTimes.get((index, rater), (None, None))
+        sessions, total = self._raterSeconds.get(rater, (0, 0.0))
+        if previousSeconds is None:
+            sessions += 1
+            total += seconds
+        else:
+            total += seconds - previousSeconds
+        self._raterSeconds[rater] = [sessions, total]
+        if previousFactor is not None:
+            self._timeSamples[index] -= 1
+            self._factorSums[index] -= previousFactor
+        factor = float(np.clip(seconds * sessions / total, *TIME_FACTOR_RANGE)) if total > 0 else None
+        if factor is not None:
+            self._timeSamples[index] += 1
+            self._factorSums[index] += factor
+        self._sessionTimes[(index, rater)] = (seconds, factor)
+        samples = self._timeSamples[index]
+        self._timeFactors[index] = self._factorSums[index] / samples if samples else 1.0
+
+    def value(self, index) -> float:
+        """Expected value of one more rating of a case, before dividing by its time factor."""
+        coverage = max(0, TARGET_RATINGS - len(self._raters[index])) / TARGET_RATINGS
+        counts = self._counts[index]
+        shared = counts >= 2
+        disagreement = 0.0
+        if shared.any():
+            means = self._sums[index][shared] / counts[shared]
+            variances = np.maximum(self._squares[index][shared] / counts[shared] - means ** 2, 0.0)
+            disagreement = float(np.sqrt(variances).mean() / ((MAX_SCORE - MIN_SCORE) / 2.0))
+        return (COVERAGE_WEIGHT * coverage + DISAGREEMENT_WEIGHT * disagreement
+                + DIVERGENCE_WEIGHT * float(self._divergence[index]))
+
+    def priority(self, index) -> float:
+        """Value per relative rater-minute of a case."""
+        return self.value(index) / self._timeFactors[index]
+
+    def _push(self, index) -> None:
+        self._versions[index] += 1
+        heapq.heappush(self._heap, (-self.priority(index), index, int(self._versions[index])))
+
+    def _rebuildHeap(self) -> None:
+        self._heap = [(-self.priority(index), index, int(self._versions[index])) for index in range(len(self.caseIds))]
+        heapq.heapify(self._heap)
+
+    def load(self, ratings=(), sessions=()) -> None:
+        """
+        Add the state of earlier sessions in bulk and rebuild the order once.
+        :param ratings: ``(caseId, rater, model, criterion, score)`` rows, e.g. ``ScoreStore.allRatings()``
+        :param sessions: ``(caseId, rater, seconds)`` of saved rating sessions, in the order they happened
+        """
+        scores = {}
+        for caseId, rater, model, criterion, score in ratings:
+            if caseId in self._caseIndex:
+                scores.setdefault((caseId, rater), {}).setdefault(model, {})[criterion] = score
+        with self._lock:
+            for (caseId, rater), caseScores in scores.items():
+                self._setScores(self._caseIndex[caseId], rater, caseScores)
+            for caseId, rater, seconds in sessions:
+                if caseId in self._caseIndex and seconds > 0:
+                    self._addTime(self._caseIndex[caseId], rater, seconds)
+            self._rebuildHeap()
+
+    def recordRating(self, caseId, rater, scores, seconds=None) -> None:
+        """Update the order after a rater saved a case.
+        :param scores: ``{model: {criterion: int or None}}``, all scores the rater gave the case
+        :param seconds: active rating time of the session, if it was timed
+        """
+        index = self._caseIndex.get(caseId)
+        if index is None:
+            return
+        with self._lock:
+            self._setScores(index, rater, scores)
+            if seconds:
+                self._addTime(index, rater, seconds)
+            self._push(index)
+            if len(self._heap) > 4 * len(self.caseIds) + 64:
+                # Too many invalidated entries
+                self._rebuildHeap()
+
+    def nextCases(self, rater, count=1, exclude=()) -> list:
+        """The ``count`` most valuable cases the rater has not rated, best first, without ``exclude``."""
+        exclude = set(exclude)
+        result = []
+        skipped = []
+        with self._lock:
+            while self._heap and len(result) < count:
+                entry = heapq.heappop(self._heap)
+                _, index, version = entry
+                if version != self._versions[index]:
+                    continue
+                skipped.append(entry)
+                if rater not in self._raters[index] and self.caseIds[index] not in exclude:
+                    result.append(self.caseIds[index])
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+        return result
+
+    def statistics(self) -> dict:
+        with self._lock:
+            ratings = np.array([len(raters) for raters in self._raters])
+            return {"cases": len(self.caseIds), "unrated": int((ratings == 0).sum()),
+                    "covered": int((ratings >= TARGET_RATINGS).sum()), "timed": int((self._timeSamples > 0).sum())}
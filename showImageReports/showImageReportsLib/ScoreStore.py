@@ -0,0 +1,237 @@
+"""
+Transactional store of human ratings.
+
+All ratings of all raters live in one local SQLite database in WAL mode, one
+row per case, rater, model and criterion. Writes are grouped into
+transactions, so a crash never leaves a half written rating behind, and
+progress questions ("what has rater X completed?") are answered by indexed
+queries instead of walking the dataset for ``human.json`` files.
+
+The legacy per-case ``human.json`` can still be written for compatibility.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.ScoreStore scores.sqlite export-legacy --rater NAME
+    PythonSlicer -m showImageReportsLib.ScoreStore scores.sqlite progress --rater NAME
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .FileUtils import atomicWrite
+from .Scores import CRITERIA, MODELS, scoresToLegacy
+
+LEGACY_FILE_NAME = "human.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    caseId TEXT PRIMARY KEY,
+    imagePath TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_imagePath ON cases (imagePath);
+CREATE TABLE IF NOT EXISTS ratings (
+    caseId TEXT NOT NULL,
+    rater TEXT NOT NULL,
+    model TEXT NOT NULL,
+    criterion TEXT NOT NULL,
+    score INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (caseId, rater, model, criterion)
+);
+CREATE INDEX IF NOT EXISTS ratings_rater ON ratings (rater, caseId);
+CREATE INDEX IF NOT EXISTS ratings_updated ON ratings (updated);
+"""
+
+
+class ScoreStore:
+    """SQLite backed score store keyed by case, rater and model.
+
+    ``putScores`` only queues rows; they are written in one transaction by ``commit``,
+    or automatically once ``batchSize`` rows are pending. Thread safe.
+    """
+
+    CELLS_PER_CASE = len(MODELS) * len(CRITERIA)
+
+    def __init__(self, path, batchSize=1000) -> None:
+        self.path = path
+        self.batchSize = batchSize
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pendingCases = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self.commit()
+            self._db.close()
+
+    def putScores(self, caseId, rater, scores, imagePath=None) -> None:
+        """Queue the scores of one case for a rater.
+        :param scores: ``{model: {criterion: int or None}}``, cells that are missing are not touched
+        """
+        now = time.time()
+        rows = [(caseId, rater, model, criterion, score, now)
+                for model, criterionScores in scores.items()
+                for criterion, score in criterionScores.items()]
+        with self._lock:
+            self._pending.extend(rows)
+            if imagePath is not None:
+                self._pendingCases[caseId] = imagePath
+            if len(self._pending) >= self.batchSize:
+                self.commit()
+
+    def commit(self) -> int:
+        """Write all queued rows in a single transaction. Returns the number of written rows."""
+        with self._lock:
+            if not self._pending and not self._pendingCases:
+                return 0
+            rows, self._pending = self._pending, []
+            cases, self._pendingCases = self._pendingCases, {}
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO cases VALUES (?, ?)", cases.items())
+                self._db.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            return len(rows)
+
+    def scores(self, caseId, rater, pending: bool = False) -> dict:
+        """
+        Committed scores of a case as ``{model: {criterion: int or None}}``; cells never saved are None.
+        :param pending: include the queued cells that are not committed yet
+        """
+        result = {model: dict.fromkeys(CRITERIA) for model in MODELS}
+        with self._lock:
+            rows = self._db.execute("SELECT model, criterion, score FROM ratings WHERE caseId=? AND rater=?",
+                                    (caseId, rater)).fetchall()
+            if pending:
+                rows += [row[2:5] for row in self._pending if row[0] == caseId and row[1] == rater]
+        for model, criterion, score in rows:
+            result.setdefault(model, {})[criterion] = score
+        return result
+
+    def allRatings(self) -> list:
+        """All committed, non-empty scores as ``(caseId, rater, model, criterion, score)`` rows."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT caseId, rater, model, criterion, score FROM ratings WHERE score IS NOT NULL").fetchall()
+
+    def imagePath(self, caseId):
+        with self._lock:
+            row = self._db.execute("SELECT imagePath FROM cases WHERE caseId=?", (caseId,)).fetchone()
+        return row[0] if row else None
+
+    def caseIds(self) -> list:
+        """Cases with at least one saved cell."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT caseId FROM ratings ORDER BY caseId")]
+
+    def imageCaseIds(self, imagePath) -> list:
+        """Case IDs the image at ``imagePath`` (absolute) was saved under."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT caseId FROM cases WHERE imagePath=? ORDER BY caseId",
+                                                       (imagePath,))]
+
+    def mergeCases(self, caseId, imagePath) -> int:
+        """
+        Move the ratings that were saved for the image at ``imagePath`` (absolute) under other case IDs, including
+        the image path itself, to ``caseId``. Where both have a cell, the later saved one is kept.
+        :return: number of merged case IDs
+        """
+        with self._lock:
+            self.commit()
+            others = set(self.imageCaseIds(imagePath))
+            if self._db.execute("SELECT 1 FROM ratings WHERE caseId=? LIMIT 1", (imagePath,)).fetchone():
+                others.add(imagePath)
+            others.discard(caseId)
+            if not others:
+                return 0
+            with self._db:
+                for other in others:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO ratings SELECT ?, rater, model, criterion, score, updated FROM ratings AS o "
+                        "WHERE caseId=? AND NOT EXISTS (SELECT 1 FROM ratings AS n WHERE n.caseId=? AND n.rater=o.rater "
+                        "AND n.model=o.model AND n.criterion=o.criterion AND n.updated >= o.updated)",
+                        (caseId, other, caseId))
+                    self._db.execute("DELETE FROM ratings WHERE caseId=?", (other,))
+                    self._db.execute("DELETE FROM cases WHERE caseId=?", (other,))
+                self._db.execute("INSERT OR REPLACE INTO cases VALUES (?, ?)", (caseId, imagePath))
+            return len(others)
+
+    def raters(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT rater FROM ratings ORDER BY rater")]
+
+    def ratedCases(self, rater) -> list:
+        """Cases for which the rater saved at least one score."""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT DISTINCT caseId FROM ratings WHERE rater=? AND score IS NOT NULL ORDER BY caseId", (rater,))]
+
+    def completedCases(self, rater) -> list:
+        """Cases in which the rater scored every model and criterion."""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT caseId FROM ratings WHERE rater=? GROUP BY caseId HAVING COUNT(score)=? ORDER BY caseId",
+                (rater, self.CELLS_PER_CASE))]
+
+    def progress(self, rater=None) -> dict:
+        """Number of partially and completely rated cases, per rater."""
+        query = ("SELECT rater, SUM(n > 0), SUM(n = ?) FROM "
+                 "(SELECT rater, caseId, COUNT(score) AS n FROM ratings {} GROUP BY rater, caseId) GROUP BY rater")
+        with self._lock:
+            if rater is None:
+                rows = self._db.execute(query.format(""), (self.CELLS_PER_CASE,)).fetchall()
+            else:
+                rows = self._db.execute(query.format("WHERE rater=?"), (self.CELLS_PER_CASE, rater)).fetchall()
+        return {row[0]: {"rated": row[1], "completed": row[2]} for row in rows}
+
+    def writeLegacyFile(self, caseId, rater, directory=None) -> str:
+        """Write the scores of one case as legacy ``human.json`` into the image folder (or ``directory``)."""
+        if directory is None:
+            imagePath = self.imagePath(caseId)
+            if imagePath is None:
+                raise ValueError(f"Image path of case {caseId} is unknown")
+            directory = os.path.dirname(imagePath)
+        path = os.path.join(directory, LEGACY_FILE_NAME)
+        legacyScores = scoresToLegacy(self.scores(caseId, rater))
+        atomicWrite(path, lambda f: json.dump(legacyScores, f, indent=2, ensure_ascii=False),
+                    mode="w", encoding="utf-8")
+        return path
+
+    def exportLegacy(self, rater, caseIds=None) -> int:
+        """Write legacy ``human.json`` files for all cases the rater has scored. Returns the number of files."""
+        self.commit()
+        if caseIds is None:
+            caseIds = self.ratedCases(rater)
+        for caseId in caseIds:
+            self.writeLegacyFile(caseId, rater)
+        return len(caseIds)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Query and export the rating store.")
+    parser.add_argument("store")
+    parser.add_argument("command", choices=["export-legacy", "progress"])
+    parser.add_argument("--rater", default=None)
+    args = parser.parse_args(argv)
+
+    store = ScoreStore(args.store)
+    if args.command == "progress":
+        for rater, counts in store.progress(args.rater).items():
+            print(f"{rater}: {counts['completed']} completed, {counts['rated']} rated")
+    else:
+        if args.rater is None:
+            parser.error("export-legacy requires --rater")
+        print(f"Wrote {store.exportLegacy(args.rater)} {LEGACY_FILE_NAME} files")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
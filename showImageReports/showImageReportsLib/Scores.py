@@ -0,0 +1,97 @@
+"""
+Rating grid layout shared by the widget, the score store and the analysis tools.
+
+Scores are given per model and criterion. The widget names its score fields
+``<model>_<criterion>`` (e.g. ``gpt4_pos``), and the legacy ``human.json``
+file stores them as ``{model: {criterion: "<score>"}}`` with ``"-1"`` for
+cells that were not rated.
+"""
+
+import numpy as np
+
+MODELS = ("mini", "gpt4", "radfm", "bf")
+CRITERIA = ("general", "complete", "pos", "num", "cls", "bian", "midu", "xing", "normal")
+
+UNRATED = -1
+MIN_SCORE = 0
+MAX_SCORE = 4
+
+
+def parseScore(value):
+    """Convert a score as typed in the widget or stored in human.json into an int, or None if not rated.
+    Raises ValueError for anything that is not an integer in the allowed range."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if text == "":
+        return None
+    score = int(text)
+    if score == UNRATED:
+        return None
+    if not MIN_SCORE <= score <= MAX_SCORE:
+        raise ValueError(f"Score {score} is out of range {MIN_SCORE}..{MAX_SCORE}")
+    return score
+
+
+def scoresFromLegacy(legacyScores) -> dict:
+    """``{model: {criterion: str}}`` as in human.json -> ``{model: {criterion: int or None}}``."""
+    return {model: {criterion: parseScore(legacyScores.get(model, {}).get(criterion)) for criterion in CRITERIA}
+            for model in MODELS}
+
+
+def scoresToLegacy(scores) -> dict:
+    """``{model: {criterion: int or None}}`` -> ``{model: {criterion: str}}`` as written to human.json."""
+    return {model: {criterion: str(UNRATED if scores.get(model, {}).get(criterion) is None else scores[model][criterion])
+                    for criterion in CRITERIA}
+            for model in MODELS}
+
+
+class ScoreGrid:
+    """Scores of one case as a ``models x criteria`` int8 array (``UNRATED`` for empty cells),
+    with a parallel array marking cells changed since the last save."""
+
+    def __init__(self) -> None:
+        self.values = np.full((len(MODELS), len(CRITERIA)), UNRATED, dtype=np.int8)
+        self.dirty = np.zeros(self.values.shape, dtype=bool)
+
+    @staticmethod
+    def cellIndex(model, criterion):
+        return MODELS.index(model), CRITERIA.index(criterion)
+
+    def get(self, model, criterion):
+        value = int(self.values[self.cellIndex(model, criterion)])
+        return None if value == UNRATED else value
+
+    def set(self, model, criterion, score) -> bool:
+        """Set one cell (``score`` int or None) and mark it dirty. Returns False if the value did not change."""
+        cell = self.cellIndex(model, criterion)
+        value = UNRATED if score is None else score
+        if self.values[cell] == value:
+            return False
+        self.values[cell] = value
+        self.dirty[cell] = True
+        return True
+
+    def load(self, scores=None) -> None:
+        """Replace all cells by ``{model: {criterion: int or None}}`` (all unrated if None) and mark them clean."""
+        self.values[:] = UNRATED
+        if scores:
+            for row, model in enumerate(MODELS):
+                self.values[row] = [UNRATED if scores.get(model, {}).get(criterion) is None else scores[model][criterion]
+                                    for criterion in CRITERIA]
+        self.dirty[:] = False
+
+    def toScores(self) -> dict:
+        return {model: {criterion: self.get(model, criterion) for criterion in CRITERIA} for model in MODELS}
+
+    def isDirty(self) -> bool:
+        return bool(self.dirty.any())
+
+    def takeDirtyScores(self) -> dict:
+        """Scores of the dirty cells only, as ``{model: {criterion: int or None}}``; the cells are marked clean."""
+        scores = {}
+        for row, column in zip(*np.nonzero(self.dirty)):
+            value = int(self.values[row, column])
+            scores.setdefault(MODELS[row], {})[CRITERIA[column]] = None if value == UNRATED else value
+        self.dirty[:] = False
+        return scores
@@ -0,0 +1,248 @@
+"""
+Per-case rater timing events in columnar form.
+
+The widget records when a case is loaded, the first interaction with it,
+every edited score cell and every save. An event is appended to typed column
+buffers in memory (time, event, case, rater, model, criterion, value; case
+IDs and raters are dictionary encoded), which costs a few microseconds and
+no I/O. Full buffers are written as immutable ``.npz`` chunks, one file per
+chunk, so concurrent Slicer instances can share a telemetry directory.
+
+A rating session of a case starts when the case is loaded. Its active time
+is the sum of the gaps between its events, each capped at ``MAX_EVENT_GAP``
+so that breaks are not counted as rating time. Rated cases per hour are the
+saved sessions divided by the active time of all sessions.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Telemetry /path/to/telemetry
+"""
+
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from .FileUtils import atomicWrite
+from .Scores import CRITERIA, MODELS
+
+LOAD_EVENT, INTERACTION_EVENT, EDIT_EVENT, SAVE_EVENT = range(4)
+EVENT_NAMES = ("load", "interaction", "edit", "save")
+CHUNK_EVENTS = 4096
+CHUNK_PATTERN = "events-*.npz"
+# Seconds; longer gaps between two events of a case count as this
+MAX_EVENT_GAP = 120.0
+
+# Column name -> array.array type code of the in-memory buffer
+_COLUMNS = (
+    ("time", "d"),
+    ("event", "b"),
+    ("case", "i"),
+    ("rater", "i"),
+    ("model", "b"),
+    ("criterion", "b"),
+    ("value", "h"),
+)
+
+
+class EventLog:
+    """Append-only event log, buffered in memory and flushed in chunks to ``directory``. Thread safe."""
+
+    def __init__(self, directory, chunkEvents=CHUNK_EVENTS) -> None:
+        self.directory = directory
+        self.chunkEvents = chunkEvents
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._buffers = {name: array(code) for name, code in _COLUMNS}
+        self._caseIds = {}
+        self._raters = {}
+        self._modelCodes = {model: i for i, model in enumerate(MODELS)}
+        self._criterionCodes = {criterion: i for i, criterion in enumerate(CRITERIA)}
+        # (caseId, rater) -> [time of the last event, active seconds, saved] of the open session of a case
+        self._sessions = {}
+        # rater -> [saved sessions, active seconds] since the log was opened
+        self._totals = {}
+
+    def close(self) -> None:
+        self.flush()
+
+    @staticmethod
+    def _code(lookup, key) -> int:
+        return lookup.setdefault(key, len(lookup))
+
+    def record(self, event, caseId, rater, model=None, criterion=None, value=None, timestamp=None) -> None:
+        """Append an event. ``model``, ``criterion`` and ``value`` (the score, None for unrated) describe edits."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            buffers = self._buffers
+            buffers["time"].append(timestamp)
+            buffers["event"].append(event)
+            buffers["case"].append(self._code(self._caseIds, caseId))
+            buffers["rater"].append(self._code(self._raters, rater))
+            buffers["model"].append(self._modelCodes.get(model, -1))
+            buffers["criterion"].append(self._criterionCodes.get(criterion, -1))
+            buffers["value"].append(-1 if value is None else value)
+            session = self._sessions.get((caseId, rater))
+            if event == LOAD_EVENT or session is None:
+                session = self._sessions[(caseId, rater)] = [timestamp, 0.0, False]
+            gap = min(max(timestamp - session[0], 0.0), MAX_EVENT_GAP)
+            session[0] = timestamp
+            session[1] += gap
+            totals = self._totals.setdefault(rater, [0, 0.0])
+            totals[1] += gap
+            if event == SAVE_EVENT and not session[2]:
+                # A session saved several times (autosave, then Save) is one rated case
+                session[2] = True
+                totals[0] += 1
+            full = len(buffers["time"]) >= self.chunkEvents
+        if full:
+            self.flush()
+
+    def sessionSeconds(self, caseId, rater) -> float:
+        """Active seconds of the open session of a case, 0 if it was not loaded."""
+        with self._lock:
+            session = self._sessions.get((caseId, rater))
+            return session[1] if session else 0.0
+
+    def sessionThroughput(self, rater):
+        """Rated cases per hour of a rater since the log was opened, None before any active time."""
+        with self._lock:
+            saved, seconds = self._totals.get(rater, (0, 0.0))
+        return saved / seconds * 3600.0 if seconds > 0 else None
+
+    def _columns(self) -> dict:
+        """Buffered events as arrays, with their dictionaries. Call with the lock held."""
+        columns = {name: np.frombuffer(buffer, dtype=buffer.typecode).copy() for name, buffer in self._buffers.items()}
+        columns["caseIds"] = np.array(list(self._caseIds), dtype=str)
+        columns["raters"] = np.array(list(self._raters), dtype=str)
+        return columns
+
+    def flush(self) -> None:
+        """Write the buffered events as a new chunk."""
+        with self._lock:
+            if not len(self._buffers["time"]):
+                return
+            columns = self._columns()
+            for buffer in self._buffers.values():
+                del buffer[:]
+            # Chunks are self-contained, their dictionaries start over
+            self._caseIds = {}
+            self._raters = {}
+        path = os.path.join(self.directory, f"events-{time.time_ns()}-{os.getpid()}.npz")
+        atomicWrite(path, lambda f: np.savez(f, **columns))
+
+    def events(self) -> dict:
+        """All events (chunks and buffer) as columns ``time``, ``event``, ``model``, ``criterion``, ``value``,
+        and ``case``/``rater`` indices into ``caseIds``/``raters``, sorted by time."""
+        chunks = loadChunks(self.directory)
+        with self._lock:
+            if len(self._buffers["time"]):
+                chunks.append(self._columns())
+        return mergeChunks(chunks)
+
+
+def loadChunks(directory) -> list:
+    """Columns of all event chunks in a telemetry directory."""
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(directory, CHUNK_PATTERN))):
+        with np.load(path) as chunk:
+            chunks.append({name: chunk[name] for name in chunk.files})
+    return chunks
+
+
+def mergeChunks(chunks) -> dict:
+    """Concatenate event chunks, re-encoding their case and rater dictionaries into shared ones."""
+    caseIds = np.unique(np.concatenate([chunk["caseIds"] for chunk in chunks] or [np.array([], dtype=str)]))
+    raters = np.unique(np.concatenate([chunk["raters"] for chunk in chunks] or [np.array([], dtype=str)]))
+    merged = {name: [] for name, _ in _COLUMNS}
+    for chunk in chunks:
+        for name, _ in _COLUMNS:
+            values = chunk[name]
+            if name == "case":
+                values = np.searchsorted(caseIds, chunk["caseIds"])[values] if len(values) else values
+            elif name == "rater":
+                values = np.searchsorted(raters, chunk["raters"])[values] if len(values) else values
+            merged[name].append(values)
+    columns = {name: np.concatenate(merged[name]).astype(np.dtype(code)) if merged[name] else np.array([], dtype=code)
+               for name, code in _COLUMNS}
+    order = np.argsort(columns["time"], kind="stable")
+    columns = {name: values[order] for name, values in columns.items()}
+    columns["caseIds"] = caseIds
+    columns["raters"] = raters
+    return columns
+
+
+def caseSessions(events) -> dict:
+    """
+    Rating sessions of all cases: one per load (events before the first load of a case start one too).
+    :return: columns ``case``, ``rater`` (indices into the event dictionaries), ``start``, ``seconds`` (active
+      time), ``firstInteraction`` (seconds from the start, NaN without interaction), ``edits`` and ``saved``
+    """
+    if not len(events["time"]):
+        empty = np.array([], dtype=np.int64)
+        return {"case": empty, "rater": empty, "start": np.array([]), "seconds": np.array([]),
+                "firstInteraction": np.array([]), "edits": empty, "saved": np.array([], dtype=bool)}
+    order = np.lexsort((events["time"], events["case"], events["rater"]))
+    times = events["time"][order]
+    kinds = events["event"][order]
+    cases = events["case"][order].astype(np.int64)
+    raters = events["rater"][order].astype(np.int64)
+    newGroup = np.ones(len(times), dtype=bool)
+    newGroup[1:] = (cases[1:] != cases[:-1]) | (raters[1:] != raters[:-1])
+    session = np.cumsum(newGroup | (kinds == LOAD_EVENT)) - 1
+    starts = np.flatnonzero(np.r_[True, session[1:] != session[:-1]])
+    gaps = np.zeros(len(times))
+    sameSession = session[1:] == session[:-1]
+    gaps[1:][sameSession] = np.minimum(np.diff(times)[sameSession], MAX_EVENT_GAP)
+    sessions = len(starts)
+    firstInteraction = np.full(sessions, np.inf)
+    interactions = kinds == INTERACTION_EVENT
+    np.minimum.at(firstInteraction, session[interactions], times[interactions] - times[starts][session[interactions]])
+    firstInteraction[np.isinf(firstInteraction)] = np.nan
+    return {
+        "case": cases[starts],
+        "rater": raters[starts],
+        "start": times[starts],
+        "seconds": np.bincount(session, weights=gaps, minlength=sessions),
+        "firstInteraction": firstInteraction,
+        "edits": np.bincount(session, weights=kinds == EDIT_EVENT, minlength=sessions).astype(np.int64),
+        "saved": np.bincount(session, weights=kinds == SAVE_EVENT, minlength=sessions) > 0,
+    }
+
+
+def raterThroughput(events) -> dict:
+    """``{rater: {"cases", "hours", "casesPerHour", "medianSeconds", "medianFirstInteraction"}}``, where the
+    median seconds are those of saved sessions."""
+    sessions = caseSessions(events)
+    result = {}
+    for index, rater in enumerate(events["raters"]):
+        mine = sessions["rater"] == index
+        saved = mine & sessions["saved"]
+        seconds = float(sessions["seconds"][mine].sum())
+        interactions = sessions["firstInteraction"][mine]
+        interactions = interactions[~np.isnan(interactions)]
+        result[str(rater)] = {
+            "cases": int(saved.sum()),
+            "hours": seconds / 3600.0,
+            "casesPerHour": float(saved.sum() / seconds * 3600.0) if seconds > 0 else None,
+            "medianSeconds": float(np.median(sessions["seconds"][saved])) if saved.any() else None,
+            "medianFirstInteraction": float(np.median(interactions)) if len(interactions) else None,
+        }
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Summarize rater timing telemetry.")
+    parser.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(raterThroughput(mergeChunks(loadChunks(args.directory))), indent=2))
+
+
+if __name__ == "__main__":
+    main()
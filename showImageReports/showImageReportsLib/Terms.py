@@ -0,0 +1,303 @@
+"""
+Radiology term index for highlighting findings in the reports.
+
+A vocabulary maps the criteria that are about specific findings (location,
+count, density, boundary, shape) to Chinese and English terms::
+
+    {"<criterion>": ["<term>", ...]}
+
+All terms are compiled into one Aho-Corasick automaton, so the reports of a
+case are scanned in a single pass regardless of the vocabulary size. Latin
+terms only match whole words. Hits are ``(start, end, criterionIndex)`` rows
+of an int32 array and are cached by report text hash in a SQLite file; they
+can be precomputed for a whole dataset on a process pool, so showing a case
+only looks up its hits.
+
+Command line usage (precompute the hits of all reports of a dataset)::
+
+    PythonSlicer -m showImageReportsLib.Terms --dataset /path/to/dataset --cache /path/to/termHits.sqlite
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import as_completed
+from functools import lru_cache
+
+import numpy as np
+
+from .FileUtils import processPool
+from .Reports import DEFAULT_REPORT_COLUMNS, corpusRecords, datasetRecords, loadReportColumns, textHash
+
+DEFAULT_TERM_VOCABULARY = {
+    "pos": [
+        "左侧", "右侧", "双侧", "额叶", "颞叶", "顶叶", "枕叶", "岛叶", "基底节", "丘脑", "小脑", "脑干", "桥脑", "延髓",
+        "中脑", "脑室", "侧脑室", "第三脑室", "第四脑室", "胼胝体", "半卵圆中心", "放射冠", "内囊", "硬膜下", "硬膜外",
+        "蛛网膜下腔", "中线", "皮层", "皮质下",
+        "left", "right", "bilateral", "frontal", "temporal", "parietal", "occipital", "insula", "basal ganglia",
+        "thalamus", "cerebellum", "cerebellar", "brainstem", "pons", "ventricle", "corpus callosum", "subdural",
+        "epidural", "subarachnoid", "midline", "cortical", "periventricular",
+    ],
+    "num": [
+        "单发", "多发", "多个", "多处", "单个", "数个", "散在", "弥漫",
+        "single", "multiple", "solitary", "several", "scattered", "diffuse",
+    ],
+    "midu": [
+        "高密度", "低密度", "等密度", "稍高密度", "稍低密度", "混杂密度", "密度增高", "密度减低", "密度均匀", "密度不均",
+        "hyperdense", "hypodense", "isodense", "hyperdensity", "hypodensity", "attenuation", "mixed density",
+    ],
+    "bian": [
+        "边界清", "边界清楚", "边界清晰", "边界不清", "边界模糊", "边缘清晰", "边缘模糊", "边缘光整", "分界",
+        "well-defined", "ill-defined", "well-circumscribed", "margin", "margins", "border", "borders",
+    ],
+    "xing": [
+        "片状", "斑片状", "类圆形", "圆形", "椭圆形", "结节状", "条状", "条片状", "新月形", "梭形", "不规则", "环形",
+        "点状", "斑点状",
+        "round", "oval", "nodular", "crescent", "crescentic", "lentiform", "irregular", "linear", "patchy", "ring",
+    ],
+}
+
+CRITERION_COLORS = {"pos": "#ffe08a", "num": "#b5e3ff", "midu": "#c8f0b0", "bian": "#ffc4c4", "xing": "#e3ccff"}
+DEFAULT_COLOR = "#dddddd"
+HIT_CHUNK_SIZE = 1000
+
+# Separates the reports of a case in a combined scan; no term contains it
+_SEPARATOR = "\0"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS term_hits (
+    vocabularyHash TEXT NOT NULL,
+    textHash TEXT NOT NULL,
+    hits BLOB NOT NULL,
+    PRIMARY KEY (vocabularyHash, textHash)
+);
+"""
+
+
+def loadTermVocabulary(path) -> dict:
+    """Read a term vocabulary from a JSON file."""
+    with open(path, encoding="utf-8") as f:
+        vocabulary = json.load(f)
+    for criterion, terms in vocabulary.items():
+        if not isinstance(terms, list):
+            raise ValueError(f"Terms of criterion {criterion} must be a list")
+    return vocabulary
+
+
+def vocabularyHash(vocabulary) -> str:
+    return hashlib.blake2b(json.dumps(vocabulary, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _isWordCharacter(c) -> bool:
+    return c.isascii() and (c.isalnum() or c == "_")
+
+
+class TermAutomaton:
+    """Aho-Corasick automaton over all terms of a vocabulary, matching case-insensitively."""
+
+    def __init__(self, vocabulary) -> None:
+        self.criteria = list(vocabulary)
+        # Per state: transitions, failure link and matched (term length, criterion index, whole word) outputs
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for criterionIndex, criterion in enumerate(self.criteria):
+            for term in vocabulary[criterion]:
+                term = term.lower()
+                if not term:
+                    continue
+                state = 0
+                for c in term:
+                    if c not in self._goto[state]:
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append([])
+                        self._goto[state][c] = len(self._goto) - 1
+                    state = self._goto[state][c]
+                wholeWord = _isWordCharacter(term[0]) or _isWordCharacter(term[-1])
+                self._output[state].append((len(term), criterionIndex, wholeWord))
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and c not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(c, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def scan(self, text) -> np.ndarray:
+        """All term occurrences in ``text`` as int32 rows ``(start, end, criterionIndex)``."""
+        lowered = text.lower()
+        goto, fail, output = self._goto, self._fail, self._output
+        hits = []
+        state = 0
+        for position, c in enumerate(lowered):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for length, criterionIndex, wholeWord in output[state]:
+                start = position - length + 1
+                if wholeWord and ((start > 0 and _isWordCharacter(lowered[start - 1])) or
+                                  (position + 1 < len(lowered) and _isWordCharacter(lowered[position + 1]))):
+                    continue
+                hits.append((start, position + 1, criterionIndex))
+        return np.array(hits, dtype=np.int32).reshape(-1, 3)
+
+    def scanAll(self, texts) -> list:
+        """Hits of several texts, found in one pass over their concatenation."""
+        if not texts:
+            return []
+        hits = self.scan(_SEPARATOR.join(texts))
+        starts = np.cumsum([0] + [len(text) + len(_SEPARATOR) for text in texts[:-1]])
+        owner = np.searchsorted(starts, hits[:, 0], side="right") - 1
+        result = []
+        for index, start in enumerate(starts):
+            textHits = hits[owner == index].copy()
+            textHits[:, :2] -= start
+            result.append(textHits)
+        return result
+
+
+@lru_cache(maxsize=4)
+def _automaton(vocabularyJson) -> TermAutomaton:
+    return TermAutomaton(json.loads(vocabularyJson))
+
+
+def scanChunk(texts, vocabularyJson) -> list:
+    """Process pool worker: ``(textHash, hits bytes)`` of each text."""
+    automaton = _automaton(vocabularyJson)
+    return [(textHash(text), automaton.scan(text).tobytes()) for text in texts]
+
+
+def hitsFromBytes(data) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.int32).reshape(-1, 3)
+
+
+def highlightHtml(text, hits, criteria, colors=CRITERION_COLORS) -> str:
+    """HTML of ``text`` with the term hits highlighted in the color of their criterion.
+    Overlapping hits are resolved leftmost-longest."""
+    order = np.lexsort((hits[:, 0] - hits[:, 1], hits[:, 0])) if len(hits) else []
+    parts = []
+    position = 0
+    for start, end, criterionIndex in (hits[i] for i in order):
+        if start < position:
+            continue
+        criterion = criteria[criterionIndex]
+        parts.append(html.escape(text[position:start]))
+        parts.append(f'<span style="background-color:{colors.get(criterion, DEFAULT_COLOR)}" title="{criterion}">'
+                     f'{html.escape(text[start:end])}</span>')
+        position = end
+    parts.append(html.escape(text[position:]))
+    return "".join(parts).replace("\n", "<br>")
+
+
+def legendHtml(criteria, colors=CRITERION_COLORS) -> str:
+    return " ".join(f'<span style="background-color:{colors.get(c, DEFAULT_COLOR)}">{html.escape(c)}</span>' for c in criteria)
+
+
+class TermHitCache:
+    """Term hits keyed by vocabulary and report text hash, in a SQLite file. Thread safe."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get(self, vocabularyKey, textHashes) -> dict:
+        """textHash -> hits of the given hashes that are cached."""
+        textHashes = list(textHashes)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT textHash, hits FROM term_hits WHERE vocabularyHash=? AND textHash IN ({','.join('?' * len(textHashes))})",
+                [vocabularyKey, *textHashes]).fetchall()
+        return {h: hitsFromBytes(data) for h, data in rows}
+
+    def put(self, vocabularyKey, rows) -> None:
+        """Store ``(textHash, hits bytes)`` rows."""
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO term_hits VALUES (?, ?, ?)",
+                                 [(vocabularyKey, h, data) for h, data in rows])
+
+    def missing(self, vocabularyKey, textHashes) -> set:
+        known = set()
+        textHashes = list(textHashes)
+        with self._lock:
+            for i in range(0, len(textHashes), 500):
+                batch = textHashes[i:i + 500]
+                known.update(row[0] for row in self._db.execute(
+                    f"SELECT textHash FROM term_hits WHERE vocabularyHash=? AND textHash IN ({','.join('?' * len(batch))})",
+                    [vocabularyKey, *batch]))
+        return set(textHashes) - known
+
+
+def precomputeHits(texts, cache: TermHitCache, vocabulary=DEFAULT_TERM_VOCABULARY, maxWorkers=None, progress=None,
+                   chunkSize=HIT_CHUNK_SIZE) -> int:
+    """
+    Scan all texts that are not cached yet and store their hits.
+    :param texts: iterable of report texts, duplicates are scanned once
+    :param progress: optional callable ``progress(done, total)``
+    :return: number of scanned texts
+    """
+    vocabularyKey = vocabularyHash(vocabulary)
+    unique = {textHash(text): text for text in texts if text}
+    pending = [unique[h] for h in cache.missing(vocabularyKey, unique)]
+    vocabularyJson = json.dumps(vocabulary, sort_keys=True)
+    chunks = [pending[i:i + chunkSize] for i in range(0, len(pending), chunkSize)]
+    done = 0
+    if len(chunks) <= 1:
+        for chunk in chunks:
+            cache.put(vocabularyKey, scanChunk(chunk, vocabularyJson))
+            done += len(chunk)
+    else:
+        with processPool(maxWorkers) as executor:
+            futures = [executor.submit(scanChunk, chunk, vocabularyJson) for chunk in chunks]
+            for future in as_completed(futures):
+                rows = future.result()
+                cache.put(vocabularyKey, rows)
+                done += len(rows)
+                if progress:
+                    progress(done, len(pending))
+    return done
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Precompute the radiology term hits of all reports.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dataset", help="dataset root folder with reports.json files")
+    source.add_argument("--corpus", help="JSONL report corpus")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--cache", required=True, help="term hit cache database")
+    parser.add_argument("--columns", default=None, help="report column mapping JSON file")
+    parser.add_argument("--vocabulary", default=None, help="term vocabulary JSON file")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    columns = loadReportColumns(args.columns) if args.columns else DEFAULT_REPORT_COLUMNS
+    vocabulary = loadTermVocabulary(args.vocabulary) if args.vocabulary else DEFAULT_TERM_VOCABULARY
+    records = datasetRecords(args.dataset, columns) if args.dataset else corpusRecords(args.corpus, args.id_field, columns)
+    cache = TermHitCache(args.cache)
+    startTime = time.time()
+    scanned = precomputeHits((text for _, texts in records for text in texts.values()), cache, vocabulary, args.workers,
+                             progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    print()
+    logging.info(f"Scanned {scanned} reports in {time.time() - startTime:.1f} seconds")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
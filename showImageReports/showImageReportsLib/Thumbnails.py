@@ -0,0 +1,260 @@
+"""
+Key-slice thumbnail atlas for the dataset overview.
+
+Every case gets one small grayscale mosaic: the axial mid-slice, windowed
+with the first suggested preset, and the axial, coronal and sagittal maximum
+intensity projections, windowed with the bone window of CT volumes (the
+automatic window otherwise). Mosaics are rendered on a process pool and
+appended to a single packed uint8 file, the atlas, that is read through a
+memory map. An SQLite index next to it records the byte offset and shape of
+every tile, so showing a page of the overview reads only the tiles on it.
+
+Rebuilding is incremental: only cases whose image changed (mtime, size) are
+rendered again. Replaced tiles are left in the atlas as garbage until it
+exceeds the live tiles, then the atlas is rewritten.
+
+Command line usage::
+
+    PythonSlicer -m showImageReportsLib.Thumbnails /path/to/dataset --workers 8
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from .FileUtils import processPool
+from .NiftiIO import readNifti
+from .Windowing import AUTO_PRESET, windowPresets
+
+ATLAS_FILE_NAME = "showImageReports.atlas"
+ATLAS_INDEX_SUFFIX = ".idx.sqlite"
+# Side length in pixels of each of the 2x2 panels of a tile
+PANEL_SIZE = 64
+MIP_PRESET = "bone"
+# Tiles written per index transaction
+ATLAS_BATCH_SIZE = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    caseId TEXT PRIMARY KEY,
+    imagePath TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    width INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tiles_position ON tiles (position);
+"""
+
+
+def windowImage(image: np.ndarray, window) -> np.ndarray:
+    """Map a 2D image to uint8 with a ``[name, window, level]`` preset."""
+    _, width, level = window
+    low = level - width / 2.0
+    image = np.nan_to_num(image.astype(np.float32, copy=False))
+    return np.clip(np.rint((image - low) * (255.0 / max(width, 1e-6))), 0, 255).astype(np.uint8)
+
+
+def fitPanel(image: np.ndarray, rowSpacing, columnSpacing, size=PANEL_SIZE) -> np.ndarray:
+    """Resample a 2D uint8 image (nearest neighbor) into a ``size`` x ``size`` panel, keeping its physical
+    aspect ratio and centering it on black."""
+    height, width = image.shape
+    extent = max(height * rowSpacing, width * columnSpacing, 1e-6)
+    outHeight = max(1, int(round(size * height * rowSpacing / extent)))
+    outWidth = max(1, int(round(size * width * columnSpacing / extent)))
+    rows = ((np.arange(outHeight) + 0.5) * height / outHeight).astype(np.intp)
+    columns = ((np.arange(outWidth) + 0.5) * width / outWidth).astype(np.intp)
+    panel = np.zeros((size, size), dtype=np.uint8)
+    top, left = (size - outHeight) // 2, (size - outWidth) // 2
+    panel[top:top + outHeight, left:left + outWidth] = image[np.ix_(rows, columns)]
+    return panel
+
+
+def renderThumbnail(array: np.ndarray, ijkToRas: np.ndarray, presets, panelSize=PANEL_SIZE) -> np.ndarray:
+    """2x2 mosaic of a ``[k, j, i]`` volume: axial mid-slice, axial, coronal and sagittal MIP.
+    Images are flipped so that anterior and superior are up."""
+    spacingI, spacingJ, spacingK = np.linalg.norm(np.asarray(ijkToRas)[:3, :3], axis=0)
+    names = [preset[0] for preset in presets]
+    sliceWindow = presets[0]
+    mipWindow = presets[names.index(MIP_PRESET)] if MIP_PRESET in names else presets[names.index(AUTO_PRESET)]
+    panels = [
+        fitPanel(windowImage(array[array.shape[0] // 2], sliceWindow)[::-1], spacingJ, spacingI, panelSize),
+        fitPanel(windowImage(array.max(axis=0), mipWindow)[::-1], spacingJ, spacingI, panelSize),
+        fitPanel(windowImage(array.max(axis=1), mipWindow)[::-1], spacingK, spacingI, panelSize),
+        fitPanel(windowImage(array.max(axis=2), mipWindow)[::-1], spacingK, spacingJ, panelSize),
+    ]
+    return np.block([[panels[0], panels[1]], [panels[2], panels[3]]])
+
+
+def renderCase(imagePath, panelSize=PANEL_SIZE):
+    """Process pool worker: ``(tile, error)`` of one case, with tile None if the image could not be read."""
+    try:
+        volume = readNifti(imagePath)
+        return renderThumbnail(volume.array, volume.ijkToRas, windowPresets(volume.array), panelSize), None
+    except Exception as e:
+        return None, str(e)
+
+
+def pgmBytes(tile: np.ndarray) -> bytes:
+    """A tile as binary PGM image, which Qt reads without further conversion."""
+    return b"P5\n%d %d\n255\n" % (tile.shape[1], tile.shape[0]) + np.ascontiguousarray(tile).tobytes()
+
+
+class ThumbnailAtlas:
+    """Packed, memory mapped thumbnails of the cases of a dataset, indexed by case ID. Thread safe."""
+
+    def __init__(self, path, panelSize=PANEL_SIZE) -> None:
+        self.path = path
+        self.panelSize = panelSize
+        self._lock = threading.Lock()
+        self._map = None
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._db = sqlite3.connect(path + ATLAS_INDEX_SUFFIX, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._map = None
+            self._db.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def build(self, cases, maxWorkers=None, progress=None) -> int:
+        """
+        Render the thumbnails of all new and changed cases and drop the ones of cases that are gone.
+        :param cases: ``(caseId, imagePath)`` in the order the overview shows them
+        :param progress: optional callable ``progress(done, total)``
+        :return: number of rendered cases
+        """
+        cases = list(cases)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value FROM meta WHERE key='panelSize'").fetchone()
+            if row is None or row[0] != self.panelSize:
+                # Tiles of another size are not reused
+                self._db.execute("DELETE FROM tiles")
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('panelSize', ?)", (self.panelSize,))
+            known = {row[0]: tuple(row[1:]) for row in self._db.execute("SELECT caseId, imagePath, mtime, size FROM tiles")}
+            caseIds = {caseId for caseId, _ in cases}
+            self._db.executemany("DELETE FROM tiles WHERE caseId=?", [(caseId,) for caseId in known if caseId not in caseIds])
+            self._db.executemany("UPDATE tiles SET position=? WHERE caseId=?",
+                                 [(position, caseId) for position, (caseId, _) in enumerate(cases)])
+        pending = []
+        for position, (caseId, imagePath) in enumerate(cases):
+            try:
+                stat = os.stat(imagePath)
+            except OSError as e:
+                logging.warning(f"Skipping thumbnail of {imagePath}: {e}")
+                continue
+            if known.get(caseId) != (imagePath, stat.st_mtime, stat.st_size):
+                pending.append((caseId, imagePath, position, stat.st_mtime, stat.st_size))
+        done = 0
+        if pending:
+            batch = []
+            with processPool(maxWorkers) as executor, open(self.path, "ab") as f:
+                futures = {executor.submit(renderCase, imagePath, self.panelSize): (caseId, imagePath, position, mtime, size)
+                           for caseId, imagePath, position, mtime, size in pending}
+                for future in as_completed(futures):
+                    tile, error = future.result()
+                    caseId, imagePath, position, mtime, size = futures[future]
+                    if tile is None:
+                        logging.warning(f"Failed to render thumbnail of {imagePath}: {error}")
+                    else:
+                        batch.append((caseId, imagePath, position, mtime, size, f.tell()) + tile.shape)
+                        f.write(tile.tobytes())
+                    done += 1
+                    if len(batch) >= ATLAS_BATCH_SIZE or done == len(pending):
+                        # The tiles are on disk before the index points to them
+                        f.flush()
+                        self._addTiles(batch)
+                        batch = []
+                    if progress:
+                        progress(done, len(pending))
+        self.compact()
+        return done
+
+    def _addTiles(self, rows) -> None:
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def compact(self, force: bool = False) -> bool:
+        """Rewrite the atlas without replaced tiles if they take more space than the live ones (or ``force``)."""
+        with self._lock:
+            rows = self._db.execute("SELECT caseId, offset, height, width FROM tiles ORDER BY position").fetchall()
+            live = sum(height * width for _, _, height, width in rows)
+            if not force and os.path.getsize(self.path) - live <= live:
+                return False
+            self._map = None
+            tempPath = self.path + ".tmp"
+            updates = []
+            with open(self.path, "rb") as source, open(tempPath, "wb") as f:
+                for caseId, offset, height, width in rows:
+                    updates.append((f.tell(), caseId))
+                    source.seek(offset)
+                    f.write(source.read(height * width))
+            os.replace(tempPath, self.path)
+            with self._db:
+                self._db.executemany("UPDATE tiles SET offset=? WHERE caseId=?", updates)
+            return True
+
+    def _tile(self, offset, height, width):
+        """Tile view into the atlas map, which is mapped again when the atlas has grown. Call with the lock held."""
+        if self._map is None or offset + height * width > len(self._map):
+            self._map = np.memmap(self.path, dtype=np.uint8, mode="r") if os.path.getsize(self.path) else None
+        if self._map is None or offset + height * width > len(self._map):
+            return None
+        return self._map[offset:offset + height * width].reshape(height, width)
+
+    def tile(self, caseId):
+        """Read-only tile of a case, or None if it has none."""
+        with self._lock:
+            row = self._db.execute("SELECT offset, height, width FROM tiles WHERE caseId=?", (caseId,)).fetchone()
+            return self._tile(*row) if row else None
+
+    def page(self, start, count) -> list:
+        """``(caseId, imagePath, tile)`` of ``count`` cases from ``start``, in overview order."""
+        with self._lock:
+            rows = self._db.execute("SELECT caseId, imagePath, offset, height, width FROM tiles ORDER BY position "
+                                    "LIMIT ? OFFSET ?", (count, start)).fetchall()
+            return [(caseId, imagePath, self._tile(offset, height, width)) for caseId, imagePath, offset, height, width in rows]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Render the key-slice thumbnail atlas of a dataset.")
+    parser.add_argument("datasetRoot")
+    parser.add_argument("--atlas", default=None, help=f"atlas file (default: {ATLAS_FILE_NAME} in the dataset root)")
+    parser.add_argument("--panel-size", type=int, default=PANEL_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from .Worklist import CaseWorklist
+
+    logging.basicConfig(level=logging.INFO)
+    worklist = CaseWorklist(args.datasetRoot)
+    atlas = ThumbnailAtlas(args.atlas or os.path.join(args.datasetRoot, ATLAS_FILE_NAME), args.panel_size)
+    startTime = time.time()
+    rendered = atlas.build([(worklist.caseId(index), imagePath) for index, imagePath in enumerate(worklist.cases)],
+                           args.workers, progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    if rendered:
+        print()
+    logging.info(f"Rendered {rendered} thumbnails in {time.time() - startTime:.1f} seconds, the atlas has {len(atlas)} cases")
+    atlas.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Per-phase timing instrumentation.
+
+Code paths wrap their phases (e.g. "load", "import", "parse", "display",
+"save") in ``timings.span(phase)``. Durations are aggregated into
+log-spaced histograms and a bounded window of recent samples for
+percentiles, and can be summarized or dumped to a JSON file.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds: 4 buckets per decade from 100 us to 100 s
+HISTOGRAM_BOUNDS = [10 ** (exponent / 4) for exponent in range(-16, 9)]
+MAX_SAMPLES = 10000
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return math.nan
+    position = (len(sortedValues) - 1) * fraction
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(sortedValues) - 1)
+    return sortedValues[lower] + (sortedValues[upper] - sortedValues[lower]) * (position - lower)
+
+
+def residentBytes():
+    """Current resident memory of this process in bytes, or None where it is not available (no ``/proc``)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class PhaseStatistics:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, seconds) -> None:
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        bucket = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS) if seconds <= bound), len(HISTOGRAM_BOUNDS))
+        self.histogram[bucket] += 1
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else math.nan,
+            "p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "max": self.maximum,
+            "histogram": {f"<={bound:.4g}": n for bound, n in zip(HISTOGRAM_BOUNDS + [math.inf], self.histogram) if n},
+        }
+
+
+class PhaseTimings:
+    """Thread safe collection of phase durations."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._values = {}
+
+    @contextmanager
+    def span(self, phase):
+        """Time the enclosed block as one sample of ``phase``."""
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - startTime)
+
+    def record(self, phase, seconds) -> None:
+        with self._lock:
+            self._phases.setdefault(phase, PhaseStatistics()).add(seconds)
+
+    def setValue(self, name, value) -> None:
+        """Record a non-timing figure (e.g. memory use) that is reported together with the phases."""
+        with self._lock:
+            self._values[name] = value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._phases.clear()
+            self._values.clear()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "phases": {phase: statistics.summary() for phase, statistics in self._phases.items()},
+                "values": dict(self._values),
+            }
+
+    def dump(self, path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, default=str)
+
+    def formatTable(self) -> str:
+        """Summary as a fixed-width text table, for display in the module."""
+        summary = self.summary()
+        lines = [f"{'phase':<12}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for phase, s in sorted(summary["phases"].items()):
+            lines.append(f"{phase:<12}{s['count']:>8}{s['mean'] * 1000:>10.1f}{s['p50'] * 1000:>10.1f}"
+                         f"{s['p95'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}")
+        for name, value in sorted(summary["values"].items()):
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
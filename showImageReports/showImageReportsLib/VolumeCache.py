@@ -0,0 +1,336 @@
+"""
+Persistent cache of decompressed volumes.
+
+Gzip inflate is single threaded and cannot seek, so every load of a ``.nii.gz``
+pays the full decompression cost. The cache stores each decoded voxel array
+once as an uncompressed ``.npy`` file, keyed by the SHA-256 of the source file
+content, and later loads memory-map it instead of inflating again.
+
+Source files are matched to cache entries through their path, mtime and size,
+so the content is only re-hashed when a file changed on disk. The cache
+directory is bounded in size and evicts least recently used entries.
+
+Next to each volume the cache can hold downsampled preview levels (see
+``Pyramid.py``) that are shown while the full-resolution volume is loading,
+its suggested window/level presets (see ``Windowing.py``) and its foreground
+bounding box (see ``Compact.py``). Presets and boxes are only a few numbers
+and are kept when the volume itself is evicted.
+
+Command line usage (fill the cache and build 2 preview levels for a whole dataset, e.g. overnight)::
+
+    PythonSlicer -m showImageReportsLib.VolumeCache /path/to/dataset --cache-dir /path/to/cache --pyramid-levels 2
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from .FileUtils import atomicWrite, fileContentHash, processPool
+from .NiftiIO import NiftiVolume, readNifti, readNiftiHeader
+from .Pyramid import buildPyramid
+from .Compact import volumeForegroundBox
+from .Windowing import windowPresets
+
+DEFAULT_CACHE_SIZE = 50 * 1024 ** 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    hash TEXT PRIMARY KEY,
+    nbytes INTEGER NOT NULL,
+    ijkToRas TEXT NOT NULL,
+    lastUsed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lastUsed ON entries (lastUsed);
+CREATE TABLE IF NOT EXISTS levels (
+    hash TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL,
+    ijkToRas TEXT NOT NULL,
+    PRIMARY KEY (hash, level)
+);
+CREATE TABLE IF NOT EXISTS presets (
+    hash TEXT PRIMARY KEY,
+    presets TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    hash TEXT PRIMARY KEY,
+    box TEXT NOT NULL
+);
+"""
+
+
+def _entryPath(cacheDir, contentHash) -> str:
+    return os.path.join(cacheDir, contentHash[:2], contentHash + ".npy")
+
+
+def _levelPath(cacheDir, contentHash, level) -> str:
+    return os.path.join(cacheDir, contentHash[:2], f"{contentHash}.L{level}.npy")
+
+
+def _writeEntry(cacheDir, contentHash, volume: NiftiVolume) -> None:
+    path = _entryPath(cacheDir, contentHash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomicWrite(path, lambda f: np.save(f, np.ascontiguousarray(volume.array)))
+
+
+def _writePyramid(cacheDir, contentHash, volume: NiftiVolume, levels) -> list:
+    """Write preview levels ``1..levels`` and return ``(level, nbytes, ijkToRas)`` for each."""
+    written = []
+    for level, (array, ijkToRas) in enumerate(buildPyramid(volume.array, volume.ijkToRas, levels), start=1):
+        atomicWrite(_levelPath(cacheDir, contentHash, level), lambda f: np.save(f, array))
+        written.append((level, array.nbytes, ijkToRas.tolist()))
+    return written
+
+
+def _warmUpSource(sourcePath, cacheDir, pyramidLevels=0) -> dict:
+    """Process pool worker: hash and decode one source file into the cache directory, build its preview levels
+    and compute its window presets and foreground box.
+    Returns the row data that the parent process records in the cache index."""
+    stat = os.stat(sourcePath)
+    contentHash = fileContentHash(sourcePath)
+    entryPath = _entryPath(cacheDir, contentHash)
+    if os.path.exists(entryPath):
+        volume = NiftiVolume(np.load(entryPath, mmap_mode="r"), readNiftiHeader(sourcePath).ijkToRas(), sourcePath)
+    else:
+        volume = readNifti(sourcePath)
+        _writeEntry(cacheDir, contentHash, volume)
+    levels = _writePyramid(cacheDir, contentHash, volume, pyramidLevels) if pyramidLevels else []
+    presets = windowPresets(volume.array)
+    return {
+        "sourcePath": sourcePath, "mtime": stat.st_mtime, "size": stat.st_size, "hash": contentHash,
+        "nbytes": volume.nbytes, "ijkToRas": volume.ijkToRas.tolist(), "levels": levels,
+        "presets": presets, "box": volumeForegroundBox(volume.array, presets),
+    }
+
+
+class VolumeCache:
+    """Content-hash keyed cache directory of uncompressed, memory-mappable volumes.
+
+    Thread safe: the prefetch threads of a worklist may load through the same cache.
+    """
+
+    def __init__(self, cacheDir, maxBytes=DEFAULT_CACHE_SIZE) -> None:
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cacheDir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cacheDir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def contentHash(self, sourcePath) -> str:
+        """Content hash of a source file. Reuses the recorded hash while the file's mtime and size are unchanged."""
+        sourcePath = os.path.abspath(sourcePath)
+        stat = os.stat(sourcePath)
+        with self._lock:
+            row = self._db.execute("SELECT mtime, size, hash FROM sources WHERE path=?", (sourcePath,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return row[2]
+        contentHash = fileContentHash(sourcePath)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                             (sourcePath, stat.st_mtime, stat.st_size, contentHash))
+        return contentHash
+
+    def recordSources(self, sources) -> None:
+        """Record known content hashes, e.g. from a dataset manifest, as ``(path, mtime, size, hash)`` rows."""
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                                 [(os.path.abspath(path), mtime, size, contentHash) for path, mtime, size, contentHash in sources])
+
+    def lookup(self, sourcePath):
+        """Return the cached volume of a source file as a read-only memory map, or None if it is not cached."""
+        return self.lookupHash(self.contentHash(sourcePath), sourcePath)
+
+    def lookupHash(self, contentHash, sourcePath=None):
+        entryPath = _entryPath(self.cacheDir, contentHash)
+        with self._lock:
+            row = self._db.execute("SELECT ijkToRas FROM entries WHERE hash=?", (contentHash,)).fetchone()
+            if row is None or not os.path.exists(entryPath):
+                self.misses += 1
+                return None
+            with self._db:
+                self._db.execute("UPDATE entries SET lastUsed=? WHERE hash=?", (time.time(), contentHash))
+            self.hits += 1
+        array = np.load(entryPath, mmap_mode="r")
+        return NiftiVolume(array, np.array(json.loads(row[0])), sourcePath)
+
+    def load(self, sourcePath) -> NiftiVolume:
+        """Load a volume through the cache: memory-map it if cached, otherwise decode it and add it to the cache."""
+        contentHash = self.contentHash(sourcePath)
+        volume = self.lookupHash(contentHash, sourcePath)
+        if volume is None:
+            volume = readNifti(sourcePath)
+            _writeEntry(self.cacheDir, contentHash, volume)
+            self._addEntry(contentHash, volume.nbytes, volume.ijkToRas.tolist())
+            self.evict()
+        return volume
+
+    def _addEntry(self, contentHash, nbytes, ijkToRas) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (contentHash, nbytes, json.dumps(ijkToRas), time.time()))
+
+    def lookupPreview(self, sourcePath, level):
+        """Return a preview level of a cached source file as a read-only memory map, or None if it was not built.
+        Only recorded hashes are used, the source file is never read here."""
+        sourcePath = os.path.abspath(sourcePath)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT levels.hash, levels.ijkToRas FROM sources JOIN levels ON sources.hash = levels.hash "
+                "WHERE sources.path=? AND levels.level=?", (sourcePath, level)).fetchone()
+        if row is None:
+            return None
+        stat = os.stat(sourcePath)
+        levelPath = _levelPath(self.cacheDir, row[0], level)
+        with self._lock:
+            current = self._db.execute("SELECT 1 FROM sources WHERE path=? AND mtime=? AND size=?",
+                                       (sourcePath, stat.st_mtime, stat.st_size)).fetchone()
+        if current is None or not os.path.exists(levelPath):
+            return None
+        return NiftiVolume(np.load(levelPath, mmap_mode="r"), np.array(json.loads(row[1])), sourcePath)
+
+    def _addLevels(self, contentHash, levels) -> None:
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO levels VALUES (?, ?, ?, ?)",
+                                 [(contentHash, level, nbytes, json.dumps(ijkToRas)) for level, nbytes, ijkToRas in levels])
+
+    def windowPresets(self, contentHash):
+        """Cached ``[name, window, level]`` presets of a volume, or None if they were not computed yet."""
+        with self._lock:
+            row = self._db.execute("SELECT presets FROM presets WHERE hash=?", (contentHash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def putWindowPresets(self, contentHash, presets) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO presets VALUES (?, ?)", (contentHash, json.dumps(presets)))
+
+    def foregroundBox(self, contentHash):
+        """Cached foreground box ``[[start, stop], ...]`` of a volume, or None if it was not computed yet."""
+        with self._lock:
+            row = self._db.execute("SELECT box FROM boxes WHERE hash=?", (contentHash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def putForegroundBox(self, contentHash, box) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO boxes VALUES (?, ?)", (contentHash, json.dumps(box)))
+
+    def totalBytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT (SELECT COALESCE(SUM(nbytes), 0) FROM entries) + "
+                                    "(SELECT COALESCE(SUM(nbytes), 0) FROM levels)").fetchone()[0]
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits ``maxBytes``. Returns the number of removed entries."""
+        excess = self.totalBytes() - self.maxBytes
+        if excess <= 0:
+            return 0
+        removed = []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hash, nbytes + (SELECT COALESCE(SUM(nbytes), 0) FROM levels WHERE levels.hash = entries.hash) "
+                "FROM entries ORDER BY lastUsed").fetchall()
+            for contentHash, nbytes in rows:
+                if excess <= 0:
+                    break
+                removed.append(contentHash)
+                excess -= nbytes
+            levelFiles = self._db.execute(
+                f"SELECT hash, level FROM levels WHERE hash IN ({','.join('?' * len(removed))})", removed).fetchall()
+            with self._db:
+                self._db.executemany("DELETE FROM entries WHERE hash=?", [(h,) for h in removed])
+                self._db.executemany("DELETE FROM levels WHERE hash=?", [(h,) for h in removed])
+        paths = [_entryPath(self.cacheDir, h) for h in removed] + [_levelPath(self.cacheDir, h, level) for h, level in levelFiles]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                # Still memory-mapped on Windows, or already gone
+                logging.debug(f"Could not remove cache file {path}: {e}")
+        logging.info(f"Evicted {len(removed)} volumes from cache {self.cacheDir}")
+        return len(removed)
+
+    def warmUp(self, sourcePaths, maxWorkers=None, progress=None, pyramidLevels=0) -> int:
+        """Decode all given source files into the cache in parallel across processes, and compute their window presets
+        and foreground boxes.
+        :param progress: optional callable ``progress(done, total)``
+        :param pyramidLevels: number of downsampled preview levels to build for each volume
+        :return: number of volumes that were cached successfully
+        """
+        sourcePaths = [os.path.abspath(path) for path in sourcePaths]
+        done = 0
+        cached = 0
+        with processPool(maxWorkers) as executor:
+            futures = {executor.submit(_warmUpSource, path, self.cacheDir, pyramidLevels): path for path in sourcePaths}
+            for future in as_completed(futures):
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.warning(f"Failed to cache {futures[future]}: {e}")
+                else:
+                    with self._lock, self._db:
+                        self._db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                                         (result["sourcePath"], result["mtime"], result["size"], result["hash"]))
+                    self._addEntry(result["hash"], result["nbytes"], result["ijkToRas"])
+                    self._addLevels(result["hash"], result["levels"])
+                    self.putWindowPresets(result["hash"], result["presets"])
+                    self.putForegroundBox(result["hash"], result["box"])
+                    cached += 1
+                if progress:
+                    progress(done, len(sourcePaths))
+        self.evict()
+        return cached
+
+    def statistics(self) -> dict:
+        nbytes = self.totalBytes()
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "totalBytes": nbytes,
+                    "maxBytes": self.maxBytes}
+
+
+def main(argv=None) -> None:
+    from .Worklist import findCases
+
+    parser = argparse.ArgumentParser(description="Fill the decompressed volume cache for all NIfTI files of a dataset.")
+    parser.add_argument("datasetRoot")
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--max-gb", type=float, default=DEFAULT_CACHE_SIZE / 1024 ** 3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pyramid-levels", type=int, default=0, help="downsampled preview levels to build per volume")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    cache = VolumeCache(args.cache_dir, int(args.max_gb * 1024 ** 3))
+    sourcePaths = findCases(args.datasetRoot)
+    startTime = time.time()
+    cached = cache.warmUp(sourcePaths, args.workers,
+                          progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True),
+                          pyramidLevels=args.pyramid_levels)
+    print()
+    logging.info(f"Cached {cached} of {len(sourcePaths)} volumes in {time.time() - startTime:.1f} seconds")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Memory-bounded pool of loaded volume nodes.
+
+Keeps recently rated cases in the scene so that going back to them does not
+reload anything from disk, and evicts the least recently used ones once the
+voxel memory of all pooled nodes exceeds a byte budget.
+"""
+
+import logging
+from collections import OrderedDict
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+
+class VolumeNodePool:
+    """LRU cache of volume nodes keyed by source path, bounded by resident bytes.
+
+    The pool does not depend on the MRML scene directly: ``removeNode`` is called for
+    every evicted node, and ``isValid`` tells whether a pooled node is still usable
+    (e.g. it was not deleted by the user or by a scene close).
+    """
+
+    def __init__(self, memoryBudget=DEFAULT_MEMORY_BUDGET, removeNode=None, isValid=None) -> None:
+        self.memoryBudget = memoryBudget
+        self._removeNode = removeNode
+        self._isValid = isValid
+        self._entries = OrderedDict()  # key -> (node, nbytes)
+        self.residentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and self._valid(entry[0])
+
+    def _valid(self, node) -> bool:
+        return self._isValid is None or self._isValid(node)
+
+    def get(self, key):
+        """Return the pooled node for ``key`` and mark it most recently used, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None and not self._valid(entry[0]):
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def add(self, key, node, nbytes: int) -> None:
+        """Add a node as most recently used and evict older nodes that no longer fit the budget."""
+        if key in self._entries:
+            self._discard(key, remove=self._entries[key][0] is not node)
+        self._entries[key] = (node, nbytes)
+        self.residentBytes += nbytes
+        self.evict()
+
+    def evict(self) -> None:
+        """Evict least recently used nodes until the budget is met. The most recent node is always kept."""
+        while self.residentBytes > self.memoryBudget and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            logging.debug(f"Evicting volume {key} from node pool")
+            self._discard(key, remove=True)
+            self.evictions += 1
+
+    def setMemoryBudget(self, memoryBudget: int) -> None:
+        self.memoryBudget = memoryBudget
+        self.evict()
+
+    def clear(self, remove=False) -> None:
+        for key in list(self._entries):
+            self._discard(key, remove=remove)
+
+    def _discard(self, key, remove=False) -> None:
+        node, nbytes = self._entries.pop(key)
+        self.residentBytes -= nbytes
+        if remove and self._removeNode is not None and self._valid(node):
+            self._removeNode(node)
+
+    def statistics(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "nodes": len(self._entries),
+            "residentBytes": self.residentBytes,
+            "memoryBudget": self.memoryBudget,
+        }
@@ -0,0 +1,89 @@
+"""
+Window/level presets suggested from the voxel histogram of a volume.
+
+A fixed brain window is wrong for bone, subdural or non-CT studies. The
+intensity histogram of a volume is computed in one vectorized pass (over a
+strided subsample of large volumes) and turned into a short list of presets:
+the standard CT windows if the volume looks like a CT in Hounsfield units,
+followed by an automatic window between percentiles of the foreground
+intensities. Presets are a few numbers per volume, so they are computed once
+on the prefetch threads or during cache warm-up and cached by content hash;
+switching between them only sets the window and level of the display node.
+"""
+
+import numpy as np
+
+# (name, window, level) of the CT windows, in Hounsfield units
+CT_PRESETS = (
+    ("brain", 60.0, 40.0),
+    ("subdural", 200.0, 75.0),
+    ("bone", 2000.0, 500.0),
+)
+AUTO_PRESET = "auto"
+PRESET_NAMES = tuple(name for name, _, _ in CT_PRESETS) + (AUTO_PRESET,)
+AUTO_PERCENTILES = (0.005, 0.995)
+HISTOGRAM_BINS = 4096
+MAX_HISTOGRAM_SAMPLES = 4 * 1024 ** 2
+# Voxels below this are air or padding and are left out of the automatic window of a CT
+CT_FOREGROUND_MIN = -500.0
+
+
+def sampleStep(array: np.ndarray, maxSamples=MAX_HISTOGRAM_SAMPLES) -> int:
+    """Stride along every axis that leaves at most about ``maxSamples`` voxels."""
+    return max(1, int(np.ceil((array.size / maxSamples) ** (1.0 / array.ndim)))) if array.size else 1
+
+
+def sampleVoxels(array: np.ndarray, maxSamples=MAX_HISTOGRAM_SAMPLES) -> np.ndarray:
+    """Strided view of a ``[k, j, i]`` array with at most about ``maxSamples`` voxels; nothing is copied."""
+    return array[(slice(None, None, sampleStep(array, maxSamples)),) * array.ndim]
+
+
+def intensityHistogram(array: np.ndarray, bins=HISTOGRAM_BINS):
+    """``(counts, edges)`` of the voxel intensities; non-finite values are ignored.
+    Integer volumes whose range fits in ``bins`` get one bin per value."""
+    samples = sampleVoxels(array).ravel()
+    if not np.issubdtype(samples.dtype, np.integer):
+        samples = samples[np.isfinite(samples)]
+    if samples.size == 0:
+        return np.zeros(1, dtype=np.int64), np.array([0.0, 1.0])
+    low, high = samples.min(), samples.max()
+    if np.issubdtype(samples.dtype, np.integer) and int(high) - int(low) < bins:
+        counts = np.bincount(samples.astype(np.int64) - int(low), minlength=int(high) - int(low) + 1)
+        edges = np.arange(int(low), int(high) + 2, dtype=np.float64) - 0.5
+        return counts, edges
+    return np.histogram(samples, bins=bins, range=(float(low), float(high) if high > low else float(low) + 1.0))
+
+
+def histogramPercentiles(counts: np.ndarray, edges: np.ndarray, fractions) -> np.ndarray:
+    """Intensities (bin centers) below which the given fractions of the counted voxels lie."""
+    cumulative = np.cumsum(counts)
+    indices = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1], side="left")
+    indices = np.minimum(indices, len(counts) - 1)
+    return (edges[indices] + edges[indices + 1]) / 2.0
+
+
+def looksLikeCT(counts: np.ndarray, edges: np.ndarray) -> bool:
+    """True if the intensities are Hounsfield units: at least 1% of the voxels are air (about -1000)."""
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    air = counts[(centers >= -1100.0) & (centers <= -900.0)].sum()
+    return counts.sum() > 0 and air >= 0.01 * counts.sum()
+
+
+def windowPresets(array: np.ndarray, percentiles=AUTO_PERCENTILES) -> list:
+    """Suggested ``[name, window, level]`` presets of a volume: the CT windows for CT volumes, and an
+    automatic window between the ``percentiles`` of the foreground intensities for every volume."""
+    counts, edges = intensityHistogram(array)
+    presets = []
+    foreground = counts.copy()
+    if looksLikeCT(counts, edges):
+        presets = [list(preset) for preset in CT_PRESETS]
+        foreground[edges[1:] <= CT_FOREGROUND_MIN] = 0
+    else:
+        # The lowest bin holds the background outside the body
+        foreground[0] = 0
+    if foreground.sum() == 0:
+        foreground = counts
+    low, high = histogramPercentiles(foreground, edges, percentiles)
+    window = max(float(high - low), 1.0)
+    presets.append([AUTO_PRESET, round(window, 2), round(float(high + low) / 2.0, 2)])
+    return presets
@@ -0,0 +1,116 @@
+"""
+Case worklist and background prefetch.
+
+A case is one NIfTI volume plus the ``reports.json`` stored next to it. The
+worklist walks all cases below a dataset root in a stable order, and the
+prefetcher decodes the next few cases on a thread pool so that moving to the
+next case only has to hand an already decoded array to the MRML scene.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .NiftiIO import isNiftiFile, readNifti
+from .Reports import readReportsFile
+
+
+def findCases(rootPath):
+    """Return the sorted list of NIfTI files below ``rootPath``."""
+    cases = []
+    for dirPath, dirNames, fileNames in os.walk(rootPath):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            if isNiftiFile(fileName):
+                cases.append(os.path.join(dirPath, fileName))
+    return cases
+
+
+class LoadedCase:
+    """Decoded volume and reports of one case, or the error that prevented decoding it."""
+
+    def __init__(self, imagePath, volume=None, reports=None, error=None) -> None:
+        self.imagePath = imagePath
+        self.volume = volume
+        self.reports = reports
+        self.error = error
+
+
+def decodeCase(imagePath, readVolume=readNifti, readReports=readReportsFile) -> LoadedCase:
+    """Decode a case. Errors are captured in the result so that they surface when the case is shown."""
+    try:
+        volume = readVolume(imagePath)
+        reports = readReports(imagePath)
+    except Exception as e:
+        logging.warning(f"Failed to prefetch {imagePath}: {e}")
+        return LoadedCase(imagePath, error=e)
+    return LoadedCase(imagePath, volume, reports)
+
+
+class CaseWorklist:
+    """Ordered list of cases with a cursor."""
+
+    def __init__(self, rootPath, cases=None) -> None:
+        self.rootPath = rootPath
+        self.cases = findCases(rootPath) if cases is None else list(cases)
+        self.currentIndex = -1
+
+    def __len__(self) -> int:
+        return len(self.cases)
+
+    def caseId(self, index) -> str:
+        return os.path.relpath(self.cases[index], self.rootPath).replace(os.sep, "/")
+
+
+class CasePrefetcher:
+    """Decode upcoming cases of a worklist on a thread pool.
+
+    Only cases in the window ``[index, index + depth]`` are kept, so memory use is
+    bounded by ``depth + 1`` decoded volumes. Cases for which ``skip(imagePath)``
+    returns True (e.g. still loaded in the scene) are not decoded. Volumes are read
+    with ``readVolume``, e.g. through a ``VolumeCache``, and reports with ``readReports``.
+    """
+
+    def __init__(self, worklist: CaseWorklist, depth=3, maxWorkers=None, skip=None,
+                 readVolume=readNifti, readReports=readReportsFile) -> None:
+        self.worklist = worklist
+        self.depth = depth
+        self.skip = skip
+        self.readVolume = readVolume
+        self.readReports = readReports
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers or max(1, min(depth, os.cpu_count() or 1)),
+                                            thread_name_prefix="showImageReportsPrefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, index) -> None:
+        """Schedule decoding of the cases ``index .. index + depth`` and drop everything outside the window."""
+        last = min(len(self.worklist), index + self.depth + 1)
+        with self._lock:
+            for stale in [i for i in self._futures if i < index or i >= last]:
+                self._futures.pop(stale).cancel()
+            for i in range(max(0, index), last):
+                if i not in self._futures and not (self.skip and self.skip(self.worklist.cases[i])):
+                    self._futures[i] = self._executor.submit(decodeCase, self.worklist.cases[i], self.readVolume, self.readReports)
+
+    def isReady(self, index) -> bool:
+        """True if the case has been decoded (or failed) and ``get`` would not block."""
+        with self._lock:
+            future = self._futures.get(index)
+        return future is not None and future.done()
+
+    def get(self, index) -> LoadedCase:
+        """Return the decoded case, waiting for it if it is still in flight."""
+        with self._lock:
+            future = self._futures.get(index)
+        if future is None:
+            return decodeCase(self.worklist.cases[index], self.readVolume, self.readReports)
+        return future.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,9 @@
+from .NiftiIO import NiftiHeader, NiftiVolume, isNiftiFile, readNifti, readNiftiHeader
+from .Worklist import CasePrefetcher, CaseWorklist, LoadedCase, decodeCase, findCases
+from .VolumePool import VolumeNodePool
+from .VolumeCache import VolumeCache
+from .Ingest import DatasetManifest, validateCase
+from .ScoreStore import ScoreStore
+from .Scores import CRITERIA, MODELS, UNRATED, ScoreGrid, parseScore, scoresFromLegacy, scoresToLegacy
+from .Reports import DEFAULT_REPORT_COLUMNS, ReportCorpora, ReportCorpus, loadReportColumns, readReportsFile, reportTexts
+from .Timing import PhaseTimings